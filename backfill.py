@@ -0,0 +1,282 @@
+"""
+Resumable backfill of archived forecasts and TMY rows over a date range and a list of sites.
+
+Every site and day is one unit. A unit reads the fmi open inputs of the day, runs the pipeline and
+- archives the result as a "fmi_output" run of the day start, see helpers/forecast_archive.py
+- appends the weather rows of the day to the TMY files of the site, see helpers/tmy_writer.py
+Inputs are read from recorded WFS responses or archived frames with --source archive (see helpers/wfs_replay.py), or
+fetched from the fmi open service with --source fmiopen.
+
+Units are computed in config.backfill_processes worker processes, at most config.backfill_pending_units units are in
+flight at a time. Results are written by the main process in day order and each written unit is appended to the
+checkpoint file config.backfill_checkpoint_file. An interrupted backfill started again with the same sites and dates
+skips the recorded units and continues where it stopped, --restart empties the checkpoint. Progress and throughput in
+site-days per second are printed every config.backfill_report_interval seconds.
+
+The checkpoint file has one json line per unit, recording a unit costs the same however long the backfill is
+    {"site": site name, "day": "YYYY-MM-DD", "targets": [written targets]}
+    {"site": site name, "day": "YYYY-MM-DD", "error": message}
+Lines are folded in file order when the checkpoint is loaded, an error line is tried again on the next run and a line
+cut off by an interrupted write is ignored. A unit is pending while any requested target of it is not recorded as
+written, only the missing targets are written.
+
+Example:
+python backfill.py --sites helsinki kuopio --start 2024-01-01 --end 2024-06-30
+python backfill.py --sites helsinki --start 2024-06-01 --end 2024-06-30 --source fmiopen --targets tmy
+"""
+
+import argparse
+import collections
+import datetime
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import config
+from helpers import forecast_archive
+from helpers import result_cache
+from helpers import site_parameters
+from helpers import solar_irradiance_estimator
+from helpers import tmy_writer
+from helpers import wfs_replay
+
+DAY_FORMAT = "%Y-%m-%d"
+TARGETS = ["forecasts", "tmy"]
+
+
+def backfill_unit(site, day, source):
+    """
+    Reads the inputs of a day and runs the pipeline. Used as a worker process task, nothing is written.
+    :param site: Dictionary of site parameters
+    :param day: Datetime, start of the day
+    :param source: "archive" or "fmiopen"
+    :return: Tuple ("ok", pipeline output dataframe) or ("error", message)
+    """
+    try:
+        if source == "fmiopen":
+            data = solar_irradiance_estimator.get_solar_irradiance(day, day_count=1, model="fmiopen", site=site)
+        else:
+            data = wfs_replay.load_replay_frame(day, day + datetime.timedelta(days=1, minutes=-1), site["site_name"],
+                                                latitude=site["latitude"], longitude=site["longitude"])
+        if data is None or len(data) == 0:
+            return "error", "no fmi open data"
+        return "ok", result_cache.process_irradiance(data, site)
+    except Exception as e:
+        return "error", type(e).__name__ + ": " + str(e)
+
+
+def write_unit(site, day, data, targets):
+    """
+    Writes the results of a unit.
+    :param targets: List of "forecasts" and "tmy"
+    :return: Number of appended TMY rows
+    """
+    if "forecasts" in targets:
+        forecast_archive.archive_frame(data, "fmi_output", site["site_name"], run_time=day)
+    if "tmy" in targets:
+        return sum(tmy_writer.append_frame(data[tmy_writer.INPUT_COLUMNS], site).values())
+    return 0
+
+
+def load_checkpoint(path=None):
+    """
+    Folds the lines of a checkpoint file.
+    :param path: Checkpoint file, config.backfill_checkpoint_file by default
+    :return: Checkpoint dictionary {"sites": {site name: {"done_days": {target: set of days}, "failed": {day: error}}}},
+    empty if the file does not exist
+    """
+    if path is None:
+        path = config.backfill_checkpoint_file
+    checkpoint = {"sites": {}}
+    if not os.path.exists(path):
+        return checkpoint
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # last line of an interrupted backfill
+                continue
+            fold_record(checkpoint, record)
+    return checkpoint
+
+
+def fold_record(checkpoint, record):
+    """
+    Applies one checkpoint line to a checkpoint dictionary.
+    """
+    entry = checkpoint["sites"].setdefault(record["site"], {"done_days": {}, "failed": {}})
+    if "error" in record:
+        entry["failed"][record["day"]] = record["error"]
+        return
+    for target in record["targets"]:
+        entry["done_days"].setdefault(target, set()).add(record["day"])
+    entry["failed"].pop(record["day"], None)
+
+
+def open_checkpoint(path=None, restart=False):
+    """
+    Opens a checkpoint file for appending lines.
+    :param restart: True empties the file
+    :return: File object
+    """
+    if path is None:
+        path = config.backfill_checkpoint_file
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    if restart:
+        return open(path, "w")
+
+    ended = True
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        with open(path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            ended = f.read(1) == b"\n"
+    f = open(path, "a")
+    # a line cut off by an interrupted write is ended, the next line starts on its own
+    if not ended:
+        f.write("\n")
+    return f
+
+
+def pending_units(checkpoint, site_names, date_start, date_end, targets=None):
+    """
+    Units with a target which is not recorded as done, in day order and site order within a day.
+    :param targets: List of "forecasts" and "tmy", both by default
+    :return: List of (site name, day) tuples
+    """
+    if targets is None:
+        targets = TARGETS
+    units = []
+    day = date_start
+    while day <= date_end:
+        units.extend((name, day) for name in site_names if missing_targets(checkpoint, name, day, targets))
+        day += datetime.timedelta(days=1)
+    return units
+
+
+def missing_targets(checkpoint, site_name, day, targets):
+    """
+    :return: List of the targets which are not recorded as done for the site and day
+    """
+    done_days = checkpoint["sites"].get(site_name, {}).get("done_days", {})
+    return [target for target in targets if day.strftime(DAY_FORMAT) not in done_days.get(target, [])]
+
+
+def run_backfill(site_names, date_start, date_end, source="archive", targets=None, processes=None,
+                 checkpoint_path=None, restart=False):
+    """
+    Backfills all units of a date range which are not in the checkpoint yet.
+    :param site_names: List of site names
+    :param date_start: First day
+    :param date_end: Last day, included
+    :param source: "archive" or "fmiopen"
+    :param targets: List of "forecasts" and "tmy", both by default
+    :param processes: Worker process count, config.backfill_processes by default. 1 runs units in this process.
+    :param checkpoint_path: Checkpoint file, config.backfill_checkpoint_file by default
+    :param restart: True empties the checkpoint and backfills every unit
+    :return: Summary dictionary with units, written, failed, seconds and site_days_per_second
+    """
+    if targets is None:
+        targets = TARGETS
+    if processes is None:
+        processes = config.backfill_processes
+
+    sites = {}
+    for name in site_names:
+        site = site_parameters.get_site(name)
+        if site is not None:
+            sites[name] = site
+
+    checkpoint = {"sites": {}} if restart else load_checkpoint(checkpoint_path)
+    units = pending_units(checkpoint, list(sites), date_start, date_end, targets)
+    skipped = len(sites) * ((date_end - date_start).days + 1) - len(units)
+    print("Backfilling " + str(len(units)) + " site-days from " + source + ", " + str(skipped)
+          + " already done according to the checkpoint")
+
+    summary = {"units": len(units), "written": 0, "failed": 0}
+    started = time.monotonic()
+    reported = started
+
+    with open_checkpoint(checkpoint_path, restart) as checkpoint_file:
+        for (name, day), (status, value) in __results(units, sites, source, processes):
+            record = {"site": name, "day": day.strftime(DAY_FORMAT)}
+            if status == "ok":
+                record["targets"] = missing_targets(checkpoint, name, day, targets)
+                write_unit(sites[name], day, value, record["targets"])
+                summary["written"] += 1
+            else:
+                record["error"] = value
+                summary["failed"] += 1
+            fold_record(checkpoint, record)
+            checkpoint_file.write(json.dumps(record) + "\n")
+            checkpoint_file.flush()
+
+            if time.monotonic() - reported >= config.backfill_report_interval:
+                reported = time.monotonic()
+                __print_progress(summary, reported - started)
+
+    elapsed = time.monotonic() - started
+    summary["seconds"] = round(elapsed, 2)
+    summary["site_days_per_second"] = round((summary["written"] + summary["failed"]) / elapsed, 2) if elapsed else 0.0
+    __print_progress(summary, elapsed)
+    return summary
+
+
+def __results(units, sites, source, processes):
+    """
+    Generator of (unit, result) in unit order. Units are computed in parallel, only a limited number of them is read
+    ahead.
+    """
+    if processes == 1:
+        for name, day in units:
+            yield (name, day), backfill_unit(sites[name], day, source)
+        return
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        pending = collections.deque()
+        for name, day in units:
+            pending.append(((name, day), executor.submit(backfill_unit, sites[name], day, source)))
+
+            # waiting for the oldest unit before submitting more keeps memory use bounded
+            if len(pending) >= config.backfill_pending_units:
+                unit, future = pending.popleft()
+                yield unit, future.result()
+
+        while pending:
+            unit, future = pending.popleft()
+            yield unit, future.result()
+
+
+def __print_progress(summary, elapsed):
+    completed = summary["written"] + summary["failed"]
+    rate = completed / elapsed if elapsed > 0 else 0.0
+    remaining = (summary["units"] - completed) / rate if rate > 0 else 0.0
+    print(str(completed) + "/" + str(summary["units"]) + " site-days, " + str(summary["failed"]) + " failed, "
+          + "{:.2f}".format(rate) + " site-days/s, " + "{:.0f}".format(remaining) + " s remaining")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill archived forecasts and TMY rows over a date range.")
+    parser.add_argument("--sites", nargs="+", default=None, help="site names, config.scheduler_sites by default")
+    parser.add_argument("--start", required=True, help="first day, YYYY-MM-DD")
+    parser.add_argument("--end", required=True, help="last day, YYYY-MM-DD")
+    parser.add_argument("--source", default="archive", choices=["archive", "fmiopen"],
+                        help="recorded or archived fmi open data, or the fmi open service")
+    parser.add_argument("--targets", nargs="+", default=TARGETS, choices=TARGETS, help="what is written")
+    parser.add_argument("--processes", type=int, default=config.backfill_processes, help="worker process count")
+    parser.add_argument("--checkpoint", default=config.backfill_checkpoint_file, help="checkpoint file")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and backfill every day")
+    args = parser.parse_args()
+
+    try:
+        run_backfill(config.scheduler_sites if args.sites is None else args.sites,
+                     datetime.datetime.strptime(args.start, DAY_FORMAT),
+                     datetime.datetime.strptime(args.end, DAY_FORMAT), args.source, args.targets, args.processes,
+                     args.checkpoint, args.restart)
+    except KeyboardInterrupt:
+        print("Backfill interrupted, run the same command again to continue")
+
+
+if __name__ == "__main__":
+    main()
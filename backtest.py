@@ -0,0 +1,316 @@
+"""
+Backtesting of fmi open based forecasts against measured production.
+
+Runs the vectorized pipeline for every day of a date range with archived fmi open inputs: archived frames from
+config.archive_directory by default, or recorded WFS responses from config.replay_directory with --source replay.
+Days are processed in parallel chunks. Forecasts and the clear sky reference are compared to hourly averages of
+measured production from real_production_data. Pipeline results are memoized, see helpers/result_cache.py, with
+config.result_cache_on_disk a rerun with unchanged config reuses the results of earlier runs.
+
+Reported metrics, computed over daylight hours (clear sky output above zero):
+MAE     mean absolute error, W
+RMSE    root mean square error, W
+bias    mean of forecast - measured, W
+skill   1 - RMSE / RMSE of clear sky reference. 0 means no better than clear sky, 1 is a perfect forecast
+Metrics are given for all days and separately for clear, mixed and cloudy days of the local calendar, see
+config.backtest_clear_day_index.
+
+Example:
+python backtest.py --site helsinki --start 2023-06-01 --end 2023-08-31
+"""
+
+import argparse
+import datetime
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+import pandas
+
+import config
+from helpers import astronomical_calculations
+from helpers import clearsky_cache
+from helpers import energy_aggregation
+from helpers import forecast_archive
+from helpers import production_data_store
+from helpers import real_production_data
+from helpers import result_cache
+from helpers import site_parameters
+from helpers import time_conversions
+from helpers import wfs_replay
+
+NANOSECONDS_PER_HOUR = 3600 * 1_000_000_000
+NANOSECONDS_PER_DAY = 24 * NANOSECONDS_PER_HOUR
+
+# day classes used in the report, order matches class numbers
+DAY_CLASSES = ["clear", "mixed", "cloudy"]
+
+
+def backtest_frame(data, site):
+    """
+    Runs the pipeline and the clear sky reference for a frame of fmi open inputs. Used as a worker process task.
+    :param data: Dataframe in the format of _meps_data_loader.collect_fmi_opendata()
+    :param site: Dictionary of site parameters
+    :return: Tuple of arrays (time in int64 ns, forecast output, clear sky output)
+    """
+    if len(data) == 0:
+        empty = numpy.empty(0)
+        return empty.astype(numpy.int64), empty, empty
+
+    # solar geometry is shared by the forecast and the clear sky reference which use the same timestamps
+    geometry = astronomical_calculations.get_solar_geometry(data["time"], site["latitude"], site["longitude"])
+    forecast = result_cache.process_irradiance(data, site, geometry)
+
+    solar_position = geometry.assign(apparent_elevation=90 - geometry["apparent_zenith"])
+    turbidity = clearsky_cache.linke_turbidity(geometry.index, site["latitude"], site["longitude"])
+    clearsky = clearsky_cache.get_location(site["latitude"], site["longitude"]).get_clearsky(
+        geometry.index, solar_position=solar_position, linke_turbidity=turbidity)
+    clearsky.insert(loc=0, column="time", value=clearsky.index)
+    clearsky = result_cache.process_irradiance(clearsky, site, geometry)
+
+    return (time_conversions.to_utc_ns(forecast["time"]), forecast["output"].to_numpy(dtype=float),
+            clearsky["output"].to_numpy(dtype=float))
+
+
+def backtest_replayed_days(days, site):
+    """
+    Same as backtest_frame(), inputs are parsed from recorded WFS responses. Used as a worker process task.
+    :param days: List of datetimes, each one is the start of a simulated day
+    :param site: Dictionary of site parameters
+    """
+    frames = [data for data in wfs_replay.load_replay_days(days, site["site_name"], latitude=site["latitude"],
+                                                           longitude=site["longitude"]) if data is not None]
+    if not frames:
+        return backtest_frame(pandas.DataFrame(), site)
+    return backtest_frame(pandas.concat(frames), site)
+
+
+def load_archived_inputs(site, date_start, date_end):
+    """
+    Reads archived fmi open frames for a date range. For every day only runs which were available at the start of the
+    day are used, the latest of them for each hour. This matches a forecast made at midnight for the coming day.
+    :return: Dataframe with time column at hourly interval centers, empty if nothing is archived
+    """
+    half_hour = datetime.timedelta(minutes=30)
+    data = forecast_archive.read_archive("fmi", site=site["site_name"], start=date_start - half_hour,
+                                         end=date_end + datetime.timedelta(days=1, minutes=-1) - half_hour,
+                                         run_end=date_end + datetime.timedelta(days=1))
+    if len(data) == 0:
+        return data
+
+    # rows are sorted by time and run time, dropping runs made after the start of the forecast day
+    times = time_conversions.to_utc_ns(data["time"])
+    runs = time_conversions.to_utc_ns(data["run_time"])
+    day_start = __forecast_day(times) * NANOSECONDS_PER_DAY
+    available = runs <= day_start
+
+    # latest available run of each hour is the last available row of each group of equal timestamps
+    data = data[available]
+    times = times[available]
+    keep = numpy.ones(len(times), dtype=bool)
+    keep[:-1] = times[1:] != times[:-1]
+
+    return data[keep].drop("run_time", axis=1).reset_index(drop=True)
+
+
+def run_backtest(site, date_start, date_end, production_store, source="archive", processes=None, chunk_days=14,
+                 production_scale=1.0):
+    """
+    Runs a backtest over a date range.
+    :param site: Dictionary of site parameters
+    :param date_start: First day
+    :param date_end: Last day, included
+    :param production_store: production_data_store.ProductionStore with measured production of the site
+    :param source: "archive" reads archived fmi frames, "replay" parses recorded WFS responses
+    :param processes: Worker process count, cpu count by default
+    :param chunk_days: Number of days processed by one worker task
+    :param production_scale: Multiplier which converts measured power to W, 1000 if measurements are in kW
+    :return: Report dictionary, None if no inputs were found
+    """
+    if processes is None:
+        processes = os.cpu_count() or 1
+
+    days = list(pandas.date_range(date_start, date_end, freq="D").to_pydatetime())
+    day_chunks = [days[i:i + chunk_days] for i in range(0, len(days), chunk_days)]
+
+    if source == "replay":
+        task = backtest_replayed_days
+        chunks = day_chunks
+    else:
+        # archived inputs are read once, chunks are split by day boundaries
+        task = backtest_frame
+        data = load_archived_inputs(site, date_start, date_end)
+        times = time_conversions.to_utc_ns(data["time"]) + NANOSECONDS_PER_HOUR // 2
+        boundaries = numpy.searchsorted(times, time_conversions.to_utc_ns([chunk[0] for chunk in day_chunks[1:]]))
+        chunks = [data.iloc[first:last] for first, last in zip(numpy.concatenate(([0], boundaries)),
+                                                               numpy.concatenate((boundaries, [len(data)])))]
+
+    if processes == 1:
+        results = [task(chunk, site) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = list(executor.map(task, chunks, [site] * len(chunks)))
+
+    times = numpy.concatenate([result[0] for result in results])
+    forecast = numpy.concatenate([result[1] for result in results])
+    clearsky = numpy.concatenate([result[2] for result in results])
+
+    if len(times) == 0:
+        print("Error: no archived fmi open data found for " + str(date_start) + " - " + str(date_end))
+        return None
+
+    # overlapping responses can repeat hours, keeping the first occurrence of each timestamp
+    times, first = numpy.unique(times, return_index=True)
+    forecast = forecast[first]
+    clearsky = clearsky[first]
+
+    measured = hourly_measured_power(production_store, times) * production_scale
+
+    # daylight hours with both forecast and measurement
+    valid = (clearsky > 0) & ~numpy.isnan(measured) & ~numpy.isnan(forecast)
+    local_days, local_day_starts = energy_aggregation.period_index(times, "day")
+    day_classes = classify_days(local_days, measured, clearsky, valid)
+
+    report = {"site": site["site_name"],
+              "start": str(date_start.date()),
+              "end": str(date_end.date()),
+              "source": source,
+              "days_requested": len(days),
+              "days_with_forecast": int(len(numpy.unique(__forecast_day(times)))),
+              "all": compute_metrics(forecast[valid], measured[valid], clearsky[valid])}
+
+    for number, name in enumerate(DAY_CLASSES):
+        selection = valid & (day_classes == number)
+        report[name] = compute_metrics(forecast[selection], measured[selection], clearsky[selection])
+        report[name]["days"] = int(len(numpy.unique(local_days[selection])))
+
+    return report
+
+
+def hourly_measured_power(production_store, times):
+    """
+    Averages measured power over the hour centered at each forecast timestamp.
+    :param production_store: production_data_store.ProductionStore
+    :param times: Sorted int64 nanosecond array of hour centers
+    :return: float array, nan for hours without measurements
+    """
+    half_hour = NANOSECONDS_PER_HOUR // 2
+    measured_times, power = production_store.query_arrays(time_conversions.from_utc_ns([times[0] - half_hour])[0],
+                                                          time_conversions.from_utc_ns([times[-1] + half_hour])[0])
+
+    # hour which each measurement belongs to, measurements falling into gaps of the forecast are dropped
+    hour = numpy.searchsorted(times - half_hour, measured_times, side="right") - 1
+    inside = (hour >= 0) & (measured_times < times[numpy.clip(hour, 0, None)] + half_hour)
+
+    sums = numpy.bincount(hour[inside], weights=power[inside], minlength=len(times))
+    counts = numpy.bincount(hour[inside], minlength=len(times))
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        return numpy.where(counts > 0, sums / counts, numpy.nan)
+
+
+def classify_days(local_days, measured, clearsky, valid):
+    """
+    Classifies each hour by the clear sky index of its local calendar day, measured energy divided by clear sky energy.
+    :param local_days: Day numbers from energy_aggregation.period_index()
+    :return: int array of class numbers, see DAY_CLASSES
+    """
+    day_count = local_days.max() + 1
+    measured_energy = numpy.bincount(local_days[valid], weights=measured[valid], minlength=day_count)
+    clearsky_energy = numpy.bincount(local_days[valid], weights=clearsky[valid], minlength=day_count)
+
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        clear_sky_index = (measured_energy / clearsky_energy)[local_days]
+
+    return numpy.where(clear_sky_index >= config.backtest_clear_day_index, 0,
+                       numpy.where(clear_sky_index < config.backtest_cloudy_day_index, 2, 1))
+
+
+def compute_metrics(forecast, measured, reference):
+    """
+    Error metrics of a forecast and a reference forecast against measurements.
+    :return: Dictionary with hours, mae, rmse, bias, skill and energy totals in kWh
+    """
+    if len(forecast) == 0:
+        return {"hours": 0, "mae": None, "rmse": None, "bias": None, "skill": None}
+
+    error = forecast - measured
+    rmse = float(numpy.sqrt(numpy.mean(error ** 2)))
+    reference_rmse = float(numpy.sqrt(numpy.mean((reference - measured) ** 2)))
+
+    return {"hours": int(len(error)),
+            "mae": float(numpy.mean(numpy.abs(error))),
+            "rmse": rmse,
+            "bias": float(numpy.mean(error)),
+            "skill": 1 - rmse / reference_rmse if reference_rmse > 0 else None,
+            "forecast_kwh": float(numpy.sum(forecast) / 1000),
+            "measured_kwh": float(numpy.sum(measured) / 1000),
+            "clearsky_kwh": float(numpy.sum(reference) / 1000)}
+
+
+def __forecast_day(times):
+    """
+    Day numbers of hour centers. Hours belong to the day of their end time, same as in fmi open day selection.
+    """
+    return (times + NANOSECONDS_PER_HOUR // 2) // NANOSECONDS_PER_DAY
+
+
+def print_report(report):
+    print("Backtest \"" + report["site"] + "\" " + report["start"] + " - " + report["end"] + ", "
+          + str(report["days_with_forecast"]) + "/" + str(report["days_requested"]) + " days with forecast data")
+    print("{:<8}{:>6}{:>7}{:>10}{:>10}{:>10}{:>8}".format("days", "count", "hours", "MAE(W)", "RMSE(W)", "bias(W)",
+                                                          "skill"))
+    for name in ["all"] + DAY_CLASSES:
+        metrics = report[name]
+        if metrics["hours"] == 0:
+            print("{:<8}{:>6}{:>7}".format(name, metrics.get("days", report["days_with_forecast"]), 0))
+            continue
+        skill = "-" if metrics["skill"] is None else "{:.3f}".format(metrics["skill"])
+        print("{:<8}{:>6}{:>7}{:>10.1f}{:>10.1f}{:>10.1f}{:>8}".format(
+            name, metrics.get("days", report["days_with_forecast"]), metrics["hours"], metrics["mae"],
+            metrics["rmse"], metrics["bias"], skill))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backtest fmi open based forecasts against measured production.")
+    parser.add_argument("--site", default="helsinki", help="site name, see helpers/site_parameters.py")
+    parser.add_argument("--start", required=True, help="first day, YYYY-MM-DD")
+    parser.add_argument("--end", required=True, help="last day, YYYY-MM-DD")
+    parser.add_argument("--source", default="archive", choices=["archive", "replay"],
+                        help="archived fmi frames or recorded WFS responses, see helpers/wfs_replay.py")
+    parser.add_argument("--production", default=None,
+                        help="measured production csv, known files from real_production_data.py by default")
+    parser.add_argument("--production-scale", type=float, default=1.0,
+                        help="multiplier which converts measured power to W, for example 1000 for kW")
+    parser.add_argument("--processes", type=int, default=None, help="worker process count, cpu count by default")
+    parser.add_argument("--chunk-days", type=int, default=14, help="days processed by one worker task")
+    parser.add_argument("--report", default=None, help="optional path for the report as json")
+    args = parser.parse_args()
+
+    site = site_parameters.get_site(args.site)
+    if site is None:
+        return
+
+    if args.production is not None:
+        production_store = production_data_store.open_store(args.production)
+    else:
+        production_store = real_production_data.get_production_store(site["site_name"])
+        if production_store is None:
+            return
+
+    report = run_backtest(site, datetime.datetime.strptime(args.start, "%Y-%m-%d"),
+                          datetime.datetime.strptime(args.end, "%Y-%m-%d"), production_store, args.source,
+                          args.processes, args.chunk_days, args.production_scale)
+    if report is None:
+        return
+
+    print_report(report)
+
+    if args.report is not None:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+        print("Backtest report saved as '" + args.report + "'")
+
+
+if __name__ == "__main__":
+    main()
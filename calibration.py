@@ -0,0 +1,243 @@
+"""
+Calibration of site parameters against measured production.
+
+Fits albedo, reflectance_constant, an air temperature offset and rated_power (or a derate factor) of a site to measured
+production with archived fmi open inputs, the same inputs as backtest.py uses. Albedo is only fitted when the inputs do
+not contain dynamic albedo, the pipeline prefers the albedo column of fmi open data over the site value.
+
+Steps which do not depend on the fitted parameters, solar geometry and plane of array projections, are computed once.
+The rest of the pipeline is evaluated for a whole grid of candidate parameter sets at once, each candidate is one row
+of (candidate, time) arrays.
+
+Output is proportional to rated_power, so rated_power or derate is not searched from a grid. For every candidate the
+least squares optimal scale is solved in closed form, which gives the fitted rated_power and the remaining squared
+error. The candidate with the smallest error is written to the site configuration file read by site_parameters.py.
+
+Example:
+python calibration.py --site helsinki --start 2023-05-01 --end 2023-08-31
+python calibration.py --site helsinki --start 2023-05-01 --end 2023-08-31 --derate
+"""
+
+import argparse
+import datetime
+
+import numpy
+
+import backtest
+from helpers import astronomical_calculations
+from helpers import geometric_projections
+from helpers import output_estimator
+from helpers import panel_temperature_estimator
+from helpers import production_data_store
+from helpers import real_production_data
+from helpers import reflection_estimator
+from helpers import shading
+from helpers import site_parameters
+from helpers import time_conversions
+
+# default candidate values
+ALBEDO_CANDIDATES = numpy.linspace(0.05, 0.8, 16)
+REFLECTANCE_CANDIDATES = numpy.linspace(0.08, 0.3, 12)
+AIR_TEMP_OFFSET_CANDIDATES = numpy.linspace(-6, 6, 13)
+
+
+def prepare_inputs(data, site, measured):
+    """
+    Computes the parameter independent part of the pipeline for daylight hours with measurements.
+    :param data: Dataframe of fmi open inputs, see backtest.load_archived_inputs()
+    :param site: Dictionary of site parameters
+    :param measured: Measured power in W for the rows of data
+    :return: Dictionary of arrays used by evaluate_candidates()
+    """
+    geometry = astronomical_calculations.get_solar_geometry(data["time"], site["latitude"], site["longitude"])
+
+    # ground reflected component is proportional to albedo, projecting with albedo 1 and scaling per candidate
+    dni_poa, dhi_poa, ghi_poa = geometric_projections.project_to_panel_surface_arrays(
+        data["dni"].to_numpy(), data["dhi"].to_numpy(), data["ghi"].to_numpy(), geometry, 1.0, site["tilt"],
+        site["azimuth"], shading.get_site_shading(site))
+    angle_of_incidence = astronomical_calculations.get_solar_angle_of_incidence_array(
+        geometry["azimuth"].to_numpy(), geometry["apparent_zenith"].to_numpy(), site["tilt"], site["azimuth"])
+
+    # dynamic albedo from forecast data is used by the pipeline when it exists, it is not fitted then
+    albedo = data["albedo"].to_numpy() if "albedo" in data.columns else numpy.full(len(data), site["albedo"])
+    wind = data["wind"].to_numpy() if "wind" in data.columns else numpy.full(len(data), site["wind_speed"])
+    air_temperature = data["T"].to_numpy() if "T" in data.columns else numpy.full(len(data), site["air_temp"])
+
+    valid = ((geometry["apparent_zenith"].to_numpy() < 90) & ~numpy.isnan(measured) & ~numpy.isnan(dni_poa)
+             & ~numpy.isnan(dhi_poa) & ~numpy.isnan(ghi_poa) & ~numpy.isnan(albedo) & ~numpy.isnan(wind)
+             & ~numpy.isnan(air_temperature))
+
+    return {"dni_poa": dni_poa[valid],
+            "dhi_poa": dhi_poa[valid],
+            "ghi_poa_unit_albedo": ghi_poa[valid],
+            "angle_of_incidence": angle_of_incidence[valid],
+            "albedo": albedo[valid] if "albedo" in data.columns else None,
+            "wind": wind[valid],
+            "T": air_temperature[valid],
+            "measured": measured[valid]}
+
+
+def unit_output(inputs, site, albedo, reflectance, air_temp_offset):
+    """
+    Output of 1 kW rated power for each candidate.
+    :param inputs: Dictionary from prepare_inputs()
+    :param albedo: Candidate albedo values, array of shape (n, 1). Ignored if inputs contain dynamic albedo.
+    :param reflectance: Candidate reflectance constants, array of shape (n, 1)
+    :param air_temp_offset: Candidate air temperature offsets, array of shape (n, 1)
+    :return: Array of shape (n, hours) in W
+    """
+    if inputs["albedo"] is not None:
+        albedo = inputs["albedo"]
+
+    dni_rc, dhi_rc, ghi_rc = reflection_estimator.reflection_corrected_arrays(
+        inputs["dni_poa"], inputs["dhi_poa"], inputs["ghi_poa_unit_albedo"] * albedo, inputs["angle_of_incidence"],
+        reflectance, site["tilt"])
+    absorbed_radiation = dni_rc + dhi_rc + ghi_rc
+
+    module_temperature = panel_temperature_estimator.module_temperature_array(
+        absorbed_radiation, inputs["wind"], inputs["T"] + air_temp_offset, site["module_elevation"])
+
+    return output_estimator.estimate_output_array(absorbed_radiation, module_temperature, rated_power=1.0)
+
+
+def evaluate_candidates(inputs, site, albedo, reflectance, air_temp_offset, batch_size=256):
+    """
+    Solves the least squares rated power of each candidate and the remaining error.
+    :param inputs: Dictionary from prepare_inputs()
+    :param albedo: Candidate albedo values, 1d array
+    :param reflectance: Candidate reflectance constants, 1d array of the same length
+    :param air_temp_offset: Candidate air temperature offsets, 1d array of the same length
+    :param batch_size: Number of candidates evaluated at once, limits memory use
+    :return: Tuple (rated power in kW, sum of squared errors), 1d arrays
+    """
+    measured = inputs["measured"]
+    measured_square_sum = numpy.dot(measured, measured)
+
+    rated_power = numpy.empty(len(albedo))
+    squared_error = numpy.empty(len(albedo))
+
+    for first in range(0, len(albedo), batch_size):
+        batch = slice(first, first + batch_size)
+        output = unit_output(inputs, site, albedo[batch, None], reflectance[batch, None], air_temp_offset[batch, None])
+
+        # minimizing |scale * output - measured|^2, scale = <output, measured> / <output, output>
+        cross = output @ measured
+        output_square_sum = numpy.einsum("ij,ij->i", output, output)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            scale = numpy.where(output_square_sum > 0, cross / output_square_sum, 0.0)
+
+        rated_power[batch] = scale
+        squared_error[batch] = measured_square_sum - scale * cross
+
+    return rated_power, squared_error
+
+
+def calibrate(site, data, measured, albedo_candidates=None, reflectance_candidates=None,
+              air_temp_offset_candidates=None, fit_derate=False):
+    """
+    Fits site parameters to measured production.
+    :param site: Dictionary of site parameters
+    :param data: Dataframe of fmi open inputs
+    :param measured: Measured power in W for the rows of data
+    :param fit_derate: If True, rated_power is kept and the scale is fitted as derate
+    :return: Tuple (fitted site dictionary, report dictionary), (None, None) if there are no usable hours
+    """
+    if albedo_candidates is None:
+        albedo_candidates = ALBEDO_CANDIDATES
+    if reflectance_candidates is None:
+        reflectance_candidates = REFLECTANCE_CANDIDATES
+    if air_temp_offset_candidates is None:
+        air_temp_offset_candidates = AIR_TEMP_OFFSET_CANDIDATES
+
+    inputs = prepare_inputs(data, site, measured)
+    hours = len(inputs["measured"])
+    if hours == 0:
+        print("Error: no daylight hours with both forecast inputs and measured production")
+        return None, None
+
+    if inputs["albedo"] is not None:
+        print("Using dynamic albedo from forecast data, albedo is not fitted")
+        albedo_candidates = [site["albedo"]]
+
+    # full grid of candidates, one candidate per element
+    albedo, reflectance, air_temp_offset = [grid.ravel() for grid in numpy.meshgrid(
+        albedo_candidates, reflectance_candidates, air_temp_offset_candidates, indexing="ij")]
+
+    rated_power, squared_error = evaluate_candidates(inputs, site, albedo, reflectance, air_temp_offset)
+    best = int(numpy.argmin(squared_error))
+
+    # error with current parameters for comparison
+    current_output = unit_output(inputs, site, numpy.array([[site["albedo"]]]),
+                                 numpy.array([[site["reflectance_constant"]]]),
+                                 numpy.array([[site["air_temp_offset"]]]))[0]
+    current_output = current_output * site["rated_power"] * site["derate"]
+
+    fitted = dict(site)
+    fitted["albedo"] = round(float(albedo[best]), 4)
+    fitted["reflectance_constant"] = round(float(reflectance[best]), 4)
+    fitted["air_temp_offset"] = round(float(air_temp_offset[best]), 2)
+    if fit_derate:
+        fitted["derate"] = round(float(rated_power[best]) / site["rated_power"], 4)
+    else:
+        fitted["rated_power"] = round(float(rated_power[best]), 3)
+        fitted["derate"] = 1
+
+    report = {"hours": hours,
+              "candidates": int(len(albedo)),
+              "rmse_before": float(numpy.sqrt(numpy.mean((current_output - inputs["measured"]) ** 2))),
+              "rmse_after": float(numpy.sqrt(max(squared_error[best], 0) / hours))}
+
+    return fitted, report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit site parameters to measured production.")
+    parser.add_argument("--site", default="helsinki", help="site name, see helpers/site_parameters.py")
+    parser.add_argument("--start", required=True, help="first day, YYYY-MM-DD")
+    parser.add_argument("--end", required=True, help="last day, YYYY-MM-DD")
+    parser.add_argument("--production", default=None,
+                        help="measured production csv, known files from real_production_data.py by default")
+    parser.add_argument("--production-scale", type=float, default=1.0,
+                        help="multiplier which converts measured power to W, for example 1000 for kW")
+    parser.add_argument("--derate", action="store_true",
+                        help="keep rated_power and fit a derate factor instead")
+    parser.add_argument("--output", default=None,
+                        help="site file to write, <config.site_directory>/<site>.json by default")
+    args = parser.parse_args()
+
+    site = site_parameters.get_site(args.site)
+    if site is None:
+        return
+
+    if args.production is not None:
+        production_store = production_data_store.open_store(args.production)
+    else:
+        production_store = real_production_data.get_production_store(site["site_name"])
+        if production_store is None:
+            return
+
+    data = backtest.load_archived_inputs(site, datetime.datetime.strptime(args.start, "%Y-%m-%d"),
+                                         datetime.datetime.strptime(args.end, "%Y-%m-%d"))
+    if len(data) == 0:
+        print("Error: no archived fmi open data found for " + args.start + " - " + args.end)
+        return
+
+    times = time_conversions.to_utc_ns(data["time"])
+    measured = backtest.hourly_measured_power(production_store, times) * args.production_scale
+
+    fitted, report = calibrate(site, data, measured, fit_derate=args.derate)
+    if fitted is None:
+        return
+
+    print("Calibrated \"" + site["site_name"] + "\" with " + str(report["hours"]) + " hours and "
+          + str(report["candidates"]) + " candidate parameter sets")
+    for name in ["rated_power", "derate", "albedo", "reflectance_constant", "air_temp_offset"]:
+        print("{:<22}{:>10} -> {}".format(name, site[name], fitted[name]))
+    print("RMSE {:.1f} W -> {:.1f} W".format(report["rmse_before"], report["rmse_after"]))
+
+    path = site_parameters.save_site_file(fitted, args.output)
+    print("Site parameters saved as '" + path + "'")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,156 @@ and data resolution belong here. Variables in this file should be expected to st
 # site name used for plotting and saved file name
 site_name = "EduCity"
 save_directory = "output/"
+# set to True to render plots without a display, show_plot() saves plots as .png files instead of opening a window
+headless_plotting = False
+# curves longer than this are downsampled before plotting, peaks and dips are kept. None plots every point
+plot_max_points = 4000
+
+##### TMY export parameters
+# hourly weather rows for Radiance runs are appended to <tmy_directory>weatherPrediction_<site name>_<year>.csv
+tmy_directory = "output/"
+# set to True to also write an EnergyPlus weather file (.epw) when a year file is compacted
+tmy_write_epw = False
+# constant values for TMY columns which fmi open data does not provide, averages of the site
+tmy_relative_humidity = 80 # unit %
+tmy_infrared_radiation = 296 # horizontal infrared radiation, unit W/m2
+tmy_wind_direction = 202 # unit degrees
+tmy_surface_pressure = 101193 # unit Pa
+
+##### Forecast archive parameters
+# fetched fmi frames and pipeline results are stored here, partitioned by site name and forecast run time
+archive_directory = "archive/"
+# set to False to disable archiving
+archive_forecasts = True
+# raw fmi open WFS responses are recorded here, model "replay" reads them back without network access
+replay_directory = "archive/wfs_responses/"
+record_wfs_responses = True
+
+##### Clear sky cache parameters
+# computed clear sky days kept in memory, one entry per site, model, resolution and day
+clearsky_cache_days = 2048
+# set to True to store computed clear sky days on disk for later program runs
+clearsky_cache_on_disk = False
+# stored days and the memory mapped Linke turbidity climatology are kept here
+clearsky_cache_directory = "archive/clearsky/"
+
+##### Result cache parameters
+# set to False to run the pipeline on every call of result_cache.process_irradiance()
+result_cache_enabled = True
+# pipeline results kept in memory, one entry per configuration and input dataframe
+result_cache_entries = 256
+# set to True to store pipeline results on disk for later program runs
+result_cache_on_disk = False
+# stored results are kept here, least recently used files are removed above result_cache_disk_mb megabytes
+result_cache_directory = "archive/results/"
+result_cache_disk_mb = 512
+
+##### Simulation store parameters
+# long simulations are written into memory mapped arrays under this directory, see helpers/simulation_store.py
+simulation_directory = "archive/simulations/"
+# pipeline columns stored for each site and their dtype, float32 halves the file size
+simulation_columns = ["output"]
+simulation_dtype = "float32"
+# days processed at a time while simulating, memory use grows with chunk length and data resolution
+simulation_chunk_days = 30
+# rows read at a time by aggregations and plot curves
+simulation_read_rows = 1000000
+
+##### Fleet parameters
+# additional sites are defined as json files in this directory, see helpers/site_parameters.py
+site_directory = "sites/"
+# gridded MEPS files are matched to sites with a spatial index which is cached here
+grid_index_cache_directory = "archive/grid_index/"
+# locally stored gridded MEPS file used by model "meps_grid" (NetCDF or GRIB)
+meps_grid_file = "archive/meps_grid/latest.nc"
+# MEPS ensemble members fetched for probabilistic forecasts, member 0 is the control run
+meps_ensemble_members = 15
+# quantiles over ensemble members reported by helpers/ensemble_forecast.py, P10, P50 and P90
+ensemble_quantiles = [0.1, 0.5, 0.9]
+# measured production csv files are ingested into indexed stores in this directory
+production_store_directory = "archive/production/"
+
+##### Uncertainty parameters
+# number of site parameter samples drawn by helpers/uncertainty.py
+uncertainty_samples = 1000
+# standard deviations of sampled site parameters. Albedo, reflectance constant and module elevation (m) are absolute
+# deviations, derate and the Huld coefficients are relative deviations
+uncertainty_deviations = {"albedo": 0.05,
+                          "reflectance_constant": 0.02,
+                          "module_elevation": 0.5,
+                          "derate": 0.03,
+                          "huld_coefficients": 0.1}
+# confidence bands are reported as these quantiles over samples
+uncertainty_quantiles = [0.05, 0.5, 0.95]
+
+##### Nowcast parameters
+# live inverter power readings are received on this TCP port as lines "<site name>,<time>,<power W>", see
+# nowcast_service.py
+nowcast_port = 8081
+# readings kept in memory per site, one day of minute readings
+nowcast_buffer_size = 1440
+# seconds between forecast corrections
+nowcast_interval = 60
+# archived forecast kind which is corrected, see helpers/forecast_archive.py
+nowcast_forecast_kind = "fmi_output"
+# bias of the forecast is estimated from the readings of this many last minutes
+nowcast_window_minutes = 60
+# correction fades out with this time constant in hours and is not applied further ahead than nowcast_horizon_hours
+nowcast_decay_hours = 2
+nowcast_horizon_hours = 6
+# readings are not used when forecast power is below this fraction of rated power
+nowcast_min_power_fraction = 0.02
+# lower and upper limit of the ratio of measured to forecast power
+nowcast_ratio_limits = [0.2, 2.0]
+# corrected forecasts are written here as <site name>.npz
+nowcast_directory = "archive/nowcast/"
+
+##### Worker parameters
+# worker.py keeps the code loaded and answers requests of worker_client.py on this unix socket
+worker_socket = "archive/worker.sock"
+# fetched fmi open frames are reused for this many seconds, fmi updates its forecasts a few times a day
+worker_fmi_max_age = 900
+# number of fetched frames kept in memory
+worker_cache_entries = 64
+
+##### Scheduler parameters
+# sites with a daily TMY export and published forecasts, see scheduler.py and helpers/site_parameters.py
+scheduler_sites = [site_name]
+# local time of the daily run
+scheduler_hour = 23
+scheduler_minute = 30
+# completed runs and last results of each site are stored here
+scheduler_state_file = "archive/scheduler_state.json"
+# missed runs of at most this many days are caught up from recorded or archived fmi open data
+scheduler_catch_up_days = 14
+# number of sites processed at the same time and seconds before a run is terminated
+scheduler_workers = 4
+scheduler_job_timeout = 600
+# forecasts of each site are published to the forecast archive every this many hours, covering this many days
+scheduler_forecast_hours = 3
+scheduler_forecast_days = 3
+
+##### Backfill parameters
+# completed site-days of backfill.py are appended here one json line each, an interrupted backfill continues from them
+backfill_checkpoint_file = "archive/backfill_checkpoint.jsonl"
+# worker processes computing site-days and the number of site-days computed ahead of writing
+backfill_processes = 4
+backfill_pending_units = 16
+# seconds between progress reports
+backfill_report_interval = 10
+
+##### Forecast server parameters
+# forecast_server.py listens on this address, use "0.0.0.0" to accept connections from other machines
+server_host = "127.0.0.1"
+server_port = 8080
+# seconds between checks for new archived runs
+server_refresh_interval = 30
+
+##### Backtest parameters
+# days are classified with the ratio of measured energy to clear sky energy. Days above backtest_clear_day_index are
+# clear, days below backtest_cloudy_day_index are cloudy and the rest are mixed
+backtest_clear_day_index = 0.6
+backtest_cloudy_day_index = 0.3
 
 #### SIMULATED INSTALLATION PARAMETERS BELOW:
 # coordinates
@@ -44,6 +194,24 @@ wind_speed = 2
 # air temp in Celsius, this will be used if temp from fmi open is not used
 air_temp = 20
 
+# correction added to air temperatures before panel temperature estimation, fitted by calibration.py
+air_temp_offset = 0
+
+# fraction of simulated output the installation actually delivers, losses not included in the model. 1 means no
+# additional losses. Fitted by calibration.py
+derate = 1
+
+# horizon elevation seen from the modules as [azimuth, elevation] points in degrees, for example [[90, 5], [180, 12]].
+# Empty list for a free horizon, see helpers/shading.py
+horizon_profile = []
+# trees and buildings near the modules, for example [{"azimuth": 200, "width": 30, "height": 18, "distance": 25}]
+# with azimuth and width in degrees and height and distance in meters
+shading_obstacles = []
+# cell size in degrees of the precomputed azimuth x elevation shading table
+shading_resolution = 0.5
+# set to False to shade only direct irradiance, True also reduces diffuse irradiance by the sky hidden by the horizon
+shading_diffuse = True
+
 
 #### OTHER PARAMETERS
 
@@ -51,9 +219,20 @@ air_temp = 20
 # timezone is currently not utilized as it should due to plotting issues
 timezone = "UTC"
 
+# daily, hourly and monthly energy totals are computed over calendar periods of this timezone
+local_timezone = "Europe/Helsinki"
+
 # data resolution, how many minutes between measurements. Recommending values 30, 15, 10, 5, 1
 data_resolution = 15
 
+# sources which only provide global horizontal irradiance are split into dni and dhi with this model, "erbs", "disc"
+# or "dirint", see helpers/irradiance_decomposition.py
+decomposition_model = "erbs"
+# direct normal irradiance is zero above this solar zenith angle and cos(zenith) is limited to at least
+# decomposition_min_cos_zenith, which keeps dni finite near sunrise and sunset
+decomposition_max_zenith = 87
+decomposition_min_cos_zenith = 0.065
+
 
 
 
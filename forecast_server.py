@@ -0,0 +1,271 @@
+"""
+Local HTTP API serving the latest forecasts of each site.
+
+The latest archived run of every site and frame kind ("fmi_output" weather model based forecast and "pvlib_output"
+clear sky forecast, see helpers/forecast_archive.py) is loaded into memory. The archive is checked for new runs every
+config.server_refresh_interval seconds, so forecasts published by the scheduler for each site (see
+scheduler.publish_forecasts()) or by main.py are picked up without restarting. Requests are answered from memory with
+a binary search on time, nothing is recomputed per request.
+
+Endpoints:
+GET /sites
+    Sites and frame kinds in memory with their run times and time ranges.
+GET /forecast?site=<site name>&kind=fmi_output&series=power&start=<time>&end=<time>&format=json
+    site    Site name, config.site_name by default
+    kind    "fmi_output" or "pvlib_output", "fmi_output" by default
+    series  "power" in W or "energy" in kWh for each timestamp
+    start   Optional first timestamp included, ISO format, naive values are UTC
+    end     Optional last timestamp included
+    format  "json" or "binary"
+
+JSON responses contain the site, kind, run time, unit, a list of UTC timestamps and a list of values, missing values
+are null. Binary responses contain the timestamps as little endian int64 nanoseconds since epoch followed by the values
+as little endian float64, the row count is given in the X-Rows header.
+
+Example:
+python forecast_server.py --port 8080
+curl "http://127.0.0.1:8080/forecast?site=helsinki&start=2024-06-01T00:00&end=2024-06-01T23:59"
+"""
+
+import argparse
+import asyncio
+import json
+import urllib.parse
+
+import numpy
+import pandas
+
+import config
+from helpers import energy_aggregation
+from helpers import forecast_archive
+from helpers import time_conversions
+
+KINDS = ["fmi_output", "pvlib_output"]
+SERIES_UNITS = {"power": "W", "energy": "kWh"}
+
+STATUS_TEXTS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}
+
+
+class ForecastCache:
+    """
+    Latest archived run of each site and frame kind, prepared for fast slicing.
+    """
+
+    def __init__(self, sites, kinds=None, root=None):
+        self.sites = list(sites)
+        self.kinds = KINDS if kinds is None else list(kinds)
+        self.root = root
+        self.entries = {}
+
+    def refresh(self):
+        """
+        Loads runs which are newer than the ones in memory. Entries are replaced as a whole, readers never see a
+        partly loaded run.
+        :return: List of (site, kind) keys which were updated
+        """
+        updated = []
+        for site in self.sites:
+            for kind in self.kinds:
+                runs = forecast_archive.list_runs(kind, site, root=self.root)
+                if not runs:
+                    continue
+                entry = self.entries.get((site, kind))
+                if entry is not None and entry["run_time"] == runs[-1]:
+                    continue
+
+                data = forecast_archive.read_archive(kind, site, run_start=runs[-1], run_end=runs[-1],
+                                                     columns=["output"], root=self.root)
+                self.entries[(site, kind)] = prepare_run(data, runs[-1])
+                updated.append((site, kind))
+        return updated
+
+    def query(self, site, kind, start=None, end=None):
+        """
+        Selects rows with start <= time <= end.
+        :return: Tuple (entry, first row, end row), entry is None if the site and kind are not in memory
+        """
+        entry = self.entries.get((site, kind))
+        if entry is None:
+            return None, 0, 0
+        first = 0 if start is None else int(numpy.searchsorted(entry["times"], start, side="left"))
+        last = len(entry["times"]) if end is None else int(numpy.searchsorted(entry["times"], end, side="right"))
+        return entry, first, last
+
+
+def prepare_run(data, run_time):
+    """
+    Precomputes everything a response needs, requests only slice these arrays and lists.
+    :param data: Archived frame with time and output columns
+    :param run_time: Run time of the frame
+    :return: Cache entry dictionary
+    """
+    times = time_conversions.to_utc_ns(data["time"]).astype("<i8")
+    power = data["output"].to_numpy(dtype="<f8")
+    energy = numpy.nan_to_num(power) * energy_aggregation.sample_durations(times) / 1000
+    energy = numpy.where(numpy.isnan(power), numpy.nan, energy).astype("<f8")
+
+    return {"run_time": run_time,
+            "times": times,
+            "time_texts": list(time_conversions.from_utc_ns(times).strftime("%Y-%m-%dT%H:%M:%SZ")),
+            "power": power,
+            "energy": energy,
+            "power_list": [None if numpy.isnan(value) else value for value in power.tolist()],
+            "energy_list": [None if numpy.isnan(value) else value for value in energy.tolist()]}
+
+
+def handle_request(cache, method, target):
+    """
+    Answers one request from the cache.
+    :param method: HTTP method
+    :param target: Request path with query string
+    :return: Tuple (status code, content type, body bytes, extra headers dictionary)
+    """
+    if method != "GET":
+        return __error(405, "only GET is supported")
+
+    url = urllib.parse.urlsplit(target)
+    parameters = dict(urllib.parse.parse_qsl(url.query))
+
+    match url.path:
+        case "/sites":
+            sites = [{"site": site, "kind": kind, "run_time": entry["run_time"].isoformat(),
+                      "rows": len(entry["times"]),
+                      "start": entry["time_texts"][0] if entry["time_texts"] else None,
+                      "end": entry["time_texts"][-1] if entry["time_texts"] else None}
+                     for (site, kind), entry in cache.entries.items()]
+            return 200, "application/json", json.dumps({"sites": sites}).encode(), {}
+        case "/forecast":
+            return __forecast_response(cache, parameters)
+        case _:
+            return __error(404, "unknown path " + url.path)
+
+
+async def serve(cache, host, port, refresh_interval=None):
+    """
+    Serves the cache until cancelled and refreshes it in the background.
+    """
+    if refresh_interval is None:
+        refresh_interval = config.server_refresh_interval
+
+    server = await asyncio.start_server(lambda reader, writer: __handle_connection(cache, reader, writer), host, port)
+    refresher = asyncio.create_task(__refresh_periodically(cache, refresh_interval))
+    print("Serving forecasts of " + ", ".join(cache.sites) + " on http://" + host + ":" + str(port))
+
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        refresher.cancel()
+
+
+def __forecast_response(cache, parameters):
+    site = parameters.get("site", config.site_name)
+    kind = parameters.get("kind", "fmi_output")
+    series = parameters.get("series", "power")
+    response_format = parameters.get("format", "json")
+
+    if series not in SERIES_UNITS:
+        return __error(400, "unknown series " + series + ", use power or energy")
+    if response_format not in ["json", "binary"]:
+        return __error(400, "unknown format " + response_format + ", use json or binary")
+
+    try:
+        start = None if "start" not in parameters else time_conversions.to_utc_ns(pandas.Timestamp(parameters["start"]))
+        end = None if "end" not in parameters else time_conversions.to_utc_ns(pandas.Timestamp(parameters["end"]))
+    except ValueError as e:
+        return __error(400, "invalid time: " + str(e))
+
+    entry, first, last = cache.query(site, kind, start, end)
+    if entry is None:
+        return __error(404, "no " + kind + " forecast for site " + site)
+
+    if response_format == "binary":
+        body = entry["times"][first:last].tobytes() + entry[series][first:last].tobytes()
+        return 200, "application/octet-stream", body, {"X-Rows": str(last - first),
+                                                      "X-Run-Time": entry["run_time"].isoformat()}
+
+    body = json.dumps({"site": site,
+                       "kind": kind,
+                       "run_time": entry["run_time"].isoformat(),
+                       "series": series,
+                       "unit": SERIES_UNITS[series],
+                       "time": entry["time_texts"][first:last],
+                       "values": entry[series + "_list"][first:last]})
+    return 200, "application/json", body.encode(), {}
+
+
+def __error(status, message):
+    return status, "application/json", json.dumps({"error": message}).encode(), {}
+
+
+async def __handle_connection(cache, reader, writer):
+    """
+    Minimal HTTP/1.1 handling, requests without a body and keep-alive connections.
+    """
+    try:
+        while True:
+            try:
+                head = await reader.readuntil(b"\r\n\r\n")
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                break
+
+            lines = head.decode("latin-1").split("\r\n")
+            request_line = lines[0].split(" ")
+            headers = {name.strip().lower(): value.strip()
+                       for name, _, value in (line.partition(":") for line in lines[1:] if line)}
+
+            if len(request_line) != 3:
+                status, content_type, body, extra_headers = __error(400, "malformed request line")
+                keep_alive = False
+            else:
+                method, target, version = request_line
+                status, content_type, body, extra_headers = handle_request(cache, method, target)
+                keep_alive = (version == "HTTP/1.1" and headers.get("connection", "").lower() != "close")
+
+            response = ["HTTP/1.1 " + str(status) + " " + STATUS_TEXTS[status],
+                        "Content-Type: " + content_type,
+                        "Content-Length: " + str(len(body)),
+                        "Connection: " + ("keep-alive" if keep_alive else "close")]
+            response += [name + ": " + value for name, value in extra_headers.items()]
+            writer.write(("\r\n".join(response) + "\r\n\r\n").encode("latin-1") + body)
+            await writer.drain()
+
+            if not keep_alive:
+                break
+    finally:
+        writer.close()
+
+
+async def __refresh_periodically(cache, interval):
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            # archive reads are blocking, running them outside the event loop keeps requests fast
+            updated = await loop.run_in_executor(None, cache.refresh)
+        except Exception as e:
+            print("Error: refreshing forecasts failed, " + type(e).__name__ + ": " + str(e))
+            continue
+        for site, kind in updated:
+            print("Loaded new " + kind + " run of site " + site)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the latest forecasts of each site over HTTP.")
+    parser.add_argument("--host", default=config.server_host, help="address to listen on")
+    parser.add_argument("--port", type=int, default=config.server_port, help="port to listen on")
+    parser.add_argument("--sites", nargs="+", default=None, help="site names, config.scheduler_sites by default")
+    args = parser.parse_args()
+
+    cache = ForecastCache(config.scheduler_sites if args.sites is None else args.sites)
+    for site, kind in cache.refresh():
+        print("Loaded " + kind + " run of site " + site)
+
+    try:
+        asyncio.run(serve(cache, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -10,53 +10,199 @@ MEPS open data collection for parameters needed in PV forecasting
 import datetime as dt
 import pandas as pd
 import numpy as np
-from fmiopendata.wfs import download_stored_query
+import defusedxml.ElementTree as ET
+from fmiopendata import wfs
+from fmiopendata.utils import read_url
 
 from helpers import astronomical_calculations
+from helpers import irradiance_decomposition
 
 pd.set_option('display.max_rows', 500)
 pd.set_option('display.min_rows', 500)
 
 
+COLLECTION_STRING = "fmi::forecast::harmonie::surface::point::multipointcoverage"
+
+# List the wanted MEPS parameters
+PARAMETERS = ["Temperature",
+              "RadiationGlobalAccumulation",
+              "RadiationNetSurfaceSWAccumulation",
+              "RadiationSWAccumulation",
+              "WindSpeedMS",
+              "TotalCloudCover"
+              ]
+
+# Dataframe column names for the MEPS parameters
+PARAMETER_COLUMNS = {"Temperature": 'T',
+                     "RadiationGlobalAccumulation": 'GHI_accum',
+                     "RadiationNetSurfaceSWAccumulation": 'NetSW_accum',
+                     "RadiationSWAccumulation": 'DirHI_accum',
+                     "WindSpeedMS": 'Wind speed',
+                     "TotalCloudCover": 'Total cloud cover'}
+
+
+# MEPS ensemble point forecast, every member is requested as its own set of parameters
+ENSEMBLE_COLLECTION_STRING = "fmi::forecast::meps::surface::point::multipointcoverage"
+
+# Parameter name of one ensemble member, member 0 is the control run
+MEMBER_PARAMETER_FORMAT = "{parameter}-M{member}"
+
+
 def collect_fmi_opendata(latlon, start_time, end_time):
-    collection_string = "fmi::forecast::harmonie::surface::point::multipointcoverage"
-
-    # List the wanted MEPS parameters
-    parameters = ["Temperature",
-                  "RadiationGlobalAccumulation",
-                  "RadiationNetSurfaceSWAccumulation",
-                  "RadiationSWAccumulation",
-                  "WindSpeedMS",
-                  "TotalCloudCover"
-                  ]
-    parameters_str = ','.join(parameters)
-
-    # Collect data
-    snd = download_stored_query(collection_string,
-                                args=["latlon=" + latlon,
-                                      "starttime=" + str(start_time),
-                                      "endtime=" + str(end_time),
-                                      'parameters=' + parameters_str])
-    data = snd.data
-
-    # Times to use in forming dataframe
-    data_list = []
-    # Make the dict of dict of dict of.. into pandas dataframe
-    for time, location_data in data.items():
-        location = list(location_data.keys())[0]  # Get the location dynamically
-        values = location_data[location]
-
-        data_list.append({'Time': time,
-                          'T': values['Air temperature']['value'],
-                          'GHI_accum': values['Global radiation accumulation']['value'],
-                          'NetSW_accum': values['Net short wave radiation accumulation at the surface']['value'],
-                          'DirHI_accum': values['Short wave radiation accumulation']['value'],
-                          'Wind speed': values['Wind speed']['value'],
-                          'Total cloud cover': values['Total cloud cover']['value']})
-
-    # Create a DataFrame and set time as index   
-    df = pd.DataFrame(data_list)
-    df.set_index('Time', inplace=True)
+    xml = download_fmi_opendata_xml(latlon, start_time, end_time)
+    return parse_fmi_opendata_xml(xml)
+
+
+def download_fmi_opendata_xml(latlon, start_time, end_time):
+    """
+    Downloads the raw WFS response for the harmonie point forecast. Raw responses can be recorded and replayed
+    later without network access, see wfs_replay.py.
+    :return: Response xml as bytes
+    """
+    parameters_str = ','.join(PARAMETERS)
+
+    # Same request as fmiopendata.wfs.download_stored_query() would make
+    args = ["latlon=" + latlon,
+            "starttime=" + str(start_time),
+            "endtime=" + str(end_time),
+            'parameters=' + parameters_str]
+    url = wfs.STORED_QUERY_URL + COLLECTION_STRING + "&" + "&".join(args)
+
+    return read_url(url)
+
+
+def parse_fmi_opendata_xml(xml, latitude=None, longitude=None):
+    """
+    Parses a raw WFS response into a dataframe with dni, dhi, ghi, dir_hi, albedo, T, wind and cloud_cover columns.
+    :param xml: Response xml as bytes
+    :param latitude: Latitude for solar angles, config.latitude by default
+    :param longitude: Longitude for solar angles, config.longitude by default
+    :return: Dataframe
+    """
+
+    times, field_names, measurements = read_multipointcoverage(xml)
+
+    # Make the measurement table into pandas dataframe
+    df = pd.DataFrame(measurements, columns=field_names)
+    df = df[list(PARAMETER_COLUMNS.keys())].rename(columns=PARAMETER_COLUMNS)
+
+    # Set time as index
+    df.index = pd.DatetimeIndex(times, name='Time')
+
+    return accumulations_to_irradiance(df, latitude, longitude)
+
+
+def read_multipointcoverage(xml):
+    """
+    Reads the value table of a single location multipointcoverage WFS response.
+    :param xml: Response xml as bytes
+    :return: Tuple (naive UTC DatetimeIndex, list of field names, array of shape (times, fields))
+    """
+    # Parsing the response directly by parameter names. fmiopendata.multipoint.MultiPoint would resolve parameter
+    # labels with one extra http request per parameter, which does not work offline.
+    root = ET.fromstring(xml)
+    field_names = [field.attrib["name"] for field in root.findall(wfs.SWE_FIELD)]
+    positions = np.array(root.findtext(wfs.GMLCOV_POSITIONS).split(), dtype=float)
+    measurements = np.array(root.findtext(wfs.GML_DOUBLE_OR_NIL_REASON_TUPLE_LIST).split(), dtype=float)
+    measurements = measurements.reshape((-1, len(field_names)))
+
+    # positions are latitude, longitude, unix time -triplets, only one location is requested
+    times = pd.to_datetime(positions[2::3], unit="s")
+
+    return times, field_names, measurements
+
+
+def download_meps_ensemble_xml(latlon, start_time, end_time, members):
+    """
+    Downloads the MEPS ensemble point forecast of the given members in one request.
+    :param members: List of member numbers
+    :return: Response xml as bytes
+    """
+    parameters = [MEMBER_PARAMETER_FORMAT.format(parameter=parameter, member=member)
+                  for member in members for parameter in PARAMETERS]
+
+    args = ["latlon=" + latlon,
+            "starttime=" + str(start_time),
+            "endtime=" + str(end_time),
+            "parameters=" + ",".join(parameters)]
+    url = wfs.STORED_QUERY_URL + ENSEMBLE_COLLECTION_STRING + "&" + "&".join(args)
+
+    return read_url(url)
+
+
+def parse_meps_ensemble_xml(xml, members, latitude=None, longitude=None):
+    """
+    Parses an ensemble response into (member, time) arrays. Same conversions as accumulations_to_irradiance(), made
+    for all members at once with shared solar angles. Members missing from the response are left out.
+    :param xml: Response xml as bytes
+    :param members: List of requested member numbers
+    :return: Dictionary with members (int array), index (naive interval end times), time (UTC interval centers) and
+    dni, dhi, ghi, albedo, T, wind and cloud_cover arrays of shape (members, times)
+    """
+    times, field_names, measurements = read_multipointcoverage(xml)
+    columns = {name: i for i, name in enumerate(field_names)}
+
+    found = [member for member in members
+             if all(MEMBER_PARAMETER_FORMAT.format(parameter=parameter, member=member) in columns
+                    for parameter in PARAMETERS)]
+
+    # values[parameter] has shape (members, times)
+    values = {}
+    for parameter, column in PARAMETER_COLUMNS.items():
+        indices = [columns[MEMBER_PARAMETER_FORMAT.format(parameter=parameter, member=member)] for member in found]
+        values[column] = measurements[:, indices].T
+
+    return accumulation_arrays_to_irradiance(times, values, latitude, longitude) | {"members": np.array(found)}
+
+
+def accumulation_arrays_to_irradiance(times, values, latitude=None, longitude=None):
+    """
+    Array version of accumulations_to_irradiance(), accumulated parameters can have leading dimensions such as
+    ensemble members. Time is the last dimension.
+    :param times: Naive UTC DatetimeIndex of accumulation end times
+    :param values: Dictionary with T, GHI_accum, NetSW_accum, DirHI_accum, Wind speed and Total cloud cover arrays
+    :return: Dictionary with index, time, dni, dhi, ghi, dir_hi, albedo, T, wind and cloud_cover
+    """
+    # instant values from hourly accumulations, first timestamp has no previous value
+    def instant(accumulated):
+        result = np.full(np.shape(accumulated), np.nan)
+        result[..., 1:] = np.diff(accumulated, axis=-1) / (60 * 60)
+        return result
+
+    ghi = instant(values["GHI_accum"])
+    net_sw = instant(values["NetSW_accum"])
+    dir_hi = instant(values["DirHI_accum"])
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        albedo = (ghi - net_sw) / ghi
+    dhi = ghi - dir_hi
+
+    # solar angles depend only on time, shared by all members
+    geometry = astronomical_calculations.get_solar_geometry(times, latitude, longitude)
+    dni = irradiance_decomposition.direct_normal(dir_hi, geometry)
+
+    return {"index": pd.DatetimeIndex(times, name="Time"),
+            "time": (times + dt.timedelta(minutes=-30)).tz_localize("UTC"),
+            "dni": np.clip(dni, 0.0, None) + 0.0,
+            "dhi": np.clip(dhi, 0.0, None) + 0.0,
+            "ghi": np.clip(ghi, 0.0, None) + 0.0,
+            "dir_hi": dir_hi,
+            "albedo": albedo,
+            "T": values["T"],
+            "wind": values["Wind speed"],
+            "cloud_cover": values["Total cloud cover"]}
+
+
+def accumulations_to_irradiance(df, latitude=None, longitude=None):
+    """
+    Converts accumulated MEPS radiation parameters to the dataframe format used by the pipeline. Shared by the WFS
+    point forecast parser and the gridded MEPS loader.
+    :param df: Dataframe with hourly naive UTC time index and T, GHI_accum, NetSW_accum, DirHI_accum, Wind speed and
+    Total cloud cover columns
+    :param latitude: Latitude for solar angles, config.latitude by default
+    :param longitude: Longitude for solar angles, config.longitude by default
+    :return: Dataframe with time, dni, dhi, ghi, dir_hi, albedo, T, wind and cloud_cover columns
+    """
 
     # Calculate instant from accumulated values (only radiation parameters)
     diff = df.diff()
@@ -74,17 +220,14 @@ def collect_fmi_opendata(latlon, start_time, end_time):
     df['DHI'] = df['GHI'] - df['DirHI']
     #
 
-    # Adding solar zenith angle to df
-    def sza_adder(df_input):
-        return astronomical_calculations.get_solar_azimuth_zenit(df_input["time"])[1]
-
-
+    # Adding solar zenith angle to df, computed for all timestamps at once
     df["time"] = df.index
-    df["sza"] = df.apply(sza_adder, axis=1)
+    geometry = astronomical_calculations.get_solar_geometry(df.index, latitude, longitude)
+    df["sza"] = geometry["apparent_zenith"].to_numpy()
     # solar zenit angle added
 
-    # Calculate dni from dhi
-    df['DNI'] = df['DirHI'] / np.cos(df['sza'] * (np.pi / 180))
+    # Calculate dni from direct horizontal, limited near sunrise and sunset where cos(sza) approaches zero
+    df['DNI'] = irradiance_decomposition.direct_normal(df['DirHI'].to_numpy(), geometry)
 
     # Keep the necessary parameters
     df = df[['DNI', 'DHI', 'GHI', 'DirHI', 'albedo',
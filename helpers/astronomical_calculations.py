@@ -1,3 +1,5 @@
+import numpy
+import pandas
 import pvlib.atmosphere
 
 # HuHu adaptation
@@ -88,6 +90,60 @@ def get_solar_azimuth_zenit(dt):
     return solar_azimuth, solar_apparent_zenith
 
 
+"""
+VECTORIZED FUNCTIONS
+The functions above compute one timestamp at a time and are used by the df.apply() -structures. Functions below compute
+the same values for whole arrays of timestamps at once and are used by the vectorized pipeline in pipeline.py.
+"""
+
+
+def get_solar_geometry(times, latitude=None, longitude=None):
+    """
+    Computes solar angles, air mass and extraterrestrial radiation for an array of timestamps. The result only depends
+    on site location and time, it can be shared by all processing steps and by all panel configurations of a site.
+    :param times: Timestamps, naive timestamps are interpreted in config.timezone
+    :param latitude: Site latitude, config.latitude by default
+    :param longitude: Site longitude, config.longitude by default
+    :return: Dataframe indexed by times with columns azimuth, apparent_zenith, airmass and dni_extra
+    """
+    if latitude is None:
+        latitude = config.latitude
+    if longitude is None:
+        longitude = config.longitude
+
+    times = pandas.DatetimeIndex(times)
+
+    # same location object as in get_solar_azimuth_zenit()
+    panel_location = location.Location(latitude, longitude, tz=config.timezone)
+    solar_position = panel_location.get_solarposition(times)
+
+    geometry = pandas.DataFrame(index=solar_position.index)
+    geometry["azimuth"] = solar_position["azimuth"].to_numpy()
+    geometry["apparent_zenith"] = solar_position["apparent_zenith"].to_numpy()
+    geometry["airmass"] = numpy.asarray(pvlib.atmosphere.get_relative_airmass(geometry["apparent_zenith"].to_numpy()))
+    geometry["dni_extra"] = numpy.asarray(irradiance.get_extra_radiation(solar_position.index))
+
+    return geometry
+
+
+def get_solar_angle_of_incidence_array(solar_azimuth, solar_apparent_zenith, tilt=None, azimuth=None):
+    """
+    Vectorized version of get_solar_angle_of_incidence(). Angles are limited to 90 degrees in the same way.
+    :param solar_azimuth: Array of solar azimuth angles in degrees
+    :param solar_apparent_zenith: Array of apparent solar zenith angles in degrees
+    :param tilt: Panel tilt, config.tilt by default
+    :param azimuth: Panel azimuth, config.azimuth by default
+    :return: Array of angles of incidence in degrees
+    """
+    if tilt is None:
+        tilt = config.tilt
+    if azimuth is None:
+        azimuth = config.azimuth
+
+    angle_of_incidence = numpy.asarray(irradiance.aoi(tilt, azimuth, solar_apparent_zenith, solar_azimuth))
+    return numpy.minimum(angle_of_incidence, 90)
+
+
 def __debug_add_solar_angles_to_df(df):
     """
     This function is here for debug purposes, adds angle values to dataframe
@@ -0,0 +1,254 @@
+"""
+Memoized clear sky irradiance.
+
+Clear sky irradiance of a site only depends on the location, model, time resolution and date, the same days are
+computed again on every run and for every backtest. This file keeps computed days in an in-memory LRU cache with
+config.clearsky_cache_days entries, one entry per site, model, resolution and day. With config.clearsky_cache_on_disk
+days are also stored under
+    <config.clearsky_cache_directory>/<latitude>_<longitude>/<model>_<resolution>min_<timezone>/<date>.npy
+and read back by later program runs.
+
+Days missing from the cache are computed in one pvlib call. Ineichen needs the Linke turbidity climatology which pvlib
+reads from its HDF5 file on every call. Here the climatology is converted once to a .npy file in
+config.clearsky_cache_directory and memory mapped, only the 12 monthly values of each site are read from it.
+
+Example:
+clearsky = clearsky_cache.get_clearsky(datetime.datetime(2024, 6, 1), datetime.datetime(2024, 6, 3, 23, 59), site)
+"""
+
+import calendar
+import collections
+import os
+
+import h5py
+import numpy
+import pandas
+import pvlib
+from pvlib import location
+
+import config
+from helpers import time_conversions
+
+MODEL_COLUMNS = {"ineichen": ["ghi", "dni", "dhi"],
+                 "simplified_solis": ["ghi", "dni", "dhi"],
+                 "haurwitz": ["ghi"]}
+
+# memory mapped climatology of shape (2160 latitudes, 4320 longitudes, 12 months), values are 20 * turbidity. Rows
+# start from latitude 90 and columns from longitude -180
+__turbidity_map = None
+# monthly turbidity values of each grid cell which has been used
+__monthly_turbidity = {}
+# pvlib locations, creating one looks up the site altitude from a file
+__locations = {}
+# cached days, key is (latitude, longitude, model, resolution, timezone, date), value is a (columns, times) array
+__days = collections.OrderedDict()
+
+
+def get_clearsky(date_start, date_end, site, model="ineichen", resolution=None, timezone=None):
+    """
+    Clear sky irradiance in the same format as pvlib Location.get_clearsky() with a time column in front.
+    :param date_start: First timestamp, naive values are in timezone
+    :param date_end: Last timestamp, included
+    :param site: Dictionary of site parameters, latitude and longitude are used
+    :param model: "ineichen", "simplified_solis" or "haurwitz"
+    :param resolution: Minutes between timestamps, config.data_resolution by default
+    :param timezone: Timezone of the timestamps, config.timezone by default
+    :return: Dataframe with time, ghi, dni and dhi columns (only ghi for haurwitz)
+    """
+    if resolution is None:
+        resolution = config.data_resolution
+    if timezone is None:
+        timezone = config.timezone
+
+    times = pandas.date_range(start=date_start, end=date_end, freq=str(resolution) + "min", tz=timezone)
+    columns = MODEL_COLUMNS[model]
+    if len(times) == 0:
+        return __to_frame(times, numpy.empty((len(columns), 0)), columns)
+
+    # days are cached on a grid starting from midnight, other start times are computed directly
+    first_day = times[0].normalize()
+    if (times[0] - first_day) % pandas.Timedelta(minutes=resolution) != pandas.Timedelta(0):
+        return __to_frame(times, __compute(times, site, model, timezone), columns)
+
+    days = pandas.date_range(first_day.tz_localize(None), times[-1].normalize().tz_localize(None), freq="D")
+    keys = [(round(site["latitude"], 6), round(site["longitude"], 6), model, resolution, timezone,
+             day.strftime("%Y-%m-%d")) for day in days]
+
+    values = {key: __lookup(key) for key in keys}
+    missing = [(key, day) for key, day in zip(keys, days) if values[key] is None]
+    if missing:
+        values.update(__compute_days(missing, site, model, resolution, timezone))
+
+    day_times = time_conversions.from_utc_ns(numpy.concatenate(
+        [time_conversions.to_utc_ns(__day_times(day, resolution, timezone)) for day in days])).tz_convert(timezone)
+    day_values = numpy.concatenate([values[key] for key in keys], axis=1)
+
+    selected = (day_times >= times[0]) & (day_times <= times[-1])
+    return __to_frame(day_times[selected], day_values[:, selected], columns)
+
+
+def linke_turbidity(times, latitude, longitude):
+    """
+    Same values as pvlib.clearsky.lookup_linke_turbidity() without reading the HDF5 file. Monthly values are the values
+    of the middle day of each month and are interpolated linearly over days of the year, like in pvlib.
+    :param times: DatetimeIndex
+    :return: Series of Linke turbidity for times
+    """
+    latitude_index = __grid_index(latitude, 90, -90, 2160)
+    longitude_index = __grid_index(longitude, -180, 180, 4320)
+
+    key = (latitude_index, longitude_index)
+    if key not in __monthly_turbidity:
+        __monthly_turbidity[key] = numpy.array(turbidity_map()[latitude_index, longitude_index])
+
+    monthly = __monthly_turbidity[key]
+    # December of the year before and January of the next year cover the first and last half months
+    monthly = numpy.concatenate([[monthly[-1]], monthly, [monthly[0]]])
+    times_utc = times.tz_convert("UTC") if times.tz is not None else times
+    day_of_year = times_utc.dayofyear
+    turbidity = numpy.where(times_utc.is_leap_year,
+                            numpy.interp(day_of_year, __month_middles(True), monthly),
+                            numpy.interp(day_of_year, __month_middles(False), monthly))
+    return pandas.Series(turbidity / 20., index=times)
+
+
+def turbidity_map():
+    """
+    Linke turbidity climatology of pvlib as a memory mapped array, converted from HDF5 on first use.
+    """
+    global __turbidity_map
+    if __turbidity_map is None:
+        path = os.path.join(config.clearsky_cache_directory, "linke_turbidity.npy")
+        if not os.path.exists(path):
+            source = os.path.join(os.path.dirname(pvlib.__file__), "data", "LinkeTurbidities.h5")
+            with h5py.File(source, "r") as f:
+                turbidities = f["LinkeTurbidity"][:]
+            os.makedirs(config.clearsky_cache_directory, exist_ok=True)
+            # worker processes may convert at the same time, each one writes its own temporary file
+            temporary = path + "." + str(os.getpid()) + ".tmp.npy"
+            numpy.save(temporary, turbidities)
+            os.replace(temporary, path)
+        __turbidity_map = numpy.load(path, mmap_mode="r")
+    return __turbidity_map
+
+
+def get_location(latitude, longitude, timezone=None):
+    """
+    Cached pvlib Location, altitude is looked up only once per site.
+    """
+    if timezone is None:
+        timezone = config.timezone
+    key = (latitude, longitude, timezone)
+    if key not in __locations:
+        __locations[key] = location.Location(latitude, longitude, tz=timezone)
+    return __locations[key]
+
+
+def clear():
+    """
+    Empties the in-memory caches, files on disk are kept.
+    """
+    __days.clear()
+    __monthly_turbidity.clear()
+    __locations.clear()
+
+
+def __lookup(key):
+    if key in __days:
+        __days.move_to_end(key)
+        return __days[key]
+
+    if config.clearsky_cache_on_disk:
+        path = __day_path(key)
+        if os.path.exists(path):
+            values = numpy.load(path)
+            __store(key, values, write=False)
+            return values
+
+    return None
+
+
+def __store(key, values, write=True):
+    __days[key] = values
+    __days.move_to_end(key)
+    while len(__days) > config.clearsky_cache_days:
+        __days.popitem(last=False)
+
+    if write and config.clearsky_cache_on_disk:
+        path = __day_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = path + "." + str(os.getpid()) + ".tmp.npy"
+        numpy.save(temporary, values)
+        os.replace(temporary, path)
+
+
+def __compute_days(missing, site, model, resolution, timezone):
+    """
+    Computes all missing days with one pvlib call and stores them.
+    :return: Dictionary {key: (columns, times) array}
+    """
+    day_times = [__day_times(day, resolution, timezone) for _, day in missing]
+    times = time_conversions.from_utc_ns(numpy.concatenate([time_conversions.to_utc_ns(times) for times in day_times]))
+    values = __compute(times.tz_convert(timezone), site, model, timezone)
+
+    computed = {}
+    ends = numpy.cumsum([len(times) for times in day_times])
+    for (key, _), start, end in zip(missing, ends - [len(times) for times in day_times], ends):
+        computed[key] = numpy.ascontiguousarray(values[:, start:end])
+        __store(key, computed[key])
+    return computed
+
+
+def __compute(times, site, model, timezone):
+    site_location = get_location(site["latitude"], site["longitude"], timezone)
+    if model == "ineichen":
+        result = site_location.get_clearsky(times, model=model,
+                                            linke_turbidity=linke_turbidity(times, site["latitude"], site["longitude"]))
+    else:
+        result = site_location.get_clearsky(times, model=model)
+    return result[MODEL_COLUMNS[model]].to_numpy(dtype=numpy.float64).T
+
+
+def __day_times(day, resolution, timezone):
+    return pandas.date_range(start=day, end=day + pandas.Timedelta(days=1, minutes=-1), freq=str(resolution) + "min",
+                             tz=timezone)
+
+
+def __to_frame(times, values, columns):
+    frame = pandas.DataFrame(dict(zip(columns, values)), index=times)
+    frame.insert(loc=0, column="time", value=frame.index)
+    return frame
+
+
+def __day_path(key):
+    latitude, longitude, model, resolution, timezone, day = key
+    return os.path.join(config.clearsky_cache_directory, str(latitude) + "_" + str(longitude),
+                        model + "_" + str(resolution) + "min_" + timezone.replace("/", "-"), day + ".npy")
+
+
+def __grid_index(degrees, first, last, cells):
+    """
+    Index of the climatology cell containing a coordinate.
+    :param first: Coordinate of the edge of the first cell, 90 for latitudes and -180 for longitudes
+    :param last: Coordinate of the edge of the last cell
+    :param cells: Number of cells between first and last
+    """
+    index = (degrees - first) * cells / (last - first) - 0.5
+    # coordinates on the outer edges are within rounding of the first and last cells
+    if -0.500001 <= index < 0:
+        return 0
+    if cells - 1 < index <= cells - 1 + 0.500001:
+        return cells - 1
+    if not 0 <= index <= cells - 1:
+        raise ValueError("Coordinate " + str(degrees) + " is out of range (" + str(first) + ", " + str(last) + ")")
+    return int(numpy.around(index))
+
+
+def __month_middles(leap):
+    """
+    Days of the year at the middle of each month, with the middles of December before and January after the year.
+    """
+    days = numpy.array(calendar.mdays[1:], dtype=float)
+    if leap:
+        days[1] += 1
+    return numpy.concatenate([[-days[-1] / 2], numpy.cumsum(days) - days / 2, [days.sum() + days[0] / 2]])
@@ -0,0 +1,195 @@
+"""
+Resampling and alignment of hourly fmi open data to other time grids.
+
+FMI open irradiance values are interval averages, after _meps_data_loader the timestamp of each value is the center of
+the hour it describes. Air temperature, wind speed, cloud cover and albedo are treated as instantaneous values.
+
+Interval averaged columns are resampled conservatively: cumulative energy is computed at source interval edges,
+interpolated to target interval edges and differentiated back to averages. Hourly energy is preserved for any target
+grid, also when target timestamps do not line up with source timestamps.
+Instantaneous columns are interpolated linearly, values outside the source range are held constant.
+
+All time searches are done on sorted int64 nanosecond arrays. Functions in this file never modify config values, the
+target resolution is always given as a parameter.
+"""
+
+import numpy
+import pandas
+
+from helpers import time_conversions
+
+# fmi open columns which describe averages over an interval
+INTERVAL_AVERAGE_COLUMNS = ["dni", "dhi", "ghi", "dir_hi"]
+
+# fmi open columns which describe values at an instant
+INSTANTANEOUS_COLUMNS = ["T", "wind", "cloud_cover", "albedo"]
+
+NANOSECONDS_PER_MINUTE = 60 * 1_000_000_000
+
+
+def get_time_grid(date_start, date_end, resolution):
+    """
+    Generates a UTC time grid from date_start to date_end.
+    :param date_start: First timestamp of the grid
+    :param date_end: Last timestamp included in the grid
+    :param resolution: Minutes between timestamps
+    :return: int64 nanosecond array
+    """
+    step = int(resolution * NANOSECONDS_PER_MINUTE)
+    return numpy.arange(time_conversions.to_utc_ns(date_start), time_conversions.to_utc_ns(date_end) + 1, step,
+                        dtype=numpy.int64)
+
+
+def resample_interval_averages(source_times, values, target_times, source_interval=60, target_interval=None,
+                               method="linear"):
+    """
+    Maps interval averaged values to a new time grid while preserving energy.
+    :param source_times: Sorted int64 nanosecond array, centers of source intervals
+    :param values: Averages over source intervals, nan values mark missing data
+    :param target_times: Sorted int64 nanosecond array, centers of target intervals
+    :param source_interval: Source interval length in minutes
+    :param target_interval: Target interval length in minutes, spacing of target_times by default
+    :param method: "linear" gives constant values inside each source interval, "pchip" gives a smooth curve which still
+    preserves the energy of each source interval
+    :return: float array of averages over target intervals, nan outside source coverage or where source data is missing
+    """
+    source_times = numpy.asarray(source_times, dtype=numpy.int64)
+    target_times = numpy.asarray(target_times, dtype=numpy.int64)
+    values = numpy.asarray(values, dtype=numpy.float64)
+
+    if target_interval is None:
+        target_interval = __grid_spacing_minutes(target_times, source_interval)
+
+    source_half = source_interval * NANOSECONDS_PER_MINUTE / 2
+    target_half = target_interval * NANOSECONDS_PER_MINUTE / 2
+
+    # source interval edges, float seconds relative to first edge keep the cumulative sums accurate
+    origin = source_times[0] - source_half
+    source_edges = numpy.append(source_times - source_half, source_times[-1] + source_half) - origin
+    source_edges = source_edges / 1e9
+    target_starts = (target_times - target_half - origin) / 1e9
+    target_ends = (target_times + target_half - origin) / 1e9
+
+    # cumulative energy at source edges, missing values are counted separately so they can be masked afterwards
+    missing = numpy.isnan(values)
+    energy = numpy.where(missing, 0.0, values) * numpy.diff(source_edges)
+    cumulative_energy = numpy.concatenate(([0.0], numpy.cumsum(energy)))
+    cumulative_missing = numpy.concatenate(([0], numpy.cumsum(missing)))
+
+    # target intervals partially outside the source range are averaged over the covered part only
+    outside = (target_ends <= source_edges[0]) | (target_starts >= source_edges[-1])
+    target_starts = numpy.clip(target_starts, source_edges[0], source_edges[-1])
+    target_ends = numpy.clip(target_ends, source_edges[0], source_edges[-1])
+    outside = outside | (target_ends <= target_starts)
+
+    if method == "pchip":
+        from scipy.interpolate import PchipInterpolator
+        interpolator = PchipInterpolator(source_edges, cumulative_energy)
+        energy_at_starts = interpolator(target_starts)
+        energy_at_ends = interpolator(target_ends)
+    else:
+        energy_at_starts = numpy.interp(target_starts, source_edges, cumulative_energy)
+        energy_at_ends = numpy.interp(target_ends, source_edges, cumulative_energy)
+
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        averages = (energy_at_ends - energy_at_starts) / (target_ends - target_starts)
+
+    # masking target intervals which overlap missing source data or fall outside the source range
+    first = numpy.clip(numpy.searchsorted(source_edges, target_starts, side="right") - 1, 0, len(values))
+    last = numpy.clip(numpy.searchsorted(source_edges, target_ends, side="left"), 0, len(values))
+    overlaps_missing = cumulative_missing[last] - cumulative_missing[first] > 0
+    averages[outside | overlaps_missing] = numpy.nan
+
+    # small negative values can appear from floating point errors
+    return numpy.maximum(averages, 0.0, where=~numpy.isnan(averages), out=averages)
+
+
+def interpolate_instantaneous(source_times, values, target_times):
+    """
+    Linear interpolation of instantaneous values to new timestamps. Missing source values are skipped, values before
+    the first and after the last valid source value are held constant.
+    :param source_times: Sorted int64 nanosecond array
+    :param values: Source values
+    :param target_times: int64 nanosecond array
+    :return: float array of interpolated values, all nan if source has no valid values
+    """
+    values = numpy.asarray(values, dtype=numpy.float64)
+    valid = ~numpy.isnan(values)
+    if not valid.any():
+        return numpy.full(len(target_times), numpy.nan)
+
+    source_times = numpy.asarray(source_times, dtype=numpy.int64)[valid]
+    origin = source_times[0]
+
+    return numpy.interp((numpy.asarray(target_times, dtype=numpy.int64) - origin).astype(numpy.float64),
+                        (source_times - origin).astype(numpy.float64), values[valid])
+
+
+def resample_fmi_frame(df, resolution, date_start=None, date_end=None, method="linear"):
+    """
+    Resamples an fmi open dataframe from solar_irradiance_estimator to the given resolution.
+    :param df: Dataframe with time column at hourly interval centers
+    :param resolution: Target resolution in minutes, for example config.data_resolution
+    :param date_start: First target timestamp. By default the target grid starts from the center of the first target
+    interval inside the source range, first source interval start + resolution / 2
+    :param date_end: Last target timestamp, last source interval end - resolution / 2 by default. With the default
+    grid every target interval lies inside the source range and the energy of the source is kept in the sum of targets
+    :param method: Interval average resampling method, see resample_interval_averages()
+    :return: New dataframe with time column and time index on the target grid
+    """
+    source_times = time_conversions.to_utc_ns(df["time"])
+    order = numpy.argsort(source_times, kind="stable")
+    source_times = source_times[order]
+
+    # target intervals centered on source edges would be averaged over their covered half only and count the edge twice
+    half_hour = 30 * NANOSECONDS_PER_MINUTE
+    half_target = int(resolution * NANOSECONDS_PER_MINUTE / 2)
+    if date_start is None:
+        date_start = time_conversions.from_utc_ns([source_times[0] - half_hour + half_target])[0]
+    if date_end is None:
+        date_end = time_conversions.from_utc_ns([source_times[-1] + half_hour - half_target])[0]
+    target_times = get_time_grid(date_start, date_end, resolution)
+
+    resampled = {}
+    for column in df.columns:
+        if column in INTERVAL_AVERAGE_COLUMNS:
+            resampled[column] = resample_interval_averages(source_times, df[column].to_numpy(dtype=float)[order],
+                                                           target_times, target_interval=resolution, method=method)
+        elif column in INSTANTANEOUS_COLUMNS:
+            resampled[column] = interpolate_instantaneous(source_times, df[column].to_numpy(dtype=float)[order],
+                                                          target_times)
+
+    times = time_conversions.from_utc_ns(target_times)
+    output = pandas.DataFrame(resampled, index=times)
+    output.insert(loc=0, column="time", value=times)
+
+    return output
+
+
+def align_columns(target_df, donor_df, columns):
+    """
+    Copies instantaneous columns from donor_df to the timestamps of target_df, for example wind and air temperature
+    from fmi open data to a pvlib dataframe. Rows of target_df are not changed or reordered.
+    :param target_df: Dataframe with time column
+    :param donor_df: Dataframe with time column and given columns
+    :param columns: List of column names
+    :return: target_df with interpolated columns
+    """
+    donor_times = time_conversions.to_utc_ns(donor_df["time"])
+    order = numpy.argsort(donor_times, kind="stable")
+    target_times = time_conversions.to_utc_ns(target_df["time"])
+
+    for column in columns:
+        target_df[column] = interpolate_instantaneous(donor_times[order],
+                                                      donor_df[column].to_numpy(dtype=float)[order], target_times)
+
+    return target_df
+
+
+def __grid_spacing_minutes(times, default):
+    """
+    Returns the median spacing of a time grid in minutes, default for grids with less than 2 timestamps.
+    """
+    if len(times) < 2:
+        return default
+    return float(numpy.median(numpy.diff(times))) / NANOSECONDS_PER_MINUTE
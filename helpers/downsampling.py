@@ -0,0 +1,143 @@
+"""
+Downsampling of long curves for plotting.
+
+A plot is only a few thousand pixels wide, drawing hundreds of thousands of points per line makes rendering slow and
+saved files large without showing anything more. Functions in this file select a subset of points which keeps the
+visual shape of a curve:
+
+"minmax"    min/max envelope. The x range is split into equally wide columns and the smallest and the largest value of
+            each column are kept. Every peak and every dip of the original curve stays in the plot.
+"lttb"      Largest-Triangle-Three-Buckets. Points are split into buckets and from each bucket the point which forms the
+            largest triangle with the neighbouring buckets is kept. Gives smoother looking curves than minmax. The
+            neighbouring buckets are represented by their averages so that all buckets are computed at once, the global
+            maximum and minimum are always kept.
+
+Both methods always keep the first and the last point, nan values are skipped.
+
+Example:
+x, y = downsampling.downsample(data["time"], data["output"], max_points=2000)
+"""
+
+import numpy
+import pandas
+
+from helpers import time_conversions
+
+
+def downsample(x, y, max_points, method="minmax"):
+    """
+    Returns a subset of points for plotting. Curves with max_points points or less are returned unchanged.
+    :param x: Sorted x values, numbers or timestamps
+    :param y: y values
+    :param max_points: Maximum number of returned points
+    :param method: "minmax" or "lttb"
+    :return: Tuple (x, y) of the same types as given
+    """
+    if max_points is None or len(y) <= max_points:
+        return x, y
+
+    x_numeric = __as_numeric(x)
+    y_numeric = numpy.asarray(y, dtype=numpy.float64)
+
+    match method:
+        case "minmax":
+            indices = minmax_indices(x_numeric, y_numeric, max(max_points // 2, 1))
+        case "lttb":
+            indices = lttb_indices(x_numeric, y_numeric, max_points)
+        case _:
+            raise ValueError("Unknown downsampling method \"" + str(method) + "\", use \"minmax\" or \"lttb\"")
+
+    return __take(x, indices), __take(y, indices)
+
+
+def minmax_indices(x, y, columns):
+    """
+    Indices of the smallest and the largest value in each of equally wide x columns.
+    :param x: Sorted float array
+    :param y: float array
+    :param columns: Number of columns, at most 2 * columns + 2 indices are returned
+    :return: Sorted int array of indices
+    """
+    valid = numpy.flatnonzero(~numpy.isnan(y))
+    if len(valid) == 0:
+        return numpy.array([0, len(y) - 1]) if len(y) else numpy.empty(0, dtype=int)
+
+    span = x[-1] - x[0]
+    if span <= 0:
+        column = numpy.zeros(len(valid), dtype=numpy.int64)
+    else:
+        column = numpy.minimum(((x[valid] - x[0]) / span * columns).astype(numpy.int64), columns - 1)
+
+    # sorting by column and value, first index of every column is its minimum and last index its maximum
+    order = numpy.lexsort((y[valid], column))
+    starts = numpy.flatnonzero(numpy.diff(column[order], prepend=-1))
+    ends = numpy.append(starts[1:], len(order)) - 1
+
+    return numpy.unique(numpy.concatenate(([0, len(y) - 1], valid[order[starts]], valid[order[ends]])))
+
+
+def lttb_indices(x, y, max_points):
+    """
+    Largest-Triangle-Three-Buckets with bucket averages as triangle corners, computed for all buckets at once.
+    :param x: Sorted float array
+    :param y: float array
+    :param max_points: Number of buckets including the first and the last point
+    :return: Sorted int array of indices
+    """
+    valid = numpy.flatnonzero(~numpy.isnan(y))
+    if len(valid) <= max_points or max_points < 3:
+        return valid
+
+    x_valid = x[valid]
+    y_valid = y[valid]
+
+    # first and last point are buckets of their own, the rest is split into buckets of equal point count
+    bucket_count = max_points - 2
+    edges = numpy.linspace(1, len(valid) - 1, bucket_count + 1).astype(numpy.int64)
+    bucket = numpy.searchsorted(edges, numpy.arange(1, len(valid) - 1), side="right") - 1
+
+    counts = numpy.diff(edges)
+    average_x = numpy.add.reduceat(x_valid[1:-1], edges[:-1] - 1) / counts
+    average_y = numpy.add.reduceat(y_valid[1:-1], edges[:-1] - 1) / counts
+
+    # triangle corners: previous bucket average, candidate point and next bucket average
+    previous_x = numpy.concatenate(([x_valid[0]], average_x[:-1]))[bucket]
+    previous_y = numpy.concatenate(([y_valid[0]], average_y[:-1]))[bucket]
+    next_x = numpy.concatenate((average_x[1:], [x_valid[-1]]))[bucket]
+    next_y = numpy.concatenate((average_y[1:], [y_valid[-1]]))[bucket]
+
+    candidate_x = x_valid[1:-1]
+    candidate_y = y_valid[1:-1]
+    area = numpy.abs((previous_x - next_x) * (candidate_y - previous_y)
+                     - (previous_x - candidate_x) * (next_y - previous_y))
+
+    # largest area of each bucket is the last one when sorted by bucket and area
+    order = numpy.lexsort((area, bucket))
+    last_of_bucket = numpy.append(numpy.flatnonzero(numpy.diff(bucket[order])), len(order) - 1)
+    selected = order[last_of_bucket] + 1
+
+    extremes = [0, numpy.argmax(y_valid), numpy.argmin(y_valid), len(valid) - 1]
+    return valid[numpy.unique(numpy.concatenate((extremes, selected)))]
+
+
+def __as_numeric(x):
+    """
+    Converts x values to floats, timestamps to nanoseconds since epoch.
+    """
+    if isinstance(x, (pandas.Series, pandas.Index)) and pandas.api.types.is_datetime64_any_dtype(x):
+        return time_conversions.to_utc_ns(x).astype(numpy.float64)
+
+    values = numpy.asarray(x)
+    if numpy.issubdtype(values.dtype, numpy.datetime64):
+        return values.astype("datetime64[ns]").astype(numpy.int64).astype(numpy.float64)
+    if values.dtype == object:
+        return time_conversions.to_utc_ns(values).astype(numpy.float64)
+    return values.astype(numpy.float64)
+
+
+def __take(values, indices):
+    if isinstance(values, pandas.Series):
+        return values.iloc[indices]
+    if isinstance(values, pandas.Index):
+        return values[indices]
+    return numpy.asarray(values)[indices]
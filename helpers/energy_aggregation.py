@@ -0,0 +1,120 @@
+"""
+Aggregation of power output to energy over local calendar periods.
+
+Power values are integrated to energy with the actual spacing of their timestamps. Each value describes the interval
+halfway to its neighbouring timestamps, so hourly fmi open data, 15 minute pvlib data and irregular measurements are
+all handled by the same code. Gaps longer than the typical spacing are not integrated over, a missing day of data
+does not turn the last value before it into a day worth of energy.
+
+Energy is summed over hours, days or months of the local calendar, config.local_timezone by default. Days follow
+summer and winter time, a day can be 23 or 25 hours long. All functions return plain arrays:
+    period_starts   DatetimeIndex of period start times in the local timezone
+    energy          float array of energy in kWh for each period
+
+Example:
+days, kwh = energy_aggregation.daily_energy(data["time"], data["output"])
+"""
+
+import numpy
+import pandas
+
+import config
+from helpers import time_conversions
+
+NANOSECONDS_PER_HOUR = 3600 * 1_000_000_000
+
+
+def sample_durations(times):
+    """
+    Duration represented by each timestamp, half of the distance to the previous and next timestamps. Distances longer
+    than 1.5 times the median spacing are treated as gaps and replaced by the median spacing.
+    :param times: Sorted int64 nanosecond array
+    :return: float array of durations in hours
+    """
+    times = numpy.asarray(times, dtype=numpy.int64)
+    if len(times) < 2:
+        return numpy.ones(len(times))
+
+    spacing = numpy.diff(times).astype(numpy.float64)
+    typical = numpy.median(spacing)
+    spacing = numpy.where(spacing > 1.5 * typical, typical, spacing)
+
+    # first and last timestamps only have one neighbour, their interval is assumed symmetric
+    before = numpy.concatenate(([spacing[0]], spacing))
+    after = numpy.concatenate((spacing, [spacing[-1]]))
+
+    return (before + after) / 2 / NANOSECONDS_PER_HOUR
+
+
+def period_index(times, period="day", timezone=None):
+    """
+    Assigns each timestamp to a local calendar period.
+    :param times: Timestamps, naive values are interpreted as UTC
+    :param period: "hour", "day" or "month"
+    :param timezone: Local timezone, config.local_timezone by default
+    :return: Tuple (int array of period numbers starting from 0, DatetimeIndex of period starts)
+    """
+    if timezone is None:
+        timezone = config.local_timezone
+
+    utc_times = time_conversions.from_utc_ns(time_conversions.to_utc_ns(times))
+    local_times = utc_times.tz_convert(timezone)
+
+    match period:
+        case "hour":
+            # flooring in UTC avoids ambiguous local hours when summer time ends
+            keys = utc_times.floor("h").tz_convert(timezone)
+        case "day":
+            keys = local_times.normalize()
+        case "month":
+            keys = local_times.tz_localize(None).to_period("M").to_timestamp().tz_localize(timezone)
+        case _:
+            raise ValueError("Unknown period \"" + str(period) + "\", use \"hour\", \"day\" or \"month\"")
+
+    codes, period_starts = pandas.factorize(keys, sort=True)
+    return codes, pandas.DatetimeIndex(period_starts)
+
+
+def aggregate_energy(times, power, period="day", timezone=None):
+    """
+    Integrates power to energy and sums it over local calendar periods. Nan power values are counted as zero.
+    :param times: Timestamps, sorted or unsorted
+    :param power: Power in W for each timestamp
+    :param period: "hour", "day" or "month"
+    :param timezone: Local timezone, config.local_timezone by default
+    :return: Tuple (DatetimeIndex of period starts, float array of energy in kWh)
+    """
+    times = time_conversions.to_utc_ns(times)
+    power = numpy.asarray(power, dtype=numpy.float64)
+    if len(times) == 0:
+        return pandas.DatetimeIndex([], tz=timezone or config.local_timezone), numpy.empty(0)
+
+    order = numpy.argsort(times, kind="stable")
+    times = times[order]
+    power = numpy.nan_to_num(power[order])
+
+    energy = power * sample_durations(times) / 1000
+    codes, period_starts = period_index(times, period, timezone)
+
+    return period_starts, numpy.bincount(codes, weights=energy, minlength=len(period_starts))
+
+
+def hourly_energy(times, power, timezone=None):
+    """
+    Energy in kWh for each local hour, see aggregate_energy()
+    """
+    return aggregate_energy(times, power, "hour", timezone)
+
+
+def daily_energy(times, power, timezone=None):
+    """
+    Energy in kWh for each local calendar day, see aggregate_energy()
+    """
+    return aggregate_energy(times, power, "day", timezone)
+
+
+def monthly_energy(times, power, timezone=None):
+    """
+    Energy in kWh for each local calendar month, see aggregate_energy()
+    """
+    return aggregate_energy(times, power, "month", timezone)
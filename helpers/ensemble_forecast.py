@@ -0,0 +1,100 @@
+"""
+Probabilistic forecasts from the MEPS ensemble.
+
+All ensemble members of the MEPS point forecast are processed at once as (member, time) arrays, see
+solar_irradiance_estimator.get_ensemble_irradiance(). Solar geometry, turbidity free steps and parsing are shared by
+all members, only the elementwise steps of the pipeline are repeated per member, so adding members is cheap.
+
+Results are quantiles over members, config.ensemble_quantiles (P10, P50 and P90) by default:
+    power   Dataframe indexed like fmi open data with a time column and one column per quantile, for example "p10", W
+    energy  Dataframe indexed by local days with one column per quantile, kWh. Quantiles are taken over the daily
+            energies of the members, not summed from power quantiles.
+
+Example:
+power, energy = ensemble_forecast.forecast_ensemble(datetime.datetime(2024, 6, 1), day_count=2)
+"""
+
+import numpy
+import pandas
+
+import config
+from helpers import astronomical_calculations
+from helpers import energy_aggregation
+from helpers import pipeline
+from helpers import site_parameters
+from helpers import solar_irradiance_estimator
+from helpers import time_conversions
+
+
+def forecast_ensemble(date_start, day_count, site=None, members=None, quantiles=None):
+    """
+    Fetches the MEPS ensemble and returns power and daily energy quantiles over members.
+    :param date_start: First day
+    :param day_count: Number of days
+    :param site: Optional dictionary of site parameters, see site_parameters.get_site_parameters()
+    :param members: List of member numbers, all config.meps_ensemble_members members by default
+    :param quantiles: List of quantiles in range [0, 1], config.ensemble_quantiles by default
+    :return: Tuple (power dataframe, energy dataframe)
+    """
+    site = site_parameters.get_site_parameters(site)
+    ensemble = solar_irradiance_estimator.get_ensemble_irradiance(date_start, day_count, site, members)
+    output = member_output(ensemble, site)
+    return (power_quantiles(ensemble["index"], ensemble["time"], output, quantiles),
+            daily_energy_quantiles(ensemble["time"], output, quantiles))
+
+
+def member_output(ensemble, site=None):
+    """
+    Runs the pipeline for all members in one pass.
+    :param ensemble: Dictionary from solar_irradiance_estimator.get_ensemble_irradiance()
+    :return: Power output array of shape (members, times) in W
+    """
+    site = site_parameters.get_site_parameters(site)
+    geometry = astronomical_calculations.get_solar_geometry(ensemble["time"], site["latitude"], site["longitude"])
+    return pipeline.process_arrays(ensemble["dni"], ensemble["dhi"], ensemble["ghi"], geometry, site,
+                                   albedo=ensemble["albedo"], air_temperature=ensemble["T"], wind=ensemble["wind"])
+
+
+def power_quantiles(index, times, output, quantiles=None):
+    """
+    :param index: Index of the output columns, interval end times
+    :param times: Timestamps of the output columns
+    :param output: Power array of shape (members, times)
+    :return: Dataframe with time column and one column per quantile
+    """
+    if quantiles is None:
+        quantiles = config.ensemble_quantiles
+
+    values = numpy.quantile(output, quantiles, axis=0)
+    power = pandas.DataFrame({__column_name(q): row for q, row in zip(quantiles, values)}, index=index)
+    power.insert(loc=0, column="time", value=times)
+    return power
+
+
+def daily_energy_quantiles(times, output, quantiles=None, timezone=None):
+    """
+    Daily energy of each member and its quantiles over members.
+    :param times: Timestamps of the output columns
+    :param output: Power array of shape (members, times)
+    :param timezone: Local timezone of days, config.local_timezone by default
+    :return: Dataframe indexed by local day starts with one column per quantile, kWh
+    """
+    if quantiles is None:
+        quantiles = config.ensemble_quantiles
+
+    times = time_conversions.to_utc_ns(times)
+    order = numpy.argsort(times, kind="stable")
+    durations = energy_aggregation.sample_durations(times[order])
+    codes, days = energy_aggregation.period_index(times[order], "day", timezone)
+
+    # energy of each member per sample, summed over days for all members at once
+    energy = numpy.nan_to_num(output[:, order]) * durations / 1000
+    boundaries = numpy.flatnonzero(numpy.diff(codes, prepend=-1))
+    daily = numpy.add.reduceat(energy, boundaries, axis=1)
+
+    values = numpy.quantile(daily, quantiles, axis=0)
+    return pandas.DataFrame({__column_name(q): row for q, row in zip(quantiles, values)}, index=days)
+
+
+def __column_name(quantile):
+    return "p" + str(int(round(quantile * 100)))
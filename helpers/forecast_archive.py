@@ -0,0 +1,219 @@
+"""
+Columnar local archive for fetched FMI frames and pipeline results.
+
+Every archived frame is stored as one partition under
+    <config.archive_directory>/site=<site name>/kind=<frame kind>/run=<run time>/
+Each partition contains three files:
+    time.npy    int64 nanoseconds since epoch in UTC, sorted
+    values.npy  float64 array with shape (column count, row count), each column is stored contiguously
+    meta.json   column names, row count, run time and the first and last timestamp of the partition
+
+Reading is done with memory mapped numpy arrays. Partitions are pruned by run time from directory names and by the time
+range stored in meta.json before any data is touched, and rows inside partitions are selected with a binary search on
+the sorted time column. This keeps reading back a year of history fast enough for backtests.
+
+Frame kinds used by the project:
+"fmi"           raw frame returned by _meps_data_loader.collect_fmi_opendata()
+"fmi_output"    fmi open based pipeline result from main.get_fmi_data()
+"pvlib_output"  clear sky pipeline result from main.get_pvlib_data()
+"""
+
+import datetime
+import json
+import os
+import shutil
+
+import numpy
+import pandas
+
+import config
+from helpers import time_conversions
+
+RUN_TIME_FORMAT = "%Y%m%dT%H%MZ"
+
+
+def archive_frame(df, kind, site=None, run_time=None, root=None):
+    """
+    Stores numeric columns of a dataframe as a new archive partition. Rows are sorted by time before storing. If a
+    partition with the same site, kind and run time exists, it is replaced.
+    :param df: Dataframe with a "time" column
+    :param kind: Frame kind, for example "fmi" or "fmi_output"
+    :param site: Site name, config.site_name by default
+    :param run_time: Datetime of the forecast run, current UTC time by default
+    :param root: Archive root directory, config.archive_directory by default
+    :return: Path to the written partition
+    """
+
+    if "time" not in df.columns:
+        print("No time column in given dataframe, frame can not be archived")
+        return None
+
+    partition = __partition_path(kind, site, __normalize_run_time(run_time), root)
+
+    times = time_conversions.to_utc_ns(df["time"])
+    order = numpy.argsort(times, kind="stable")
+
+    # only numeric columns are stored, time is stored separately
+    columns = [column for column in df.columns
+               if column != "time" and pandas.api.types.is_numeric_dtype(df[column])]
+    values = numpy.empty((len(columns), len(df)), dtype=numpy.float64)
+    for i, column in enumerate(columns):
+        values[i] = df[column].to_numpy(dtype=numpy.float64, na_value=numpy.nan)[order]
+    times = times[order]
+
+    meta = {"columns": columns,
+            "rows": int(len(times)),
+            "run_time": os.path.basename(partition)[len("run="):],
+            "start": int(times[0]) if len(times) else None,
+            "end": int(times[-1]) if len(times) else None}
+
+    # writing to a temporary directory first and renaming it, readers never see half written partitions
+    temporary = partition + ".tmp"
+    shutil.rmtree(temporary, ignore_errors=True)
+    os.makedirs(temporary)
+    numpy.save(os.path.join(temporary, "time.npy"), times)
+    numpy.save(os.path.join(temporary, "values.npy"), values)
+    with open(os.path.join(temporary, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+    shutil.rmtree(partition, ignore_errors=True)
+    os.replace(temporary, partition)
+
+    return partition
+
+
+def list_runs(kind, site=None, run_start=None, run_end=None, root=None):
+    """
+    Lists archived run times for a site and frame kind.
+    :param kind: Frame kind
+    :param site: Site name, config.site_name by default
+    :param run_start: Optional, earliest run time included
+    :param run_end: Optional, latest run time included
+    :param root: Archive root directory, config.archive_directory by default
+    :return: Sorted list of UTC run time timestamps
+    """
+    directory = __kind_path(kind, site, root)
+    if not os.path.isdir(directory):
+        return []
+
+    runs = []
+    for name in os.listdir(directory):
+        if not name.startswith("run=") or name.endswith(".tmp"):
+            continue
+        runs.append(pandas.Timestamp(datetime.datetime.strptime(name[len("run="):], RUN_TIME_FORMAT), tz="UTC"))
+
+    if run_start is not None:
+        runs = [run for run in runs if run >= __to_utc_timestamp(run_start)]
+    if run_end is not None:
+        runs = [run for run in runs if run <= __to_utc_timestamp(run_end)]
+
+    return sorted(runs)
+
+
+def read_archive(kind, site=None, start=None, end=None, run_start=None, run_end=None, columns=None,
+                 latest_only=False, root=None):
+    """
+    Reads archived frames back as a single dataframe. Time range filters are pushed down to partition and row level so
+    only the requested rows are read from disk.
+    :param kind: Frame kind
+    :param site: Site name, config.site_name by default
+    :param start: Optional, first timestamp included
+    :param end: Optional, last timestamp included
+    :param run_start: Optional, earliest run time included
+    :param run_end: Optional, latest run time included
+    :param columns: Optional list of column names, all columns by default
+    :param latest_only: If True, only the row from the latest run is kept for each timestamp
+    :param root: Archive root directory, config.archive_directory by default
+    :return: Dataframe with time and run_time columns and the archived value columns, sorted by time and run time
+    """
+    start_ns = None if start is None else time_conversions.to_utc_ns(start)
+    end_ns = None if end is None else time_conversions.to_utc_ns(end)
+
+    time_parts = []
+    run_parts = []
+    value_parts = []
+    column_names = columns
+
+    for run in list_runs(kind, site, run_start, run_end, root):
+        partition = __partition_path(kind, site, run, root)
+        with open(os.path.join(partition, "meta.json")) as f:
+            meta = json.load(f)
+
+        # partition level pruning, skips partitions which do not overlap with the requested range
+        if meta["rows"] == 0:
+            continue
+        if start_ns is not None and meta["end"] < start_ns:
+            continue
+        if end_ns is not None and meta["start"] > end_ns:
+            continue
+
+        if column_names is None:
+            column_names = meta["columns"]
+
+        # row level pruning with binary search on the sorted, memory mapped time column
+        times = numpy.load(os.path.join(partition, "time.npy"), mmap_mode="r")
+        first = 0 if start_ns is None else int(numpy.searchsorted(times, start_ns, side="left"))
+        last = len(times) if end_ns is None else int(numpy.searchsorted(times, end_ns, side="right"))
+        if first >= last:
+            continue
+
+        values = numpy.load(os.path.join(partition, "values.npy"), mmap_mode="r")
+        selected = numpy.full((len(column_names), last - first), numpy.nan)
+        for i, column in enumerate(column_names):
+            if column in meta["columns"]:
+                selected[i] = values[meta["columns"].index(column), first:last]
+
+        time_parts.append(numpy.asarray(times[first:last]))
+        run_parts.append(numpy.full(last - first, time_conversions.to_utc_ns(run), dtype=numpy.int64))
+        value_parts.append(selected)
+
+    if not time_parts:
+        return pandas.DataFrame(columns=["time", "run_time"] + list(column_names or []))
+
+    times = numpy.concatenate(time_parts)
+    runs = numpy.concatenate(run_parts)
+    values = numpy.concatenate(value_parts, axis=1)
+
+    # sorting by time and run time, latest run last for each timestamp
+    order = numpy.lexsort((runs, times))
+    times, runs, values = times[order], runs[order], values[:, order]
+
+    if latest_only:
+        # last row of every group of equal timestamps is the one from the latest run
+        keep = numpy.ones(len(times), dtype=bool)
+        keep[:-1] = times[1:] != times[:-1]
+        times, runs, values = times[keep], runs[keep], values[:, keep]
+
+    df = pandas.DataFrame(dict(zip(column_names, values)))
+    df.insert(loc=0, column="run_time", value=time_conversions.from_utc_ns(runs))
+    df.insert(loc=0, column="time", value=time_conversions.from_utc_ns(times))
+
+    return df
+
+
+def __normalize_run_time(run_time):
+    """
+    Returns run time as a UTC timestamp with minute precision, current time by default.
+    """
+    if run_time is None:
+        run_time = datetime.datetime.now(datetime.timezone.utc)
+    return __to_utc_timestamp(run_time).floor("min")
+
+
+def __to_utc_timestamp(value):
+    timestamp = pandas.Timestamp(value)
+    if timestamp.tzinfo is None:
+        return timestamp.tz_localize("UTC")
+    return timestamp.tz_convert("UTC")
+
+
+def __kind_path(kind, site, root):
+    if root is None:
+        root = config.archive_directory
+    if site is None:
+        site = config.site_name
+    return os.path.join(root, "site=" + str(site), "kind=" + str(kind))
+
+
+def __partition_path(kind, site, run_time, root):
+    return os.path.join(__kind_path(kind, site, root), "run=" + run_time.strftime(RUN_TIME_FORMAT))
@@ -27,6 +27,7 @@ import pandas
 import pvlib.irradiance
 
 import helpers.astronomical_calculations as astronomical_calculations
+import helpers.shading as shading
 import config
 
 
@@ -174,3 +175,90 @@ def __project_ghi_to_panel_surface(ghi, albedo=config.albedo):
     step1 = (1.0-math.cos(numpy.radians(config.tilt)))/2
     step2 = ghi*albedo * step1
     return step2 # ghi * config.albedo * ((1.0 - math.cos(numpy.radians(config.tilt))) / 2.0)
+
+
+"""
+VECTORIZED PROJECTION FUNCTIONS
+Same projections as above computed for whole arrays at once. Irradiance arrays can have extra leading dimensions, for
+example ensemble members or parameter samples, solar geometry arrays are broadcast along the last dimension.
+"""
+
+
+def project_to_panel_surface_arrays(dni, dhi, ghi, geometry, albedo=None, tilt=None, azimuth=None,
+                                    site_shading=None):
+    """
+    Projects dni, dhi and ghi arrays to the panel surface.
+    :param dni: Direct normal irradiance array
+    :param dhi: Diffuse horizontal irradiance array
+    :param ghi: Global horizontal irradiance array
+    :param geometry: Solar geometry dataframe from astronomical_calculations.get_solar_geometry()
+    :param albedo: Ground albedo, float or array broadcastable to ghi. config.albedo by default
+    :param tilt: Panel tilt, config.tilt by default
+    :param azimuth: Panel azimuth, config.azimuth by default
+    :param site_shading: Optional horizon and near shading from shading.get_site_shading(). Direct and circumsolar
+    irradiance are masked by the sun position, isotropic diffuse by the hidden share of the sky.
+    :return: dni_poa, dhi_poa, ghi_poa arrays
+    """
+    if albedo is None:
+        albedo = config.albedo
+    if tilt is None:
+        tilt = config.tilt
+    if azimuth is None:
+        azimuth = config.azimuth
+
+    solar_azimuth = geometry["azimuth"].to_numpy()
+    solar_zenith = geometry["apparent_zenith"].to_numpy()
+
+    # dni, same as __project_dni_to_panel_surface_using_time()
+    angle_of_incidence = astronomical_calculations.get_solar_angle_of_incidence_array(solar_azimuth, solar_zenith,
+                                                                                      tilt, azimuth)
+    dni_poa = numpy.abs(dni * numpy.cos(numpy.radians(angle_of_incidence)))
+
+    # dhi with perez model, same as __project_dhi_to_panel_surface_perez(). Zero dhi is projected as zero.
+    dhi = numpy.asarray(dhi, dtype=float)
+    dhi_perez = pvlib.irradiance.perez(tilt, azimuth, dhi, numpy.asarray(dni, dtype=float),
+                                       geometry["dni_extra"].to_numpy(), solar_zenith, solar_azimuth,
+                                       geometry["airmass"].to_numpy(), return_components=site_shading is not None)
+
+    if site_shading is not None:
+        # one table lookup per timestamp, circumsolar diffuse comes from the direction of the sun
+        direct = shading.direct_factor(site_shading, solar_azimuth, 90 - solar_zenith)
+        diffuse = site_shading["diffuse"] if config.shading_diffuse else 1.0
+        dni_poa = dni_poa * direct
+        dhi_perez = (dhi_perez["poa_circumsolar"] * direct
+                     + (dhi_perez["poa_isotropic"] + dhi_perez["poa_horizon"]) * diffuse)
+    dhi_poa = numpy.where(dhi == 0, 0.0, dhi_perez)
+
+    # ghi, same as __project_ghi_to_panel_surface()
+    ghi_poa = ghi * albedo * ((1.0 - numpy.cos(numpy.radians(tilt))) / 2)
+
+    return dni_poa, dhi_poa, ghi_poa
+
+
+def irradiance_df_to_poa_df_vectorized(irradiance_df, geometry=None, albedo=None, tilt=None, azimuth=None,
+                                       site_shading=None):
+    """
+    Vectorized version of irradiance_df_to_poa_df(), adds dni_poa, dhi_poa, ghi_poa and poa columns.
+    :param irradiance_df: Solar irradiance dataframe with time, ghi, dni and dhi columns.
+    :param geometry: Optional precomputed solar geometry for the time column
+    :param albedo: Ground albedo, albedo column of the dataframe or config.albedo by default
+    :return: Dataframe with dni, ghi and dhi plane of array irradiance projections
+    """
+    if geometry is None:
+        geometry = astronomical_calculations.get_solar_geometry(irradiance_df["time"])
+
+    # dynamic albedo from dataframe if albedo column exists
+    if albedo is None and "albedo" in irradiance_df.columns:
+        albedo = irradiance_df["albedo"].to_numpy()
+
+    dni_poa, dhi_poa, ghi_poa = project_to_panel_surface_arrays(irradiance_df["dni"].to_numpy(),
+                                                                irradiance_df["dhi"].to_numpy(),
+                                                                irradiance_df["ghi"].to_numpy(),
+                                                                geometry, albedo, tilt, azimuth, site_shading)
+
+    irradiance_df["dni_poa"] = dni_poa
+    irradiance_df["dhi_poa"] = dhi_poa
+    irradiance_df["ghi_poa"] = ghi_poa
+    irradiance_df["poa"] = irradiance_df["dhi_poa"] + irradiance_df["dni_poa"] + irradiance_df["ghi_poa"]
+
+    return irradiance_df
@@ -0,0 +1,171 @@
+"""
+Splitting of global horizontal irradiance into direct normal and diffuse horizontal parts.
+
+Sources like pyranometers and fmi radiation observations only measure ghi, the pipeline needs dni and dhi as well.
+The decomposition models work on whole arrays and take their solar angles from the shared solar geometry, see
+astronomical_calculations.get_solar_geometry(). Irradiance arrays can have leading dimensions such as ensemble members,
+time is the last dimension.
+    erbs    Erbs et al. 1982, diffuse fraction as a polynomial of the clearness index
+    disc    Maxwell 1987, direct beam transmittance from the clearness index and air mass
+    dirint  Perez et al. 1992, DISC corrected with the variability of the clearness index, see pvlib.irradiance.dirint()
+Erbs and DISC give the same values as the pvlib functions with the same names.
+
+MEPS provides direct horizontal irradiance, which is converted to dni by dividing with cos(zenith). Near sunrise and
+sunset this division blows up, direct_normal() limits it in the same way as the decomposition models: dni is zero above
+config.decomposition_max_zenith, cos(zenith) is not allowed below config.decomposition_min_cos_zenith and dni never
+exceeds extraterrestrial irradiance.
+
+Example:
+geometry = astronomical_calculations.get_solar_geometry(data["time"], site["latitude"], site["longitude"])
+dni, dhi = irradiance_decomposition.decompose(data["ghi"].to_numpy(), geometry, model="disc")
+"""
+
+import sys
+
+import numpy
+import pvlib
+
+import config
+
+MODELS = ["erbs", "disc", "dirint"]
+
+
+def decompose(ghi, geometry, model=None):
+    """
+    :param ghi: Global horizontal irradiance array of shape (..., times)
+    :param geometry: Solar geometry for the times from astronomical_calculations.get_solar_geometry()
+    :param model: "erbs", "disc" or "dirint", config.decomposition_model by default
+    :return: Tuple (dni, dhi) arrays of the same shape as ghi
+    """
+    if model is None:
+        model = config.decomposition_model
+
+    match model:
+        case "erbs":
+            return erbs(ghi, geometry)
+        case "disc":
+            return disc(ghi, geometry)
+        case "dirint":
+            return dirint(ghi, geometry)
+
+    print("Error: decomposition model \"" + str(model) + "\" not supported, use one of " + ", ".join(MODELS))
+    sys.exit(1)
+
+
+def add_decomposition(df, geometry, model=None):
+    """
+    Adds dni and dhi columns computed from the ghi column.
+    :param df: Dataframe with a ghi column, rows matching geometry
+    :return: df
+    """
+    dni, dhi = decompose(df["ghi"].to_numpy(dtype=float), geometry, model)
+    df["dni"] = dni
+    df["dhi"] = dhi
+    return df
+
+
+def erbs(ghi, geometry):
+    """
+    Erbs model, same as pvlib.irradiance.erbs().
+    :return: Tuple (dni, dhi)
+    """
+    ghi = numpy.asarray(ghi, dtype=float)
+    zenith, cos_zenith, dni_extra = __angles(geometry)
+    kt = clearness_index(ghi, geometry)
+
+    diffuse_fraction = numpy.where(
+        kt <= 0.22, 1 - 0.09 * kt,
+        numpy.where(kt <= 0.8, 0.9511 - 0.1604 * kt + 4.388 * kt ** 2 - 16.638 * kt ** 3 + 12.336 * kt ** 4, 0.165))
+
+    dhi = diffuse_fraction * ghi
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        dni = (ghi - dhi) / cos_zenith
+
+    bad = (zenith > config.decomposition_max_zenith) | (ghi < 0) | (dni < 0)
+    return numpy.where(bad, 0.0, dni), numpy.where(bad, ghi, dhi)
+
+
+def disc(ghi, geometry):
+    """
+    DISC model, same as pvlib.irradiance.disc() at standard pressure.
+    :return: Tuple (dni, dhi)
+    """
+    ghi = numpy.asarray(ghi, dtype=float)
+    zenith, cos_zenith, dni_extra = __angles(geometry)
+    # DISC is defined with a solar constant of 1370 W/m2, the shared geometry uses 1366.1 W/m2
+    dni_extra = dni_extra * (1370.0 / 1366.1)
+    kt = clearness_index(ghi, geometry, dni_extra)
+
+    # DISC is defined with the Kasten 1966 air mass, limited to 12
+    airmass = numpy.minimum(pvlib.atmosphere.get_relative_airmass(zenith, model="kasten1966"), 12)
+
+    cloudy = kt <= 0.6
+    a = numpy.where(cloudy, 0.512 - 1.56 * kt + 2.286 * kt ** 2 - 2.222 * kt ** 3,
+                    -5.743 + 21.77 * kt - 27.49 * kt ** 2 + 11.56 * kt ** 3)
+    b = numpy.where(cloudy, 0.37 + 0.962 * kt, 41.4 - 118.5 * kt + 66.05 * kt ** 2 + 31.9 * kt ** 3)
+    c = numpy.where(cloudy, -0.28 + 0.932 * kt - 2.048 * kt ** 2,
+                    -47.01 + 184.2 * kt - 222.0 * kt ** 2 + 73.81 * kt ** 3)
+
+    clear_transmittance = (0.866 - 0.122 * airmass + 0.0121 * airmass ** 2 - 0.000653 * airmass ** 3
+                           + 1.4e-05 * airmass ** 4)
+    dni = (clear_transmittance - (a + b * numpy.exp(c * airmass))) * dni_extra
+
+    bad = (zenith > config.decomposition_max_zenith) | (ghi < 0) | ~(dni >= 0)
+    dni = numpy.where(bad, 0.0, dni)
+    return dni, __diffuse(ghi, dni, cos_zenith)
+
+
+def dirint(ghi, geometry):
+    """
+    DIRINT model from pvlib, which also uses the clearness index of neighbouring timestamps. Computed separately for
+    each row of leading dimensions.
+    :return: Tuple (dni, dhi)
+    """
+    ghi = numpy.asarray(ghi, dtype=float)
+    zenith, cos_zenith, dni_extra = __angles(geometry)
+
+    rows = ghi.reshape(-1, ghi.shape[-1])
+    dni = numpy.empty(rows.shape)
+    for i, row in enumerate(rows):
+        dni[i] = numpy.asarray(pvlib.irradiance.dirint(row, zenith, geometry.index,
+                                                       min_cos_zenith=config.decomposition_min_cos_zenith,
+                                                       max_zenith=config.decomposition_max_zenith))
+
+    dni = numpy.nan_to_num(dni.reshape(ghi.shape))
+    return dni, __diffuse(ghi, dni, cos_zenith)
+
+
+def clearness_index(ghi, geometry, dni_extra=None):
+    """
+    Ratio of ghi to extraterrestrial horizontal irradiance, limited to range [0, 1].
+    :param dni_extra: Optional extraterrestrial irradiance array, dni_extra of geometry by default
+    """
+    zenith, cos_zenith, geometry_dni_extra = __angles(geometry)
+    if dni_extra is None:
+        dni_extra = geometry_dni_extra
+    horizontal_extra = dni_extra * numpy.maximum(cos_zenith, config.decomposition_min_cos_zenith)
+    return numpy.clip(numpy.nan_to_num(numpy.asarray(ghi, dtype=float) / horizontal_extra), 0.0, 1.0)
+
+
+def direct_normal(dir_hi, geometry):
+    """
+    Direct normal irradiance from direct horizontal irradiance with limits near sunrise and sunset.
+    :param dir_hi: Direct horizontal irradiance array of shape (..., times)
+    :param geometry: Solar geometry for the times
+    :return: dni array
+    """
+    zenith, cos_zenith, dni_extra = __angles(geometry)
+    dni = numpy.asarray(dir_hi, dtype=float) / numpy.maximum(cos_zenith, config.decomposition_min_cos_zenith)
+    dni = numpy.minimum(dni, dni_extra)
+    # missing values are kept missing
+    return numpy.where((zenith > config.decomposition_max_zenith) & ~numpy.isnan(dni), 0.0, dni)
+
+
+def __angles(geometry):
+    zenith = geometry["apparent_zenith"].to_numpy()
+    return zenith, numpy.cos(numpy.radians(zenith)), geometry["dni_extra"].to_numpy()
+
+
+def __diffuse(ghi, dni, cos_zenith):
+    # diffuse is what remains of ghi, beam on a horizontal surface can not exceed ghi
+    return numpy.maximum(ghi - dni * numpy.maximum(cos_zenith, 0.0), 0.0)
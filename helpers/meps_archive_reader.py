@@ -0,0 +1,115 @@
+"""
+Chunked reading and processing of multi-year MEPS point archives stored as local csv or parquet files.
+
+Archive files are expected to contain the columns used by meps_data_parser.meps_rad_to_ghi_dni_dhi():
+date, grad_instant, swavr_instant, nswrs_instant, t, wind
+
+Files are read in chunks of rows so that memory use stays bounded regardless of archive length. Chunks are independent
+of each other, meps conversion and the vectorized pipeline are computed for each chunk in a separate worker process.
+Only a limited number of chunks is kept in flight at any time.
+
+Example:
+for data in meps_archive_reader.process_meps_archive(["meps_helsinki_2020-2023.csv"]):
+    data[["time", "output"]].to_csv("output/meps_helsinki.csv", mode="a", header=False)
+"""
+
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas
+
+from helpers import meps_data_parser
+from helpers import pipeline
+from helpers import site_parameters
+
+# columns read from archive files, other columns are skipped while reading
+MEPS_COLUMNS = ["date", "grad_instant", "swavr_instant", "nswrs_instant", "t", "wind"]
+
+
+def read_meps_archive_chunks(path, chunk_rows=50000):
+    """
+    Generator which reads a MEPS archive file in chunks.
+    :param path: Path to a .csv or .parquet file. Reading parquet files requires pyarrow.
+    :param chunk_rows: Maximum row count of a chunk
+    :return: Dataframes with MEPS_COLUMNS, date column parsed to datetime
+    """
+    if path.endswith(".parquet"):
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            print("Reading parquet files requires pyarrow, install it with 'pip install pyarrow'")
+            raise
+
+        parquet_file = pyarrow.parquet.ParquetFile(path)
+        for batch in parquet_file.iter_batches(batch_size=chunk_rows, columns=MEPS_COLUMNS):
+            chunk = batch.to_pandas()
+            chunk["date"] = pandas.to_datetime(chunk["date"])
+            yield chunk
+    else:
+        for chunk in pandas.read_csv(path, usecols=MEPS_COLUMNS, parse_dates=["date"], chunksize=chunk_rows):
+            yield chunk
+
+
+def process_meps_chunk(meps_data, site=None):
+    """
+    Converts a MEPS chunk to ghi, dni, dhi and processes it through the vectorized pipeline.
+    :param meps_data: Dataframe with MEPS_COLUMNS
+    :param site: Optional dictionary of site parameters
+    :return: Power output dataframe
+    """
+    site = site_parameters.get_site_parameters(site)
+    data = meps_data_parser.meps_rad_to_ghi_dni_dhi(meps_data, site["latitude"], site["longitude"])
+    data["time"] = __as_utc(data["time"])
+    data.index = data["time"]
+    return pipeline.process_irradiance(data, site)
+
+
+def process_meps_archive(paths, site=None, chunk_rows=50000, processes=None, max_pending=None):
+    """
+    Generator which streams MEPS archive files through conversion and pipeline. Chunks are processed in parallel, results
+    are returned in file and row order.
+    :param paths: List of archive file paths, processed in given order
+    :param site: Optional dictionary of site parameters, config values by default
+    :param chunk_rows: Maximum row count of a chunk
+    :param processes: Worker process count, cpu count by default. 1 processes chunks in this process.
+    :param max_pending: Maximum number of chunks read ahead, 2 * processes by default
+    :return: Power output dataframes, one for each chunk
+    """
+
+    # resolving parameters here so that all workers use the same values
+    site = site_parameters.get_site_parameters(site)
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if max_pending is None:
+        max_pending = 2 * processes
+
+    if processes == 1:
+        for path in paths:
+            for chunk in read_meps_archive_chunks(path, chunk_rows):
+                yield process_meps_chunk(chunk, site)
+        return
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        pending = deque()
+        for path in paths:
+            for chunk in read_meps_archive_chunks(path, chunk_rows):
+                pending.append(executor.submit(process_meps_chunk, chunk, site))
+
+                # waiting for the oldest chunk before reading more keeps memory use bounded
+                if len(pending) >= max_pending:
+                    yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+
+def __as_utc(times):
+    """
+    MEPS archive dates are in UTC, adds the timezone marker if it is missing.
+    """
+    times = pandas.to_datetime(times)
+    if times.dt.tz is None:
+        return times.dt.tz_localize("UTC")
+    return times.dt.tz_convert("UTC")
@@ -1,8 +1,8 @@
-import numpy
 import pandas
 import datetime as dt
 from datetime import timedelta
 from helpers import astronomical_calculations
+from helpers import irradiance_decomposition
 
 
 def print_full(x):
@@ -23,7 +23,7 @@ def print_full(x):
     pandas.reset_option('display.max_colwidth')
 
 
-def meps_rad_to_ghi_dni_dhi(meps_data):
+def meps_rad_to_ghi_dni_dhi(meps_data, latitude=None, longitude=None):
     """
     This function formats meps dataframes further, removing somewhat cryptic swarv_instant -like variables.
     And adding ghi, dhi, dni which are required for unified processing
@@ -38,38 +38,30 @@ def meps_rad_to_ghi_dni_dhi(meps_data):
     97155 2023-07-13 07:00:00        535.91         420.91         483.94      21.56       0.25       4.21       2.11
     97156 2023-07-13 08:00:00        638.23         154.42         576.11      22.07       0.62       2.92       1.88
     97157 2023-07-13 09:00:00        721.49         464.92         651.21      23.59      -0.14       2.88       1.65
+
+    Latitude and longitude are used for solar angles, config values by default.
     """
 
-    # renaming variables to match code by @viivik
-    df = meps_data.copy()
-    df["ghi"] = df["grad_instant"]  # OK
-    df["net_sw"] = df["nswrs_instant"]  # OK
-    df["dir_hi"] = df["swavr_instant"]  # OK
+    # renaming variables to match code by @viivik, only the needed columns are taken from the input
+    df = pandas.DataFrame({"time": meps_data["date"].to_numpy(),
+                           "ghi": meps_data["grad_instant"].to_numpy(),  # OK
+                           "dir_hi": meps_data["swavr_instant"].to_numpy()})  # OK
 
-    # translating variables to albedo, dhi, ghi using equations from _meps_data_loader.py
-    df['albedo'] = (df['ghi'] - df['net_sw']) / df['ghi']
+    # translating variables to dhi using equations from _meps_data_loader.py
     df['dhi'] = df['ghi'] - df['dir_hi']
 
-    # shifting time by 30 minutes as datapoints are hourly and they represent the average of last hour.
-    df["date"] = df["date"] + dt.timedelta(minutes=-30)
-
-    # adding apparent solar zenit angle with shifted time
-    def sza_adder(df_input):
-        return astronomical_calculations.get_solar_azimuth_zenit(df_input["date"])[1]
-
-    df["sza"] = df.apply(sza_adder, axis=1)
-
-    # shifting time back by 30 minutes, restoring original times
-    df["date"] = df["date"] + dt.timedelta(minutes=30)
+    # adding apparent solar zenit angle for the center of the hour as datapoints are hourly and they represent the
+    # average of last hour. Solar angles are computed for all rows at once.
+    geometry = astronomical_calculations.get_solar_geometry(df["time"] + dt.timedelta(minutes=-30),
+                                                            latitude, longitude)
 
-    # Calculate dni from dhi
-    df['dni'] = df['dir_hi'] / numpy.cos(df['sza'] * (numpy.pi / 180))
+    # Calculate dni from direct horizontal, limited near sunrise and sunset where cos(sza) approaches zero
+    df['dni'] = irradiance_decomposition.direct_normal(df['dir_hi'].to_numpy(), geometry)
 
     # saving only relevant parameters to output df
-    df = df[["date", "ghi", "dni", "dhi"]]
-    df.columns = ["time", "ghi", "dni", "dhi"]
-    df["T"] = meps_data["t"]
-    df["wind"] = meps_data["wind"]
+    df = df[["time", "ghi", "dni", "dhi"]]
+    df["T"] = meps_data["t"].to_numpy()
+    df["wind"] = meps_data["wind"].to_numpy()
     df.index = df["time"]
 
     # debug plotting
@@ -0,0 +1,299 @@
+"""
+Gridded MEPS/Harmonie field ingestion for a fleet of sites.
+
+Instead of fetching a point forecast for each site separately, all sites are extracted from one locally stored gridded
+file. Grid points are matched to sites once with a KD-tree built from the grid coordinates. The matching is cached in
+memory and on disk in config.grid_index_cache_directory, so later files on the same grid only need a table lookup.
+Values for all sites and all timestamps are then read with one vectorized gather per variable.
+
+Supported files:
+- NetCDF3 classic files are opened with scipy and memory mapped, only the gathered grid points are read from disk.
+- NetCDF4 and GRIB files are opened lazily with xarray (optional dependency, GRIB also requires cfgrib).
+
+The result for each site has the same format as _meps_data_loader.collect_fmi_opendata() output and can be passed
+directly to the pipeline.
+
+Example:
+sites = [site_parameters.get_site(name) for name in ["helsinki", "kuopio"]]
+data = meps_grid_loader.extract_sites("meps_det_2_5km_20240701T00Z.nc", sites)
+data["helsinki"]
+"""
+
+import hashlib
+import os
+import re
+
+import numpy
+import pandas
+from scipy.spatial import cKDTree
+
+import config
+from helpers import _meps_data_loader
+
+# Dataframe column name -> (candidate variable names in file, scale, offset). The first variable found in the file is
+# used. Names are from MEPS NetCDF files, GRIB short names are listed as alternatives. A pair of names is read as x and y
+# wind components and combined to wind speed.
+GRID_VARIABLES = {"T": (["air_temperature_2m", "t2m", "2t"], 1.0, -273.15),
+                  "GHI_accum": (["integral_of_surface_downwelling_shortwave_flux_in_air_wrt_time", "ssrd"], 1.0, 0.0),
+                  "NetSW_accum": (["integral_of_surface_net_downward_shortwave_flux_wrt_time", "ssr"], 1.0, 0.0),
+                  "DirHI_accum": (["integral_of_surface_direct_downwelling_shortwave_flux_in_air_wrt_time",
+                                   "fdir"], 1.0, 0.0),
+                  "Wind speed": (["wind_speed_10m", "si10", ("x_wind_10m", "y_wind_10m"), ("u10", "v10")], 1.0, 0.0),
+                  "Total cloud cover": (["cloud_area_fraction", "tcc"], 100.0, 0.0)}
+
+# spatial indexes built during this program run, keyed by grid and site fingerprint
+__site_index_cache = {}
+
+
+class GridFile:
+    """
+    Lazily opened gridded file. Variables are returned as array-like objects which are only read when indexed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.dataset = None
+        self.xarray_dataset = None
+
+        if path.endswith(".nc"):
+            try:
+                from scipy.io import netcdf_file
+                self.dataset = netcdf_file(path, "r", mmap=True)
+            except (TypeError, ValueError):
+                # not a NetCDF3 classic file, using xarray for NetCDF4
+                self.dataset = None
+
+        if self.dataset is None:
+            try:
+                import xarray
+            except ImportError:
+                print("Reading NetCDF4 and GRIB files requires xarray, "
+                      "install it with 'pip install xarray netCDF4 cfgrib'")
+                raise
+            engine = "cfgrib" if path.endswith((".grib", ".grib2", ".grb", ".grb2")) else None
+            self.xarray_dataset = xarray.open_dataset(path, engine=engine)
+
+    def has_variable(self, name):
+        if self.dataset is not None:
+            return name in self.dataset.variables
+        return name in self.xarray_dataset.variables
+
+    def variable(self, name):
+        """
+        Returns variable values without reading them. NetCDF3 packed values are unpacked by read_points().
+        """
+        if self.dataset is not None:
+            return self.dataset.variables[name]
+        return self.xarray_dataset[name].variable
+
+    def coordinates(self):
+        """
+        Returns 2D latitude and longitude arrays of the grid.
+        """
+        latitude = numpy.asarray(self.__values(self.__first_existing(["latitude", "lat"])), dtype=float)
+        longitude = numpy.asarray(self.__values(self.__first_existing(["longitude", "lon"])), dtype=float)
+
+        # regular grids store 1D coordinates
+        if latitude.ndim == 1 and longitude.ndim == 1:
+            longitude, latitude = numpy.meshgrid(longitude, latitude)
+
+        return latitude, longitude
+
+    def times(self):
+        """
+        Returns forecast times as naive UTC DatetimeIndex.
+        """
+        name = self.__first_existing(["time", "valid_time"])
+        values = numpy.asarray(self.__values(name))
+
+        if numpy.issubdtype(values.dtype, numpy.datetime64):
+            return pandas.DatetimeIndex(values)
+
+        units = self.variable(name).attrs["units"] if self.dataset is None else self.variable(name).units
+        if isinstance(units, bytes):
+            units = units.decode()
+        return self.__parse_cf_times(values, units)
+
+    def read_points(self, name, flat_indices):
+        """
+        Gathers values of a variable at the given flat grid indices.
+        :param name: Variable name
+        :param flat_indices: int array of flat y * x grid indices, any shape
+        :return: float array with shape (time count,) + flat_indices.shape
+        """
+        variable = self.variable(name)
+        shape = variable.shape
+        point_count = shape[-2] * shape[-1]
+
+        if self.dataset is not None:
+            # memory mapped view with time first and grid points last. Other dimensions, such as height or ensemble
+            # member, are expected to be singletons and only their first element is read
+            values = variable.data.reshape((shape[0], -1, point_count))[:, 0, :]
+            gathered = numpy.asarray(values[:, flat_indices.ravel()], dtype=float)
+            gathered = self.__unpack_netcdf3(gathered, variable)
+        else:
+            import xarray
+            y_indices, x_indices = numpy.unravel_index(flat_indices.ravel(), shape[-2:])
+            data = self.xarray_dataset[name]
+            data = data.squeeze([dim for dim in data.dims[1:-2] if data.sizes[dim] == 1])
+            gathered = data.isel({data.dims[-2]: xarray.DataArray(y_indices, dims="point"),
+                                  data.dims[-1]: xarray.DataArray(x_indices, dims="point")}).values
+            gathered = numpy.asarray(gathered, dtype=float).reshape((shape[0], len(y_indices)))
+
+        return gathered.reshape((shape[0],) + flat_indices.shape)
+
+    def close(self):
+        if self.dataset is not None:
+            self.dataset.close()
+        if self.xarray_dataset is not None:
+            self.xarray_dataset.close()
+
+    @staticmethod
+    def __unpack_netcdf3(values, variable):
+        """
+        Applies NetCDF fill value, scale factor and offset. scipy does not unpack values automatically.
+        """
+        attributes = variable._attributes
+        if "_FillValue" in attributes:
+            values[values == attributes["_FillValue"]] = numpy.nan
+        if "scale_factor" in attributes:
+            values = values * attributes["scale_factor"]
+        if "add_offset" in attributes:
+            values = values + attributes["add_offset"]
+        return values
+
+    @staticmethod
+    def __parse_cf_times(values, units):
+        """
+        Parses CF convention times such as "seconds since 1970-01-01 00:00:00 +00:00".
+        """
+        match = re.match(r"\s*(\w+)\s+since\s+(.+)", units)
+        unit = {"seconds": "s", "second": "s", "minutes": "min", "minute": "min", "hours": "h", "hour": "h",
+                "days": "D", "day": "D"}[match.group(1).lower()]
+        origin = pandas.Timestamp(match.group(2).strip())
+        if origin.tzinfo is not None:
+            origin = origin.tz_convert("UTC").tz_localize(None)
+        return pandas.DatetimeIndex(origin + pandas.to_timedelta(values, unit=unit))
+
+    def __first_existing(self, names):
+        for name in names:
+            if self.has_variable(name):
+                return name
+        raise KeyError("None of the variables " + str(names) + " found in " + self.path)
+
+    def __values(self, name):
+        variable = self.variable(name)
+        if self.dataset is not None:
+            # copying small coordinate arrays, memory mapped file can not be closed while views to it exist
+            return numpy.array(variable.data)
+        return variable.values
+
+
+def build_site_index(latitude, longitude, sites, neighbours=1):
+    """
+    Matches sites to grid points. Distances are computed on a unit sphere so the index works for projected grids with
+    2D coordinate arrays, such as the MEPS lambert conformal grid.
+    :param latitude: 2D grid latitude array
+    :param longitude: 2D grid longitude array
+    :param sites: List of site parameter dictionaries
+    :param neighbours: 1 uses the nearest grid point, larger values use inverse distance weighting of nearest points
+    :return: flat grid indices and weights, both with shape (site count, neighbours)
+    """
+    fingerprint = __index_fingerprint(latitude, longitude, sites, neighbours)
+    if fingerprint in __site_index_cache:
+        return __site_index_cache[fingerprint]
+
+    cache_path = os.path.join(config.grid_index_cache_directory, fingerprint + ".npz")
+    if os.path.exists(cache_path):
+        cached = numpy.load(cache_path)
+        __site_index_cache[fingerprint] = (cached["indices"], cached["weights"])
+        return __site_index_cache[fingerprint]
+
+    tree = cKDTree(__to_unit_vectors(latitude.ravel(), longitude.ravel()))
+    site_vectors = __to_unit_vectors(numpy.array([site["latitude"] for site in sites]),
+                                     numpy.array([site["longitude"] for site in sites]))
+    distances, indices = tree.query(site_vectors, k=neighbours)
+    distances = distances.reshape((len(sites), neighbours))
+    indices = indices.reshape((len(sites), neighbours))
+
+    # inverse distance weights, a site exactly on a grid point takes only that point
+    with numpy.errstate(divide="ignore"):
+        weights = 1.0 / distances
+    exact = numpy.isinf(weights)
+    weights = numpy.where(exact.any(axis=1, keepdims=True), exact.astype(float), weights)
+    weights = weights / weights.sum(axis=1, keepdims=True)
+
+    os.makedirs(config.grid_index_cache_directory, exist_ok=True)
+    numpy.savez(cache_path, indices=indices, weights=weights)
+    __site_index_cache[fingerprint] = (indices, weights)
+
+    return indices, weights
+
+
+def extract_sites(path, sites, neighbours=1):
+    """
+    Extracts T, radiation accumulations, wind and cloud cover for all sites from a gridded file.
+    :param path: Path to a local NetCDF or GRIB file
+    :param sites: List of site parameter dictionaries, see site_parameters.get_site()
+    :param neighbours: 1 uses the nearest grid point, larger values use inverse distance weighting
+    :return: Dictionary of site name -> dataframe in _meps_data_loader format
+    """
+    grid_file = GridFile(path)
+    try:
+        latitude, longitude = grid_file.coordinates()
+        indices, weights = build_site_index(latitude, longitude, sites, neighbours)
+        times = grid_file.times()
+
+        # one gather per variable for all sites, result shape (time, site)
+        columns = {}
+        for column, (names, scale, offset) in GRID_VARIABLES.items():
+            columns[column] = __read_variable(grid_file, names, indices, weights) * scale + offset
+    finally:
+        grid_file.close()
+
+    data = {}
+    for i, site in enumerate(sites):
+        df = pandas.DataFrame({column: values[:, i] for column, values in columns.items()},
+                              index=pandas.DatetimeIndex(times, name="Time"))
+        data[site["site_name"]] = _meps_data_loader.accumulations_to_irradiance(df, site["latitude"],
+                                                                                site["longitude"])
+
+    return data
+
+
+def __read_variable(grid_file, names, indices, weights):
+    """
+    Reads the first existing variable from names, pairs of names are combined to wind speed.
+    :return: Array with shape (time, site), nan if none of the variables exist
+    """
+    for name in names:
+        if isinstance(name, tuple):
+            if grid_file.has_variable(name[0]) and grid_file.has_variable(name[1]):
+                x_component = (grid_file.read_points(name[0], indices) * weights).sum(axis=-1)
+                y_component = (grid_file.read_points(name[1], indices) * weights).sum(axis=-1)
+                return numpy.hypot(x_component, y_component)
+        elif grid_file.has_variable(name):
+            return (grid_file.read_points(name, indices) * weights).sum(axis=-1)
+
+    print("None of the variables " + str(names) + " found in " + grid_file.path + ", using nan")
+    return numpy.full((len(grid_file.times()), len(indices)), numpy.nan)
+
+
+def __to_unit_vectors(latitude, longitude):
+    latitude = numpy.radians(latitude)
+    longitude = numpy.radians(longitude)
+    return numpy.column_stack((numpy.cos(latitude) * numpy.cos(longitude),
+                               numpy.cos(latitude) * numpy.sin(longitude),
+                               numpy.sin(latitude)))
+
+
+def __index_fingerprint(latitude, longitude, sites, neighbours):
+    """
+    Hash of grid coordinates, site coordinates and neighbour count, used as spatial index cache key.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(numpy.ascontiguousarray(latitude, dtype=numpy.float64).tobytes())
+    digest.update(numpy.ascontiguousarray(longitude, dtype=numpy.float64).tobytes())
+    digest.update(numpy.array([[site["latitude"], site["longitude"]] for site in sites], dtype=numpy.float64).tobytes())
+    digest.update(str(neighbours).encode())
+    return digest.hexdigest()
@@ -0,0 +1,164 @@
+"""
+Short term correction of forecasts with live inverter power readings.
+
+Readings of each site are kept in a fixed size ring buffer, config.nowcast_buffer_size readings per site, so memory use
+does not grow however long the service runs. On every update the readings of the last config.nowcast_window_minutes
+minutes are compared with the forecast power at the same times. The ratio of measured to forecast energy is applied to
+the next hours of the forecast and fades out with time constant config.nowcast_decay_hours:
+    corrected = forecast * (1 + (ratio - 1) * exp(-(t - now) / decay))
+Forecast times further than config.nowcast_horizon_hours ahead and times before now are not changed. Readings at night
+or during very low forecast power, below config.nowcast_min_power_fraction of rated power, are not used.
+
+All steps are numpy operations on at most a buffer and a forecast run, an update takes well under a millisecond per
+site.
+
+Example:
+nowcaster = nowcast.Nowcaster()
+nowcaster.ingest("helsinki", times, power)
+result = nowcaster.update("helsinki", forecast_times, forecast_power, now, rated_power=21)
+"""
+
+import numpy
+
+import config
+
+NANOSECONDS_PER_MINUTE = 60 * 1_000_000_000
+NANOSECONDS_PER_HOUR = 60 * NANOSECONDS_PER_MINUTE
+
+
+class RingBuffer:
+    """
+    Fixed size buffer of (time, value) readings, the oldest readings are overwritten when the buffer is full.
+    """
+
+    def __init__(self, capacity=None):
+        if capacity is None:
+            capacity = config.nowcast_buffer_size
+        self.capacity = capacity
+        self.times = numpy.zeros(capacity, dtype=numpy.int64)
+        self.values = numpy.full(capacity, numpy.nan)
+        # total number of readings ever appended, the next reading is written to position count % capacity
+        self.count = 0
+
+    def append(self, times, values):
+        """
+        Appends readings, all at once.
+        :param times: int64 array of nanoseconds since epoch in UTC
+        :param values: float array of readings
+        """
+        times = numpy.asarray(times, dtype=numpy.int64)[-self.capacity:]
+        values = numpy.asarray(values, dtype=numpy.float64)[-self.capacity:]
+
+        positions = (self.count + numpy.arange(len(times))) % self.capacity
+        self.times[positions] = times
+        self.values[positions] = values
+        self.count += len(times)
+
+    def window(self, start, end):
+        """
+        Readings with start <= time <= end in time order. Readings do not need to arrive in time order.
+        :return: Tuple (times, values)
+        """
+        size = min(self.count, self.capacity)
+        times = self.times[:size]
+        selected = numpy.flatnonzero((times >= start) & (times <= end))
+        order = numpy.argsort(times[selected], kind="stable")
+        return times[selected][order], self.values[:size][selected][order]
+
+    def latest_time(self):
+        """
+        :return: Time of the newest reading, None if the buffer is empty
+        """
+        if self.count == 0:
+            return None
+        return int(self.times[:min(self.count, self.capacity)].max())
+
+
+def bias_ratio(reading_times, readings, forecast_times, forecast, minimum_power):
+    """
+    Ratio of measured to forecast energy over the readings.
+    :param reading_times: int64 nanosecond array of reading times
+    :param readings: Measured power array in W
+    :param forecast_times: Sorted int64 nanosecond array of forecast times
+    :param forecast: Forecast power array in W
+    :param minimum_power: Readings where forecast power is below this are not used, W
+    :return: Tuple (ratio limited to config.nowcast_ratio_limits, number of readings used), ratio is 1 without readings
+    """
+    if len(reading_times) == 0 or len(forecast_times) == 0:
+        return 1.0, 0
+
+    # forecast power at reading times, readings outside the forecast are not used
+    expected = numpy.interp(reading_times, forecast_times, numpy.nan_to_num(forecast), left=numpy.nan,
+                            right=numpy.nan)
+    used = (expected > minimum_power) & ~numpy.isnan(readings)
+    if not used.any():
+        return 1.0, 0
+
+    lower, upper = config.nowcast_ratio_limits
+    ratio = readings[used].sum() / expected[used].sum()
+    return float(numpy.clip(ratio, lower, upper)), int(used.sum())
+
+
+def corrected_forecast(forecast_times, forecast, ratio, now, decay_hours=None, horizon_hours=None):
+    """
+    Applies a bias ratio to the next hours of a forecast.
+    :param forecast_times: int64 nanosecond array of forecast times
+    :param forecast: Forecast power array in W
+    :param ratio: Ratio of measured to forecast power, see bias_ratio()
+    :param now: Current time as nanoseconds since epoch
+    :return: Corrected forecast power array
+    """
+    if decay_hours is None:
+        decay_hours = config.nowcast_decay_hours
+    if horizon_hours is None:
+        horizon_hours = config.nowcast_horizon_hours
+
+    lead = (forecast_times - now) / NANOSECONDS_PER_HOUR
+    weight = numpy.where((lead >= 0) & (lead <= horizon_hours), numpy.exp(-numpy.maximum(lead, 0) / decay_hours), 0.0)
+    return forecast * (1 + (ratio - 1) * weight)
+
+
+class Nowcaster:
+    """
+    Ring buffers of live readings for any number of sites.
+    """
+
+    def __init__(self, capacity=None):
+        self.capacity = capacity
+        self.buffers = {}
+
+    def ingest(self, site, times, values):
+        """
+        Adds readings of a site, a buffer is created for new sites.
+        :param times: int64 array of nanoseconds since epoch in UTC
+        :param values: Power readings in W
+        """
+        if site not in self.buffers:
+            self.buffers[site] = RingBuffer(self.capacity)
+        self.buffers[site].append(times, values)
+
+    def update(self, site, forecast_times, forecast, now, rated_power=None, window_minutes=None):
+        """
+        Corrects the forecast of a site with its latest readings.
+        :param forecast_times: Sorted int64 nanosecond array of forecast times
+        :param forecast: Forecast power array in W
+        :param now: Current time as nanoseconds since epoch
+        :param rated_power: Rated power of the site in kW, config.rated_power by default
+        :param window_minutes: Readings of this many last minutes are used, config.nowcast_window_minutes by default
+        :return: Dictionary with ratio, readings (number of readings used), times and power (corrected forecast)
+        """
+        if rated_power is None:
+            rated_power = config.rated_power
+        if window_minutes is None:
+            window_minutes = config.nowcast_window_minutes
+
+        ratio, used = 1.0, 0
+        if site in self.buffers:
+            reading_times, readings = self.buffers[site].window(now - window_minutes * NANOSECONDS_PER_MINUTE, now)
+            ratio, used = bias_ratio(reading_times, readings, forecast_times, forecast,
+                                     config.nowcast_min_power_fraction * rated_power * 1000)
+
+        return {"ratio": ratio,
+                "readings": used,
+                "times": forecast_times,
+                "power": corrected_forecast(forecast_times, forecast, ratio, now)}
@@ -1,7 +1,11 @@
 import math
 
+import numpy
+
 import config
 
+# huld et al 2010 constants k1 - k6
+HULD_COEFFICIENTS = (-0.017162, -0.040289, -0.004681, 0.000148, 0.000169, 0.000005)
 
 
 def add_output_to_df(df):
@@ -31,12 +35,7 @@ def add_output_to_df(df):
 def __estimate_output(absorbed_radiation, panel_temp):
 
     # huld et al 2010 constants
-    k1 = -0.017162
-    k2 = -0.040289
-    k3 = -0.004681
-    k4 = 0.000148
-    k5 = 0.000169
-    k6 = 0.000005
+    k1, k2, k3, k4, k5, k6 = HULD_COEFFICIENTS
 
     # hud et al equation:
 
@@ -74,3 +73,53 @@ def __estimate_output(absorbed_radiation, panel_temp):
 
     return output
 
+
+
+def add_output_to_df_vectorized(df, rated_power=None):
+    """
+    Vectorized version of add_output_to_df().
+    :param df: Dataframe with poa_ref_cor and module_temp columns
+    :param rated_power: Rated installation power in kW, config.rated_power by default
+    :return: df with output column
+    """
+    if "poa_ref_cor" not in df.columns:
+        print("column poa_ref_cor not found in dataframe, output can not be simulated")
+        return df
+    if "module_temp" not in df.columns:
+        print("module temperature variable \"module_temp\" not found in dataframe")
+        return df
+
+    df["output"] = estimate_output_array(df["poa_ref_cor"].to_numpy(), df["module_temp"].to_numpy(), rated_power)
+    return df
+
+
+def estimate_output_array(absorbed_radiation, panel_temp, rated_power=None, coefficients=None):
+    """
+    Array version of __estimate_output(). Returns zero where radiation is zero or less and where inputs are nan.
+    Arguments are broadcast together, rated_power and coefficient arrays of shape (n, 1) give n estimates for each
+    timestamp.
+    :param absorbed_radiation: Reflection corrected poa array
+    :param panel_temp: Module temperature array
+    :param rated_power: Rated installation power in kW, config.rated_power by default
+    :param coefficients: Huld et al. constants k1 - k6, HULD_COEFFICIENTS by default
+    :return: Array of power output in W
+    """
+    if rated_power is None:
+        rated_power = config.rated_power
+    if coefficients is None:
+        coefficients = HULD_COEFFICIENTS
+    k1, k2, k3, k4, k5, k6 = coefficients
+
+    nrad = numpy.asarray(absorbed_radiation, dtype=float) / 1000.0
+    positive = nrad > 0
+
+    # logarithm is only computed for positive radiation, other values return zero output
+    log_nrad = numpy.log(numpy.where(positive, nrad, 1.0))
+    Tdiff = panel_temp - 25
+
+    efficiency = (1 + k1 * log_nrad + k2 * log_nrad ** 2 + Tdiff * (k3 + k4 * log_nrad + k5 * log_nrad ** 2)
+                  + k6 * Tdiff ** 2)
+    efficiency = numpy.maximum(efficiency, 0)
+
+    output = rated_power * 1000.0 * nrad * efficiency
+    return numpy.where(positive & ~numpy.isnan(output), output, 0.0)
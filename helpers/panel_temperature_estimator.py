@@ -6,9 +6,11 @@ Corrections for taking into account panel temperature induced losses
 import math
 from datetime import timedelta
 
+import numpy
 import pandas as pd
 
 import config
+from helpers import data_resampler
 
 
 def add_estimated_panel_temperature(df):
@@ -87,22 +89,9 @@ def add_wind_and_temp_to_df1_from_df2(df1, df2):
     :return: target df with wind and T columns which are from df2
     """
 
-    # If df1 does not have values where minute == 30, the frames do not align well. Can cause issues.
-    # alignment issues can be avoided by using config.data_resolution of 30, 15, 10, 5, 1
-
-    # creating weather df
-    weather_df = df2[["time", "wind", "T"]]
-
-    # joining weather df to df1
-    df1 = df1.merge(weather_df, on="time", how="outer")
-
-    # filling in nan values for wind
-    df1['wind'] = df1['wind'].interpolate(limit_direction='both')
-
-    # filling in nan values for temp
-    df1['T'] = df1['T'].interpolate(limit_direction='both')
-
-    return df1
+    # wind and temp are interpolated to df1 timestamps with sorted time searches, frames do not have to share
+    # timestamps and rows of df1 are not changed
+    return data_resampler.align_columns(df1, df2, ["wind", "T"])
 
 
 def temperature_of_module(absorbed_radiation, wind, module_elevation, air_temperature):
@@ -130,3 +119,38 @@ def temperature_of_module(absorbed_radiation, wind, module_elevation, air_temper
     module_temperature = absorbed_radiation * math.e ** (constant_a + constant_b * wind_speed) + air_temperature
 
     return module_temperature
+
+
+def add_estimated_panel_temperature_vectorized(df, module_elevation=None, air_temp_offset=0):
+    """
+    Vectorized version of add_estimated_panel_temperature(). Uses air temperature where the estimate is nan.
+    :param df: Dataframe with poa_ref_cor, wind and T columns
+    :param module_elevation: Module elevation in meters, config.module_elevation by default
+    :param air_temp_offset: Correction added to air temperature for the module temperature model, the T column of df
+    is not changed
+    :return: df with module_temp column
+    """
+    for column in ["T", "wind", "poa_ref_cor"]:
+        if column not in df.columns:
+            print("No " + column + " variable in given dataframe")
+            print("Aborting")
+            return df
+
+    df["module_temp"] = module_temperature_array(df["poa_ref_cor"].to_numpy(), df["wind"].to_numpy(),
+                                                 df["T"].to_numpy() + air_temp_offset, module_elevation)
+    return df
+
+
+def module_temperature_array(absorbed_radiation, wind, air_temperature, module_elevation=None):
+    """
+    Array version of temperature_of_module(), falls back to air temperature where the estimate is nan. Arguments are
+    broadcast together, parameter arrays of shape (n, 1) give n estimates for each timestamp.
+    :return: Array of module temperatures in Celsius
+    """
+    if module_elevation is None:
+        module_elevation = config.module_elevation
+
+    module_temperature = temperature_of_module(absorbed_radiation, wind, module_elevation, air_temperature)
+    air_temperature = numpy.broadcast_to(air_temperature, numpy.shape(module_temperature))
+
+    return numpy.where(numpy.isnan(module_temperature), air_temperature, module_temperature)
@@ -0,0 +1,189 @@
+"""
+Vectorized version of the solar pv processing pipeline.
+
+Runs the same steps 2-6 as the functions in main.py:
+2. project irradiance components to plane of array
+3. simulate how much of irradiance components is absorbed
+4. compute sum of reflection-corrected components
+5. estimate panel temperature based on wind speed, air temperature and absorbed radiation
+6. estimate power output
+
+Each step works on whole columns instead of df.apply(), which makes processing long time series and many sites fast.
+Results match the row by row pipeline, column names are the same. Sources with only ghi, for example pyranometers, are
+first split into dni and dhi, see irradiance_decomposition.py.
+
+Callers can declare the columns they need with the outputs parameter. Only the steps required for those columns are
+run, for example weather inputs for a TMY file need none of the steps 2-6:
+data = pipeline.process_irradiance(irradiance_df, outputs=["T", "ghi", "dni", "dhi", "wind"])
+"""
+
+import numpy
+
+from helpers import astronomical_calculations
+from helpers import geometric_projections
+from helpers import irradiance_decomposition
+from helpers import reflection_estimator
+from helpers import panel_temperature_estimator
+from helpers import output_estimator
+from helpers import shading
+from helpers import site_parameters
+
+# columns added by each step, in processing order. Columns not listed here are inputs and need no processing.
+STEP_COLUMNS = {"poa": ["dni_poa", "dhi_poa", "ghi_poa", "poa"],
+                "reflection": ["dni_rc", "dhi_rc", "ghi_rc", "poa_ref_cor"],
+                "weather": ["T", "wind"],
+                "temperature": ["module_temp"],
+                "output": ["output"]}
+STEPS = list(STEP_COLUMNS)
+
+
+def required_steps(outputs):
+    """
+    Steps needed for producing the given columns. Each step needs all steps before it, except that "weather" is only
+    needed for T or wind columns and for the panel temperature step.
+    :param outputs: Iterable of column names, None for all steps
+    :return: Set of step names
+    """
+    if outputs is None:
+        return set(STEPS)
+
+    last = -1
+    weather = False
+    for column in outputs:
+        for index, step in enumerate(STEPS):
+            if column not in STEP_COLUMNS[step]:
+                continue
+            if step == "weather":
+                # dummy values of the site are used when the input has no T or wind
+                weather = True
+            else:
+                last = max(last, index)
+
+    steps = set(STEPS[:last + 1])
+    if weather or "temperature" in steps:
+        steps.add("weather")
+    return steps
+
+
+def process_irradiance(irradiance_df, site=None, geometry=None, outputs=None):
+    """
+    Processes a dataframe with time, ghi, dni and dhi columns into a power output dataframe. If the input does not
+    contain T and wind values, dummies from site parameters are used. Inputs with only a ghi column are split into dni
+    and dhi with config.decomposition_model.
+    :param irradiance_df: Dataframe from solar_irradiance_estimator or meps_data_parser
+    :param site: Optional dictionary of site parameters, see site_parameters.get_site_parameters()
+    :param geometry: Optional precomputed solar geometry from astronomical_calculations.get_solar_geometry()
+    :param outputs: Optional list of needed columns. Only the steps required for them are run and only these columns
+    are returned. All steps and columns by default.
+    :return: Dataframe with the same columns as the row by row pipeline produces
+    """
+    site = site_parameters.get_site_parameters(site)
+    data = irradiance_df.copy()
+    steps = required_steps(outputs)
+
+    # sources which only provide ghi need solar geometry for splitting it into dni and dhi
+    ghi_only = "dni" not in data.columns or "dhi" not in data.columns
+
+    if steps <= {"weather"} and not ghi_only:
+        # only input columns requested, solar geometry is not needed
+        if steps:
+            data = __add_weather(data, site)
+        return data[list(outputs)]
+
+    if geometry is None:
+        geometry = astronomical_calculations.get_solar_geometry(data["time"], site["latitude"], site["longitude"])
+
+    # step 1.1. decompose ghi into dni and dhi, see irradiance_decomposition.py
+    if ghi_only:
+        data = irradiance_decomposition.add_decomposition(data, geometry)
+        if steps <= {"weather"}:
+            data = __add_weather(data, site) if steps else data
+            return data[list(outputs)]
+
+    # step 2. project irradiance components to plane of array:
+    albedo = data["albedo"].to_numpy() if "albedo" in data.columns else site["albedo"]
+    data = geometric_projections.irradiance_df_to_poa_df_vectorized(data, geometry, albedo, site["tilt"],
+                                                                    site["azimuth"], shading.get_site_shading(site))
+
+    if "reflection" not in steps:
+        data = __add_weather(data, site) if "weather" in steps else data
+        return data[list(outputs)]
+
+    # step 3. and 4. absorbed irradiance components and their sum:
+    angle_of_incidence = astronomical_calculations.get_solar_angle_of_incidence_array(
+        geometry["azimuth"].to_numpy(), geometry["apparent_zenith"].to_numpy(), site["tilt"], site["azimuth"])
+    data = reflection_estimator.add_reflection_corrected_poa_vectorized(data, angle_of_incidence,
+                                                                        site["reflectance_constant"], site["tilt"])
+
+    # step 4.1. add dummy wind and air temp data
+    if "weather" in steps:
+        data = __add_weather(data, site)
+    if "temperature" not in steps:
+        return data[list(outputs)]
+
+    # step 5. estimate panel temperature based on wind speed, air temperature and absorbed radiation
+    # the air temperature offset of the site only corrects the module temperature model, T is weather and unchanged
+    data = panel_temperature_estimator.add_estimated_panel_temperature_vectorized(data, site["module_elevation"],
+                                                                                  site["air_temp_offset"])
+    if "output" not in steps:
+        return data[list(outputs)]
+
+    # step 6. estimate power output
+    data = output_estimator.add_output_to_df_vectorized(data, site["rated_power"])
+    if site["derate"] != 1:
+        data["output"] = data["output"] * site["derate"]
+
+    return data if outputs is None else data[list(outputs)]
+
+
+def process_arrays(dni, dhi, ghi, geometry, site=None, albedo=None, air_temperature=None, wind=None,
+                   coefficients=None):
+    """
+    Steps 2-6 for irradiance arrays with leading dimensions, for example ensemble members or random samples. Time is
+    the last dimension and solar geometry is shared along the leading dimensions. Results match process_irradiance()
+    row by row.
+    :param dni: Array of shape (..., times)
+    :param dhi: Array of shape (..., times)
+    :param ghi: Array of shape (..., times)
+    :param geometry: Solar geometry for the times from astronomical_calculations.get_solar_geometry()
+    :param site: Optional dictionary of site parameters, see site_parameters.get_site_parameters()
+    :param albedo: Optional albedo array broadcastable to ghi, site albedo by default
+    :param air_temperature: Optional air temperature array, site dummy value by default
+    :param wind: Optional wind speed array, site dummy value by default
+    :param coefficients: Optional Huld coefficients k1 - k6, output_estimator.HULD_COEFFICIENTS by default
+    :return: Power output array in W, same shape as the broadcast inputs. Site parameters can be arrays of shape (n, 1)
+    as well, which gives n estimates for each timestamp
+    """
+    site = site_parameters.get_site_parameters(site)
+    if albedo is None:
+        albedo = site["albedo"]
+    if air_temperature is None:
+        air_temperature = site["air_temp"]
+    if wind is None:
+        wind = site["wind_speed"]
+
+    # step 2. project irradiance components to plane of array:
+    dni_poa, dhi_poa, ghi_poa = geometric_projections.project_to_panel_surface_arrays(
+        dni, dhi, ghi, geometry, albedo, site["tilt"], site["azimuth"], shading.get_site_shading(site))
+
+    # step 3. and 4. absorbed irradiance components and their sum:
+    angle_of_incidence = astronomical_calculations.get_solar_angle_of_incidence_array(
+        geometry["azimuth"].to_numpy(), geometry["apparent_zenith"].to_numpy(), site["tilt"], site["azimuth"])
+    dni_rc, dhi_rc, ghi_rc = reflection_estimator.reflection_corrected_arrays(
+        dni_poa, dhi_poa, ghi_poa, angle_of_incidence, site["reflectance_constant"], site["tilt"])
+    absorbed_radiation = dni_rc + dhi_rc + ghi_rc
+
+    # step 5. estimate panel temperature based on wind speed, air temperature and absorbed radiation
+    module_temperature = panel_temperature_estimator.module_temperature_array(
+        absorbed_radiation, wind, numpy.add(air_temperature, site["air_temp_offset"]), site["module_elevation"])
+
+    # step 6. estimate power output
+    return output_estimator.estimate_output_array(absorbed_radiation, module_temperature, site["rated_power"],
+                                                  coefficients) * site["derate"]
+
+
+def __add_weather(data, site):
+    """
+    Adds dummy wind and air temperature from site parameters when missing.
+    """
+    return panel_temperature_estimator.add_dummy_wind_and_temp(data, site["wind_speed"], site["air_temp"])
@@ -0,0 +1,165 @@
+"""
+Indexed store for measured production data.
+
+Inverter csv files are ingested once into a time sorted columnar store under
+    <config.production_store_directory>/<store name>/
+Each store contains three files:
+    time.npy    int64 nanoseconds since epoch, sorted. Naive csv timestamps are stored as if they were UTC.
+    power.npy   float64 power values, rows with missing time or power are dropped while ingesting
+    meta.json   source file path, size and modification time, timezone awareness and the first and last timestamp
+
+Range queries memory map the arrays and select rows with a binary search on the time column, so pulling day windows
+from a multi-year dataset does not read or parse the csv again. Stores are re-ingested automatically when the source
+csv changes and opened stores are kept in memory for the lifetime of the program. A store whose source csv has been
+removed is still read, the csv is only needed for ingesting.
+
+Example:
+store = production_data_store.open_store("helpers/pv_prod_Helsinki_2022-2023.csv")
+data = store.query(datetime.datetime(2023, 7, 12), datetime.datetime(2023, 7, 14))
+"""
+
+import json
+import os
+import shutil
+
+import numpy
+import pandas
+
+import config
+from helpers import time_conversions
+
+# opened stores, key is the store directory
+__open_stores = {}
+
+
+class ProductionStore:
+    """
+    Memory mapped production data of one inverter csv file.
+    """
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.directory = directory
+        self.times = numpy.load(os.path.join(directory, "time.npy"), mmap_mode="r")
+        self.power = numpy.load(os.path.join(directory, "power.npy"), mmap_mode="r")
+
+    def __len__(self):
+        return len(self.times)
+
+    def query_arrays(self, start, end):
+        """
+        Selects rows with start <= time <= end with a binary search.
+        :param start: Datetime, naive values are compared to stored naive timestamps directly
+        :param end: Datetime, inclusive
+        :return: Tuple (int64 nanosecond array, float power array), views to the memory mapped arrays
+        """
+        first = numpy.searchsorted(self.times, time_conversions.to_utc_ns(start), side="left")
+        last = numpy.searchsorted(self.times, time_conversions.to_utc_ns(end), side="right")
+        return self.times[first:last], self.power[first:last]
+
+    def query(self, start, end):
+        """
+        Selects rows with start <= time <= end.
+        :param start: Datetime
+        :param end: Datetime, inclusive
+        :return: Dataframe with time and power columns, same format as the source csv timestamps
+        """
+        times, power = self.query_arrays(start, end)
+        times = time_conversions.from_utc_ns(times)
+        if not self.meta["tz_aware"]:
+            times = times.tz_localize(None)
+        return pandas.DataFrame({"time": times, "power": numpy.array(power)})
+
+
+def open_store(csv_path, name=None, root=None):
+    """
+    Opens the store of an inverter csv file, ingests the csv first if the store does not exist or the csv has changed.
+    An existing store is read as it is when the csv does not exist.
+    :param csv_path: Path to a csv with prod_time and pv_inv_out columns separated by ";"
+    :param name: Store name, csv file name without extension by default
+    :param root: Store root directory, config.production_store_directory by default
+    :return: ProductionStore
+    """
+    directory = __store_path(csv_path, name, root)
+
+    store = __open_stores.get(directory)
+    if store is not None and __is_current(store.meta, csv_path):
+        return store
+
+    meta_path = os.path.join(directory, "meta.json")
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if not __is_current(meta, csv_path):
+            ingest_csv(csv_path, name, root)
+    else:
+        ingest_csv(csv_path, name, root)
+
+    store = ProductionStore(directory)
+    __open_stores[directory] = store
+    return store
+
+
+def ingest_csv(csv_path, name=None, root=None):
+    """
+    Reads an inverter csv once and writes it into the store format.
+    :param csv_path: Path to a csv with prod_time and pv_inv_out columns separated by ";"
+    :param name: Store name, csv file name without extension by default
+    :param root: Store root directory, config.production_store_directory by default
+    :return: Path to the written store
+    """
+    directory = __store_path(csv_path, name, root)
+
+    data = pandas.read_csv(csv_path, sep=";", usecols=["prod_time", "pv_inv_out"])
+    data["prod_time"] = pandas.to_datetime(data["prod_time"])
+    data = data.dropna()
+
+    times = time_conversions.to_utc_ns(data["prod_time"])
+    power = data["pv_inv_out"].to_numpy(dtype=numpy.float64)
+    order = numpy.argsort(times, kind="stable")
+    times = times[order]
+    power = power[order]
+
+    source = os.stat(csv_path)
+    meta = {"source": os.path.abspath(csv_path),
+            "source_size": source.st_size,
+            "source_mtime_ns": source.st_mtime_ns,
+            "tz_aware": data["prod_time"].dt.tz is not None,
+            "rows": int(len(times)),
+            "start": int(times[0]) if len(times) else None,
+            "end": int(times[-1]) if len(times) else None}
+
+    # writing to a temporary directory first and renaming it, readers never see half written stores
+    temporary = directory + ".tmp"
+    shutil.rmtree(temporary, ignore_errors=True)
+    os.makedirs(temporary)
+    numpy.save(os.path.join(temporary, "time.npy"), times)
+    numpy.save(os.path.join(temporary, "power.npy"), power)
+    with open(os.path.join(temporary, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(temporary, directory)
+    __open_stores.pop(directory, None)
+
+    return directory
+
+
+def __store_path(csv_path, name, root):
+    if root is None:
+        root = config.production_store_directory
+    if name is None:
+        name = os.path.splitext(os.path.basename(csv_path))[0]
+    os.makedirs(root, exist_ok=True)
+    return os.path.join(root, name)
+
+
+def __is_current(meta, csv_path):
+    """
+    Store is current if the source csv has not been modified after ingesting or does not exist anymore.
+    """
+    if not os.path.exists(csv_path):
+        return True
+    source = os.stat(csv_path)
+    return meta["source_size"] == source.st_size and meta["source_mtime_ns"] == source.st_mtime_ns
@@ -1,5 +1,6 @@
 import datetime
-import pandas
+
+from helpers import production_data_store
 
 
 
@@ -8,46 +9,43 @@ import pandas
 #### This file can be removed before open source release                                #####
 #############################################################################################
 
+# measured production csv files of FMI installations, keys are site names from site_parameters.py
+PRODUCTION_FILES = {"helsinki": "helpers/pv_prod_Helsinki_2022-2023.csv",
+                    "kuopio": "helpers/pv_prod_Kuopio_2022-2023_vs2.csv"}
+
+
+def get_production_store(site_name):
+    """
+    Returns the indexed production store of a site, None if no measured production is known for the site
+    """
+    if site_name not in PRODUCTION_FILES:
+        print("No measured production data for site \"" + site_name + "\"")
+        return None
+    return production_data_store.open_store(PRODUCTION_FILES[site_name])
+
+
 def __get_data_for_days(start_date, days, file):
     """
     This function reads known production values from helsinki 2022-2023 dataset
     Returns data for start_date + n days
     """
-    # reading csv
-    actual_production = pandas.read_csv(file, sep=";", parse_dates=["prod_time"])
-
-    # taking relevant parameters
-    actual_production = actual_production[["prod_time", "pv_inv_out"]]
-
-    # renaming columns
-    actual_production.columns = ["time", "power"]
-
-    # dropping na power values
-    actual_production = actual_production.dropna()
-
-    # formatting time column from text to datetime
-    actual_production['time'] = pandas.to_datetime(actual_production['time'])
-
-    # choosing relevant time interval
-    actual_production = actual_production[actual_production["time"] >= start_date]
-    actual_production = actual_production[actual_production["time"] <= start_date + datetime.timedelta(days=days+1) ]
-    actual_production = actual_production.dropna()
-
-    return actual_production
+    # csv is parsed only on first use, later calls are binary searches on the indexed store
+    store = production_data_store.open_store(file)
+    return store.query(start_date, start_date + datetime.timedelta(days=days+1))
 
 def get_data_for_days_kuopio(start_date, days):
     """
     This function reads known production values from Kuopio 2022-2023 dataset
     Returns data for start_date + n days
     """
-    return __get_data_for_days(start_date, days, "helpers/pv_prod_Kuopio_2022-2023_vs2.csv")
+    return __get_data_for_days(start_date, days, PRODUCTION_FILES["kuopio"])
 
 def get_data_for_days_helsinki(start_date, days):
     """
     This function reads known production values from Helsinki 2022-2023 dataset
     Returns data for start_date + n days
     """
-    return __get_data_for_days(start_date, days, "helpers/pv_prod_Helsinki_2022-2023.csv")
+    return __get_data_for_days(start_date, days, PRODUCTION_FILES["helsinki"])
 
 
 #get_data_for_days(datetime.datetime(2023, 7, 12), 2)
\ No newline at end of file
@@ -181,3 +181,85 @@ def __dhi_reflected():
     dhi_reflected = math.e ** part3
 
     return dhi_reflected
+
+
+"""
+VECTORIZED REFLECTION FUNCTIONS
+Same equations as above for whole arrays. Reflectance constant and tilt can be arrays as well, which allows evaluating
+many parameter sets at once.
+"""
+
+
+def dni_reflected_array(angle_of_incidence, reflectance=None):
+    """
+    Vectorized version of __dni_reflected().
+    :param angle_of_incidence: Array of angles of incidence in degrees
+    :param reflectance: Panel reflectance constant, module reflectance_constant by default
+    :return: Array of reflected fractions in range [0,1]
+    """
+    if reflectance is None:
+        reflectance = reflectance_constant
+
+    upper_fraction = numpy.exp(-numpy.cos(numpy.radians(angle_of_incidence)) / reflectance) - numpy.exp(-1.0 / reflectance)
+    lower_fraction = 1.0 - numpy.exp(-1.0 / reflectance)
+
+    return upper_fraction / lower_fraction
+
+
+def diffuse_reflected_arrays(tilt=None, reflectance=None):
+    """
+    Vectorized versions of __dhi_reflected() and __ghi_reflected().
+    :param tilt: Panel tilt in degrees, config.tilt by default
+    :param reflectance: Panel reflectance constant, module reflectance_constant by default
+    :return: dhi_reflected, ghi_reflected
+    """
+    if tilt is None:
+        tilt = config.tilt
+    if reflectance is None:
+        reflectance = reflectance_constant
+
+    c1 = 4.0 / (math.pi * 3.0)
+    c2 = -0.074
+    panel_tilt = numpy.radians(tilt)
+
+    part1_dhi = numpy.sin(panel_tilt) + (math.pi - panel_tilt - numpy.sin(panel_tilt)) / (1.0 + numpy.cos(panel_tilt))
+    part1_ghi = numpy.sin(panel_tilt) + (panel_tilt - numpy.sin(panel_tilt)) / (1.0 - numpy.cos(panel_tilt))
+
+    dhi_reflected = numpy.exp((-1.0 / reflectance) * (c1 * part1_dhi + c2 * (part1_dhi ** 2.0)))
+    ghi_reflected = numpy.exp((-1.0 / reflectance) * (c1 * part1_ghi + c2 * (part1_ghi ** 2.0)))
+
+    return dhi_reflected, ghi_reflected
+
+
+def reflection_corrected_arrays(dni_poa, dhi_poa, ghi_poa, angle_of_incidence, reflectance=None, tilt=None):
+    """
+    Computes absorbed shares of projected irradiance components.
+    :return: dni_rc, dhi_rc, ghi_rc arrays, their sum is the reflection corrected poa
+    """
+    dni_reflected = dni_reflected_array(angle_of_incidence, reflectance)
+    dhi_reflected, ghi_reflected = diffuse_reflected_arrays(tilt, reflectance)
+
+    dni_rc = numpy.abs(1 - dni_reflected) * dni_poa
+    dhi_rc = numpy.abs(1 - dhi_reflected) * dhi_poa
+    ghi_rc = numpy.abs(1 - ghi_reflected) * ghi_poa
+
+    return dni_rc, dhi_rc, ghi_rc
+
+
+def add_reflection_corrected_poa_vectorized(df, angle_of_incidence, reflectance=None, tilt=None):
+    """
+    Vectorized version of add_reflection_corrected_poa_components_to_df() and add_reflection_corrected_poa_to_df().
+    Adds dni_rc, dhi_rc, ghi_rc and poa_ref_cor columns.
+    :param df: Dataframe with dni_poa, dhi_poa and ghi_poa columns
+    :param angle_of_incidence: Array of angles of incidence for the rows of df
+    :return: df
+    """
+    dni_rc, dhi_rc, ghi_rc = reflection_corrected_arrays(df["dni_poa"].to_numpy(), df["dhi_poa"].to_numpy(),
+                                                         df["ghi_poa"].to_numpy(), angle_of_incidence,
+                                                         reflectance, tilt)
+    df["dni_rc"] = dni_rc
+    df["dhi_rc"] = dhi_rc
+    df["ghi_rc"] = ghi_rc
+    df["poa_ref_cor"] = dni_rc + dhi_rc + ghi_rc
+
+    return df
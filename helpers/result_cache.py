@@ -0,0 +1,172 @@
+"""
+Memoized pipeline results.
+
+The same inputs are often processed again: a worker answering forecasts of a fmi open run which has not changed, the
+clear sky reference of the same days in every backtest, a backtest rerun after an unrelated change. This file keeps
+pipeline results in an in-memory LRU cache with config.result_cache_entries entries. With config.result_cache_on_disk
+results are also stored as pickled dataframes under config.result_cache_directory and read back by later program
+runs, the least recently used files are removed when the directory grows over config.result_cache_disk_mb.
+
+A result is keyed by two hashes:
+    configuration   every value of config.py, the effective site parameters, the requested outputs and the module
+                    constants used by the pipeline, see configuration_hash()
+    input data      column names, dtypes, index and values of the input dataframe, see frame_fingerprint()
+Changing any config value, site parameter or input value gives a different key, stale results are never returned and
+are eventually evicted. Solar geometry is computed from the input times and site location, which are part of the key,
+a precomputed geometry is only passed on to the pipeline.
+
+Returned dataframes are copies, callers can modify them without changing the cached result.
+
+Example:
+data = result_cache.process_irradiance(irradiance_df, site)
+"""
+
+import collections
+import hashlib
+import json
+import os
+import pickle
+import types
+
+import numpy
+import pandas
+
+import config
+from helpers import output_estimator
+from helpers import pipeline
+from helpers import site_parameters
+
+# cached results, key is (configuration hash, input fingerprint), value is a dataframe
+__results = collections.OrderedDict()
+# hit and miss counts since start or clear()
+__statistics = {"hits": 0, "misses": 0}
+
+
+def process_irradiance(irradiance_df, site=None, geometry=None, outputs=None):
+    """
+    Same as pipeline.process_irradiance(), results of earlier calls with the same configuration and inputs are reused.
+    """
+    site = site_parameters.get_site_parameters(site)
+    if not config.result_cache_enabled:
+        return pipeline.process_irradiance(irradiance_df, site, geometry, outputs)
+
+    key = (configuration_hash(site, outputs), frame_fingerprint(irradiance_df))
+    result = __lookup(key)
+    if result is None:
+        __statistics["misses"] += 1
+        result = pipeline.process_irradiance(irradiance_df, site, geometry, outputs)
+        __store(key, result)
+    else:
+        __statistics["hits"] += 1
+    return result.copy()
+
+
+def configuration_hash(site, outputs=None):
+    """
+    Hash of everything besides the input data which affects pipeline results.
+    :param site: Dictionary of effective site parameters
+    :param outputs: Optional list of requested columns
+    :return: Hex digest string
+    """
+    settings = {name: value for name, value in vars(config).items()
+                if not name.startswith("_") and not isinstance(value, (types.ModuleType, types.FunctionType, type))}
+    state = {"config": settings,
+             "site": site,
+             "outputs": None if outputs is None else list(outputs),
+             "huld_coefficients": output_estimator.HULD_COEFFICIENTS}
+    text = json.dumps(state, sort_keys=True, default=str)
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+def frame_fingerprint(df):
+    """
+    Hash of the column names, dtypes, index and values of a dataframe. Values are hashed with pandas, about as fast as
+    copying the frame.
+    :return: Hex digest string
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(json.dumps([[str(column), str(dtype)] for column, dtype in df.dtypes.items()]).encode())
+    digest.update(str(df.index.dtype).encode())
+    digest.update(numpy.ascontiguousarray(pandas.util.hash_pandas_object(df, index=True).to_numpy()).tobytes())
+    return digest.hexdigest()
+
+
+def statistics():
+    """
+    :return: Dictionary with hits, misses and entries (results in memory)
+    """
+    return {"hits": __statistics["hits"], "misses": __statistics["misses"], "entries": len(__results)}
+
+
+def clear():
+    """
+    Empties the in-memory cache and resets statistics, files on disk are kept.
+    """
+    __results.clear()
+    __statistics["hits"] = 0
+    __statistics["misses"] = 0
+
+
+def __lookup(key):
+    if key in __results:
+        __results.move_to_end(key)
+        return __results[key]
+
+    if config.result_cache_on_disk:
+        path = __result_path(key)
+        # truncated files and files pickled by other pandas or numpy versions are computed again
+        try:
+            result = pandas.read_pickle(path)
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError, AttributeError, ImportError):
+            return None
+        # reading marks the file as recently used for eviction
+        os.utime(path)
+        __store(key, result, write=False)
+        return result
+
+    return None
+
+
+def __store(key, result, write=True):
+    __results[key] = result
+    __results.move_to_end(key)
+    while len(__results) > config.result_cache_entries:
+        __results.popitem(last=False)
+
+    if write and config.result_cache_on_disk:
+        path = __result_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = path + "." + str(os.getpid()) + ".tmp"
+        result.to_pickle(temporary)
+        os.replace(temporary, path)
+        __evict_files()
+
+
+def __result_path(key):
+    return os.path.join(config.result_cache_directory, key[0], key[1] + ".pkl")
+
+
+def __evict_files():
+    """
+    Removes least recently used result files until the directory is within config.result_cache_disk_mb.
+    """
+    files = []
+    for root, _, names in os.walk(config.result_cache_directory):
+        for name in names:
+            if name.endswith(".pkl"):
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except FileNotFoundError:
+                    # removed by another process
+                    continue
+                files.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+
+    excess = sum(size for _, size, _ in files) - config.result_cache_disk_mb * 1024 * 1024
+    for _, size, path in sorted(files):
+        if excess <= 0:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        excess -= size
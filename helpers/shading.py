@@ -0,0 +1,156 @@
+"""
+Horizon and near shading of a site.
+
+Shading is described by a horizon profile, a list of [azimuth, elevation] points in degrees, and by obstacles such as
+trees and buildings:
+    {"azimuth": 200, "width": 30, "height": 18, "distance": 25}
+An obstacle covers azimuths azimuth +- width / 2 up to the elevation angle of its top seen from the modules, height and
+distance are in meters and height is measured from the ground like module_elevation. Sites define them with the
+"horizon" and "obstacles" keys of site parameters, config.horizon_profile and config.shading_obstacles by default. A
+site json file could contain for example:
+    "horizon": [[90, 5], [180, 12], [270, 3]],
+    "obstacles": [{"azimuth": 200, "width": 30, "height": 18, "distance": 25}]
+
+The profile is precomputed once per site into a dense azimuth x elevation table with config.shading_resolution degree
+cells, each cell holds the visible fraction of the sun. Direct irradiance is then masked with one table lookup per
+timestamp, which costs the same for any profile. Diffuse irradiance is scaled with one constant per site, the share of
+the isotropic sky seen by the tilted panel which is above the horizon, when config.shading_diffuse is True.
+
+Example:
+site_shading = shading.get_site_shading(site)
+direct = shading.direct_factor(site_shading, geometry["azimuth"], 90 - geometry["apparent_zenith"])
+"""
+
+import json
+import math
+
+import numpy
+
+import config
+
+# precomputed shading of each site, key is the json of the parameters shading depends on
+__site_shading = {}
+
+
+def get_site_shading(site):
+    """
+    Precomputed shading of a site, computed on first use.
+    :param site: Dictionary of site parameters with horizon, obstacles, tilt, azimuth and module_elevation
+    :return: Dictionary with table, resolution, profile and diffuse factor, None if the site has no shading
+    """
+    horizon = site.get("horizon", config.horizon_profile)
+    obstacles = site.get("obstacles", config.shading_obstacles)
+    if not horizon and not obstacles:
+        return None
+
+    # parameter samples can have an array of module elevations, obstacle angles use their mean
+    module_elevation = float(numpy.mean(site["module_elevation"]))
+    key = json.dumps([horizon, obstacles, float(numpy.mean(site["tilt"])), float(numpy.mean(site["azimuth"])),
+                      module_elevation, config.shading_resolution])
+
+    if key not in __site_shading:
+        profile = horizon_profile(horizon, obstacles, module_elevation)
+        __site_shading[key] = {"table": sky_table(profile),
+                               "resolution": config.shading_resolution,
+                               "profile": profile,
+                               "diffuse": diffuse_view_factor(profile, numpy.mean(site["tilt"]),
+                                                              numpy.mean(site["azimuth"]))}
+    return __site_shading[key]
+
+
+def horizon_profile(horizon=None, obstacles=None, module_elevation=0.0, resolution=None):
+    """
+    Horizon elevation at the center of each azimuth cell.
+    :param horizon: List of [azimuth, elevation] points, linearly interpolated around the full circle
+    :param obstacles: List of obstacle dictionaries with azimuth, width, height and distance
+    :param module_elevation: Module elevation from ground in meters
+    :param resolution: Cell size in degrees, config.shading_resolution by default
+    :return: Array of elevations in degrees, one per azimuth cell starting from north
+    """
+    if resolution is None:
+        resolution = config.shading_resolution
+
+    azimuths = (numpy.arange(int(round(360 / resolution))) + 0.5) * resolution
+    profile = numpy.zeros(len(azimuths))
+
+    if horizon:
+        points = numpy.array(sorted(horizon), dtype=float)
+        profile = numpy.maximum(profile, numpy.interp(azimuths, points[:, 0], points[:, 1], period=360))
+
+    for obstacle in obstacles or []:
+        elevation = math.degrees(math.atan2(obstacle["height"] - module_elevation, obstacle["distance"]))
+        # azimuth difference in range [-180, 180)
+        difference = (azimuths - obstacle["azimuth"] + 180) % 360 - 180
+        covered = numpy.abs(difference) <= obstacle["width"] / 2
+        profile = numpy.where(covered, numpy.maximum(profile, elevation), profile)
+
+    return profile
+
+
+def sky_table(profile, resolution=None):
+    """
+    Visible fraction of each azimuth x elevation cell. The visible fraction changes linearly over one cell at the
+    horizon, so the sun does not disappear in one step.
+    :param profile: Horizon elevations from horizon_profile()
+    :param resolution: Cell size in degrees, config.shading_resolution by default
+    :return: Array of shape (azimuth cells, elevation cells from 0 to 90 degrees) with values in range [0, 1]
+    """
+    if resolution is None:
+        resolution = config.shading_resolution
+
+    elevations = (numpy.arange(int(math.ceil(90 / resolution))) + 0.5) * resolution
+    return numpy.clip((elevations[None, :] - numpy.asarray(profile)[:, None]) / resolution + 0.5, 0.0, 1.0)
+
+
+def direct_factor(shading, solar_azimuth, solar_elevation):
+    """
+    Visible fraction of the sun for each timestamp, one table lookup per timestamp.
+    :param shading: Dictionary from get_site_shading()
+    :param solar_azimuth: Array of solar azimuths in degrees
+    :param solar_elevation: Array of apparent solar elevations in degrees
+    :return: Array of factors in range [0, 1]
+    """
+    table = shading["table"]
+    resolution = shading["resolution"]
+
+    azimuth_index = numpy.floor(numpy.asarray(solar_azimuth, dtype=float) / resolution).astype(numpy.int64)
+    azimuth_index %= table.shape[0]
+    elevation = numpy.nan_to_num(numpy.asarray(solar_elevation, dtype=float), nan=-1.0)
+    elevation_index = numpy.clip(numpy.floor(elevation / resolution).astype(numpy.int64), 0, table.shape[1] - 1)
+
+    # sun below the horizon is always shaded
+    return numpy.where(elevation < 0, 0.0, table[azimuth_index, elevation_index])
+
+
+def diffuse_view_factor(profile, tilt, azimuth, resolution=None):
+    """
+    Share of isotropic sky diffuse irradiance on the panel which comes from above the horizon profile.
+    :param profile: Horizon elevations from horizon_profile()
+    :param tilt: Panel tilt in degrees
+    :param azimuth: Panel azimuth in degrees
+    :return: Factor in range [0, 1]
+    """
+    if resolution is None:
+        resolution = config.shading_resolution
+
+    table = sky_table(profile, resolution)
+    azimuths = numpy.radians((numpy.arange(table.shape[0]) + 0.5) * resolution)[:, None]
+    elevations = numpy.radians((numpy.arange(table.shape[1]) + 0.5) * resolution)[None, :]
+
+    # cosine of the angle between the panel normal and each sky cell, cells behind the panel do not contribute
+    tilt = math.radians(tilt)
+    azimuth = math.radians(azimuth)
+    incidence = (numpy.sin(elevations) * math.cos(tilt)
+                 + numpy.cos(elevations) * math.sin(tilt) * numpy.cos(azimuths - azimuth))
+    # solid angle of a cell is proportional to the cosine of its elevation
+    weights = numpy.maximum(incidence, 0.0) * numpy.cos(elevations)
+
+    total = weights.sum()
+    return float((weights * table).sum() / total) if total > 0 else 1.0
+
+
+def clear():
+    """
+    Empties precomputed site shading.
+    """
+    __site_shading.clear()
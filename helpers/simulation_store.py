@@ -0,0 +1,335 @@
+"""
+Out-of-core storage for long simulations.
+
+Twenty years of one minute output is over ten million rows per site, more than fits in memory as dataframes once
+several sites and columns are simulated. A simulation store preallocates one memory mapped array per output column on
+disk and the pipeline writes into it chunk by chunk, memory use stays at one chunk however long the simulation is.
+A store is a directory
+    <config.simulation_directory>/<store name>/
+        meta.json       time grid, site names, columns, dtype and the end of the written rows of each site
+        time.npy        int64 nanoseconds since epoch in UTC, one row per step of the time grid
+        <column>.npy    config.simulation_dtype array of shape (sites, rows), nan for rows not written yet
+The .npy files are plain numpy arrays with their small header, they can also be opened with numpy.load(mmap_mode="r").
+
+Rows are placed by their timestamps on the regular time grid, chunks can be written in any order and a simulation which
+was stopped continues from the written end of each site. Sources with other timestamps, hourly fmi open data centered
+at half hours for example, are resampled to the grid before running the pipeline. Readers get views to the memory
+mapped arrays, reopening a store reads only meta.json. Energy aggregation and plot curves read the arrays in blocks of
+config.simulation_read_rows rows, periods with unwritten rows have nan energy.
+
+Example:
+store = simulation_store.simulate("helsinki_20y", ["helsinki"], datetime.datetime(2004, 1, 1),
+                                  datetime.datetime(2023, 12, 31))
+months, kwh = store.aggregate_energy("helsinki", period="month")
+"""
+
+import datetime
+import json
+import math
+import os
+import shutil
+
+import numpy
+import pandas
+
+import config
+from helpers import data_resampler
+from helpers import energy_aggregation
+from helpers import pipeline
+from helpers import site_parameters
+from helpers import solar_irradiance_estimator
+from helpers import time_conversions
+
+NANOSECONDS_PER_MINUTE = 60 * 1_000_000_000
+
+
+class SimulationStore:
+    """
+    Memory mapped simulation results of one or more sites on a shared time grid.
+    """
+
+    def __init__(self, directory, writable=False):
+        with open(os.path.join(directory, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.directory = directory
+        self.writable = writable
+        mode = "r+" if writable else "r"
+        self.times = numpy.load(os.path.join(directory, "time.npy"), mmap_mode="r")
+        self.columns = {column: numpy.load(os.path.join(directory, column + ".npy"), mmap_mode=mode)
+                        for column in self.meta["columns"]}
+
+    def __len__(self):
+        return self.meta["rows"]
+
+    def sites(self):
+        return list(self.meta["sites"])
+
+    def column(self, column="output", site=None):
+        """
+        :param column: Column name
+        :param site: Site name, the first site by default
+        :return: Memory mapped array of the column for all rows
+        """
+        return self.columns[column][self.__site_row(site)]
+
+    def query_arrays(self, start, end, column="output", site=None):
+        """
+        Selects rows with start <= time <= end.
+        :param start: Datetime, naive values are UTC
+        :param end: Datetime, inclusive
+        :return: Tuple (int64 nanosecond array, column array), views to the memory mapped arrays
+        """
+        first = numpy.searchsorted(self.times, time_conversions.to_utc_ns(start), side="left")
+        last = numpy.searchsorted(self.times, time_conversions.to_utc_ns(end), side="right")
+        return self.times[first:last], self.column(column, site)[first:last]
+
+    def write(self, data, site=None):
+        """
+        Writes the store columns of a pipeline output frame to the rows of its timestamps. Timestamps outside the time
+        grid or between its steps are skipped.
+        :param data: Dataframe with a time column and the store columns
+        :param site: Site name, the first site by default
+        :return: Number of written rows
+        """
+        if not self.writable:
+            raise ValueError("store " + self.directory + " is opened read only")
+
+        times = time_conversions.to_utc_ns(data["time"])
+        offsets = times - self.meta["start"]
+        step = self.meta["step"]
+        valid = (offsets >= 0) & (offsets % step == 0) & (offsets < self.meta["rows"] * step)
+        rows = offsets[valid] // step
+
+        site_row = self.__site_row(site)
+        for column, values in self.columns.items():
+            values[site_row, rows] = data[column].to_numpy(dtype=numpy.float64)[valid]
+        return int(valid.sum())
+
+    def mark_written(self, site, end):
+        """
+        Records that rows of a site are written up to end, flushes the arrays first.
+        :param end: int64 nanoseconds since epoch, exclusive
+        """
+        for values in self.columns.values():
+            values.flush()
+        self.meta["written"][site] = int(end)
+        write_meta(self.directory, self.meta)
+
+    def aggregate_energy(self, site=None, period="day", column="output", timezone=None):
+        """
+        Same as energy_aggregation.aggregate_energy() for a whole column, computed in blocks of rows. Periods with rows
+        which are not written, or which the source had no data for, are not counted as zero, their energy is nan.
+        :return: Tuple (DatetimeIndex of period starts, float array of energy in kWh)
+        """
+        values = self.column(column, site)
+        starts, energies, unwritten = [], [], []
+        for first in range(0, len(self), config.simulation_read_rows):
+            last = min(first + config.simulation_read_rows, len(self))
+            block = numpy.asarray(values[first:last], dtype=numpy.float64)
+            # the time grid is regular, durations at block edges are the same as inside the blocks
+            block_starts, block_energy = energy_aggregation.aggregate_energy(self.times[first:last], block, period,
+                                                                             timezone)
+            codes, _ = energy_aggregation.period_index(self.times[first:last], period, timezone)
+            starts.append(time_conversions.to_utc_ns(block_starts))
+            energies.append(block_energy)
+            unwritten.append(numpy.bincount(codes, weights=numpy.isnan(block), minlength=len(block_starts)))
+
+        if not starts:
+            return energy_aggregation.aggregate_energy([], [], period, timezone)
+
+        # periods which span two blocks are summed together
+        codes, unique_starts = pandas.factorize(numpy.concatenate(starts), sort=True)
+        energy = numpy.bincount(codes, weights=numpy.concatenate(energies), minlength=len(unique_starts))
+        missing = numpy.bincount(codes, weights=numpy.concatenate(unwritten), minlength=len(unique_starts))
+        energy[missing > 0] = numpy.nan
+        return time_conversions.from_utc_ns(unique_starts).tz_convert(timezone or config.local_timezone), energy
+
+    def curve(self, site=None, column="output", max_points=None):
+        """
+        Min/max envelope of a whole column for plotting, see downsampling.py. Computed in blocks of rows.
+        :param max_points: Maximum number of points, config.plot_max_points by default
+        :return: Tuple (DatetimeIndex, float array)
+        """
+        if max_points is None:
+            max_points = config.plot_max_points
+        values = self.column(column, site)
+
+        # rows of the regular time grid are split into equally long buckets, each gives its smallest and largest value
+        bucket_rows = 1 if max_points is None else max(math.ceil(len(self) / max(max_points // 2, 1)), 1)
+        block_rows = max(config.simulation_read_rows // bucket_rows, 1) * bucket_rows
+        indices = []
+        for first in range(0, len(self), block_rows):
+            block = numpy.asarray(values[first:first + block_rows], dtype=numpy.float64)
+            padded = numpy.full(math.ceil(len(block) / bucket_rows) * bucket_rows, numpy.nan)
+            padded[:len(block)] = block
+            buckets = padded.reshape(-1, bucket_rows)
+
+            written = ~numpy.isnan(buckets).all(axis=1)
+            buckets = buckets[written]
+            offsets = first + numpy.flatnonzero(written) * bucket_rows
+            # nan values are never selected
+            indices.extend([offsets + numpy.where(numpy.isnan(buckets), numpy.inf, buckets).argmin(axis=1),
+                            offsets + numpy.where(numpy.isnan(buckets), -numpy.inf, buckets).argmax(axis=1)])
+
+        indices = numpy.unique(numpy.concatenate(indices)) if indices else numpy.empty(0, dtype=numpy.int64)
+        return time_conversions.from_utc_ns(self.times[indices]), numpy.asarray(values[indices], dtype=numpy.float64)
+
+    def __site_row(self, site):
+        if site is None:
+            return 0
+        return self.meta["sites"].index(site)
+
+
+def create_store(name, sites, date_start, date_end, resolution=None, columns=None, root=None):
+    """
+    Preallocates a store for a time grid, an existing store with the same name is replaced.
+    :param name: Store name
+    :param sites: List of site names
+    :param date_start: First timestamp, naive values are in config.timezone
+    :param date_end: Last timestamp, included
+    :param resolution: Minutes between timestamps, config.data_resolution by default
+    :param columns: Stored pipeline columns, config.simulation_columns by default
+    :param root: Store root directory, config.simulation_directory by default
+    :return: Writable SimulationStore
+    """
+    if resolution is None:
+        resolution = config.data_resolution
+    if columns is None:
+        columns = config.simulation_columns
+    directory = __store_path(name, root)
+
+    times = pandas.date_range(start=date_start, end=date_end, freq=str(resolution) + "min", tz=config.timezone)
+    meta = {"sites": list(sites),
+            "columns": list(columns),
+            "dtype": config.simulation_dtype,
+            "resolution": resolution,
+            "start": int(time_conversions.to_utc_ns(times[0])) if len(times) else 0,
+            "step": resolution * NANOSECONDS_PER_MINUTE,
+            "rows": len(times),
+            "written": {}}
+
+    # arrays are filled through a temporary directory which is renamed, readers never see a half created store
+    temporary = directory + ".tmp"
+    shutil.rmtree(temporary, ignore_errors=True)
+    os.makedirs(temporary)
+    numpy.save(os.path.join(temporary, "time.npy"), meta["start"] + numpy.arange(len(times), dtype=numpy.int64)
+               * meta["step"])
+    for column in columns:
+        values = numpy.lib.format.open_memmap(os.path.join(temporary, column + ".npy"), mode="w+",
+                                              dtype=config.simulation_dtype, shape=(len(sites), len(times)))
+        for first in range(0, len(times), config.simulation_read_rows):
+            values[:, first:first + config.simulation_read_rows] = numpy.nan
+        values.flush()
+        del values
+    write_meta(temporary, meta)
+
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(temporary, directory)
+    return SimulationStore(directory, writable=True)
+
+
+def open_store(name, root=None, writable=False):
+    """
+    Opens an existing store, only meta.json is read.
+    :return: SimulationStore, None if the store does not exist
+    """
+    directory = __store_path(name, root)
+    if not os.path.exists(os.path.join(directory, "meta.json")):
+        print("Error: simulation store \"" + directory + "\" not found")
+        return None
+    return SimulationStore(directory, writable)
+
+
+def simulate(name, sites, date_start, date_end, model="pvlib", chunk_days=None, root=None, overwrite=False):
+    """
+    Runs the pipeline for every site over a date range and writes the results into a store chunk by chunk. An existing
+    store of the same name and time grid continues from the written end of each site, an existing store with other
+    sites, columns or time grid is only replaced with overwrite.
+    :param name: Store name
+    :param sites: List of site names
+    :param date_start: First day
+    :param date_end: Last day, included
+    :param model: Irradiance model, see solar_irradiance_estimator.get_solar_irradiance()
+    :param chunk_days: Days processed at a time, config.simulation_chunk_days by default
+    :param overwrite: True replaces an existing store which does not match the sites and time grid
+    :return: SimulationStore opened read only, None if an existing store was not replaced
+    """
+    if chunk_days is None:
+        chunk_days = config.simulation_chunk_days
+    day_end = date_end + datetime.timedelta(days=1, minutes=-1)
+
+    store = open_store(name, root, writable=True) if os.path.exists(os.path.join(__store_path(name, root),
+                                                                                 "meta.json")) else None
+    if store is not None and not __same_grid(store, sites, date_start, day_end):
+        if not overwrite:
+            print("Error: simulation store " + name + " exists with other sites, columns or time grid, use --replace "
+                  + "or overwrite=True to replace it")
+            return None
+        store = None
+    if store is None:
+        store = create_store(name, sites, date_start, day_end, root=root)
+
+    for site_name in sites:
+        site = site_parameters.get_site(site_name)
+        if site is None:
+            continue
+
+        day = date_start
+        written = store.meta["written"].get(site_name)
+        if written is not None:
+            # continuing from the local day of the written end
+            written_day = time_conversions.from_utc_ns([written])[0].tz_convert(config.timezone).tz_localize(None)
+            day = max(day, datetime.datetime(written_day.year, written_day.month, written_day.day))
+
+        while day <= date_end:
+            days = min(chunk_days, (date_end - day).days + 1)
+            irradiance = __on_grid(solar_irradiance_estimator.get_solar_irradiance(day, days, model=model, site=site),
+                                   store, day, days)
+            data = pipeline.process_irradiance(irradiance, site, outputs=["time"] + store.meta["columns"])
+            store.write(data, site_name)
+            day += datetime.timedelta(days=days)
+            store.mark_written(site_name, time_conversions.to_utc_ns(pandas.Timestamp(day, tz=config.timezone)))
+
+        print("Simulated " + site_name + " " + date_start.strftime("%Y-%m-%d") + " - " + date_end.strftime("%Y-%m-%d"))
+
+    return open_store(name, root)
+
+
+def write_meta(directory, meta):
+    """
+    Replaces meta.json of a store through a temporary file.
+    """
+    temporary = os.path.join(directory, "meta.json." + str(os.getpid()) + ".tmp")
+    with open(temporary, "w") as f:
+        json.dump(meta, f)
+    os.replace(temporary, os.path.join(directory, "meta.json"))
+
+
+def __on_grid(irradiance, store, day, days):
+    """
+    Resamples source data which is not on the time grid of the store, hourly fmi open and MEPS values centered at half
+    hours for example, to the grid rows of the simulated days. See data_resampler.resample_fmi_frame().
+    """
+    times = time_conversions.to_utc_ns(irradiance["time"])
+    step = store.meta["step"]
+    if len(times) == 0 or (numpy.all((times - store.meta["start"]) % step == 0)
+                           and numpy.all(numpy.diff(times) == step)):
+        return irradiance
+
+    first = pandas.Timestamp(day, tz=config.timezone)
+    last = pandas.Timestamp(day + datetime.timedelta(days=days), tz=config.timezone) - pandas.Timedelta(step)
+    return data_resampler.resample_fmi_frame(irradiance, store.meta["resolution"], first, last)
+
+
+def __same_grid(store, sites, date_start, date_end):
+    times = pandas.date_range(start=date_start, end=date_end, freq=str(config.data_resolution) + "min",
+                              tz=config.timezone)
+    return (store.meta["sites"] == list(sites) and store.meta["columns"] == list(config.simulation_columns)
+            and store.meta["rows"] == len(times) and store.meta["resolution"] == config.data_resolution
+            and len(times) > 0 and store.meta["start"] == time_conversions.to_utc_ns(times[0]))
+
+
+def __store_path(name, root):
+    if root is None:
+        root = config.simulation_directory
+    return os.path.join(root, name)
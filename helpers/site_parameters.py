@@ -0,0 +1,146 @@
+"""
+Site parameters for the vectorized pipeline.
+
+The row by row functions read installation parameters directly from config.py. Vectorized functions take them as
+arguments instead, which allows processing several sites in one program run without modifying config values.
+Parameters are passed around as plain dictionaries with the keys listed in PARAMETER_NAMES.
+
+Named sites:
+- config.site_name, parameters from config.py
+- "helsinki", "kuopio" and "tyyssija", parameters from the FMI installation section of config.py
+- sites defined as json files in config.site_directory, for example sites/turku_school.json:
+    {"site_name": "turku_school", "latitude": 60.45, "longitude": 22.27, "tilt": 30, "azimuth": 190, "rated_power": 50}
+  Keys missing from the file are taken from config.py.
+"""
+
+import json
+import os
+
+import config
+from helpers import reflection_estimator
+
+PARAMETER_NAMES = ["site_name", "latitude", "longitude", "elevation", "tilt", "azimuth", "rated_power", "albedo",
+                   "module_elevation", "reflectance_constant", "wind_speed", "air_temp", "air_temp_offset", "derate",
+                   "horizon", "obstacles"]
+
+
+def get_site_parameters(overrides=None):
+    """
+    Returns installation parameters from config.py, values in overrides replace config values.
+    :param overrides: Optional dictionary, for example {"tilt": 15, "azimuth": 135}
+    :return: Dictionary with keys from PARAMETER_NAMES
+    """
+    parameters = {"site_name": config.site_name,
+                  "latitude": config.latitude,
+                  "longitude": config.longitude,
+                  "elevation": config.elevation,
+                  "tilt": config.tilt,
+                  "azimuth": config.azimuth,
+                  "rated_power": config.rated_power,
+                  "albedo": config.albedo,
+                  "module_elevation": config.module_elevation,
+                  "reflectance_constant": reflection_estimator.reflectance_constant,
+                  "wind_speed": config.wind_speed,
+                  "air_temp": config.air_temp,
+                  "air_temp_offset": config.air_temp_offset,
+                  "derate": config.derate,
+                  "horizon": config.horizon_profile,
+                  "obstacles": config.shading_obstacles}
+
+    if overrides is not None:
+        parameters.update(overrides)
+
+    return parameters
+
+
+def get_site(name):
+    """
+    Returns parameters of a named site. Site files in config.site_directory override built-in sites with the same name.
+    :param name: Site name
+    :return: Dictionary with keys from PARAMETER_NAMES, None if site is not known
+    """
+    path = os.path.join(config.site_directory, name + ".json")
+    if os.path.exists(path):
+        return load_site_file(path)
+
+    builtin_sites = __get_builtin_sites()
+    if name in builtin_sites:
+        return get_site_parameters(builtin_sites[name])
+
+    print("Error: site \"" + name + "\" not found in config.py or in " + config.site_directory)
+    return None
+
+
+def list_sites():
+    """
+    Lists names of all known sites, built-in sites first.
+    :return: List of site names
+    """
+    names = list(__get_builtin_sites().keys())
+    if os.path.isdir(config.site_directory):
+        for file_name in sorted(os.listdir(config.site_directory)):
+            if file_name.endswith(".json") and file_name[:-len(".json")] not in names:
+                names.append(file_name[:-len(".json")])
+    return names
+
+
+def load_site_file(path):
+    """
+    Reads site parameters from a json file, missing parameters are taken from config.py.
+    :param path: Path to site json file
+    :return: Dictionary with keys from PARAMETER_NAMES
+    """
+    with open(path) as f:
+        overrides = json.load(f)
+
+    if "site_name" not in overrides:
+        overrides["site_name"] = os.path.basename(path)[:-len(".json")]
+
+    return get_site_parameters(overrides)
+
+
+def save_site_file(site, path=None):
+    """
+    Writes site parameters to a json file which get_site() reads. The file is replaced atomically.
+    :param site: Dictionary of site parameters
+    :param path: Output path, <config.site_directory>/<site name>.json by default
+    :return: Path to the written file
+    """
+    if path is None:
+        os.makedirs(config.site_directory, exist_ok=True)
+        path = os.path.join(config.site_directory, site["site_name"] + ".json")
+
+    temporary = path + ".tmp"
+    with open(temporary, "w") as f:
+        json.dump({name: site[name] for name in PARAMETER_NAMES if name in site}, f, indent=4)
+    os.replace(temporary, path)
+
+    return path
+
+
+def __get_builtin_sites():
+    """
+    Sites defined in config.py
+    """
+    return {config.site_name: {},
+            "helsinki": {"site_name": "helsinki",
+                         "latitude": config.latitude_helsinki,
+                         "longitude": config.longitude_helsinki,
+                         "tilt": config.tilt_helsinki,
+                         "azimuth": config.azimuth_helsinki,
+                         "rated_power": config.rated_power_helsinki,
+                         "module_elevation": config.elevation_helsinki},
+            "kuopio": {"site_name": "kuopio",
+                       "latitude": config.latitude_kuopio,
+                       "longitude": config.longitude_kuopio,
+                       "tilt": config.tilt_kuopio,
+                       "azimuth": config.azimuth_kuopio,
+                       "rated_power": config.rated_power_kuopio,
+                       "module_elevation": config.elevation_kuopio},
+            "tyyssija": {"site_name": "tyyssija",
+                         "latitude": 60.462,
+                         "longitude": 22.288,
+                         "tilt": 20,
+                         "azimuth": 180,
+                         "rated_power": 142,
+                         "module_elevation": 25}}
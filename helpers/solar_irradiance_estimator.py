@@ -1,20 +1,18 @@
 import sys
 
-import pandas as pd
-from pvlib import location
 from datetime import timedelta
 
-from helpers import _meps_data_loader
+from helpers import _meps_data_loader, clearsky_cache, forecast_archive, wfs_replay, meps_grid_loader, site_parameters
 import config
 
 """
 Solar irradiance dataframe creation functions are included in this file.
 
-Currently supports pvlib simulations and fmi open data
+Currently supports pvlib simulations, fmi open data and locally stored gridded MEPS files
 """
 
 
-def get_solar_irradiance(date_start, day_count, model="pvlib"):
+def get_solar_irradiance(date_start, day_count, model="pvlib", site=None):
     """
     Returns a dataframe with datetime, ghi, dni and dhi values.
     Example output:
@@ -28,6 +26,7 @@ def get_solar_irradiance(date_start, day_count, model="pvlib"):
     :param date_start, first day in model
     :param date_end, last day in model
     :param model: string with model name, uses pvlib by default
+    :param site: Optional dictionary of site parameters, see site_parameters.py. Location from config.py by default
     :return:
     """
     #print("Generating dataframe with ghi, dni, dhi using " + str(model) + ".")
@@ -36,13 +35,19 @@ def get_solar_irradiance(date_start, day_count, model="pvlib"):
     date_end = date_start + timedelta(days=day_count, minutes=-1)
     #print("start date:" + str(date_start) + " - " + str(date_end))
 
+    site = site_parameters.get_site_parameters(site)
+
     match model:
         case "pvlib" | "pvlib_ineichen" | "inechen":
-            return __get_irradiance_pvlib(date_start, date_end)
+            return __get_irradiance_pvlib(date_start, date_end, site)
         case "pvlib_simplified_solis" | "simplified_solis" | "solis":
-            return __get_irradiance_pvlib(date_start, date_end, mod="simplified_solis")
+            return __get_irradiance_pvlib(date_start, date_end, site, mod="simplified_solis")
         case "meps" | "fmi_open" | "fmiopen":
-            return __get_irradiance_fmiopen(date_start, date_end)
+            return __get_irradiance_fmiopen(date_start, date_end, site)
+        case "replay" | "fmiopen_replay":
+            return __get_irradiance_replay(date_start, date_end, site)
+        case "meps_grid":
+            return __get_irradiance_meps_grid(date_start, date_end, site)
 
 
     # none of the cases activated:
@@ -51,39 +56,81 @@ def get_solar_irradiance(date_start, day_count, model="pvlib"):
 
 
 
-def __get_irradiance_fmiopen(date_start, date_end):
-    latlon = str(config.latitude) + "," + str(config.longitude)
-    return _meps_data_loader.collect_fmi_opendata(latlon, date_start, date_end)
+def get_ensemble_irradiance(date_start, day_count, site=None, members=None):
+    """
+    MEPS ensemble forecast of all members as arrays, see _meps_data_loader.parse_meps_ensemble_xml().
+    :param date_start: First day
+    :param day_count: Number of days
+    :param site: Optional dictionary of site parameters
+    :param members: List of member numbers, members 0 - config.meps_ensemble_members - 1 by default
+    :return: Dictionary with members, index, time and (member, time) arrays of dni, dhi, ghi, albedo, T and wind
+    """
+    if members is None:
+        members = list(range(config.meps_ensemble_members))
+
+    date_end = date_start + timedelta(days=day_count, minutes=-1)
+    site = site_parameters.get_site_parameters(site)
+
+    latlon = str(site["latitude"]) + "," + str(site["longitude"])
+    xml = _meps_data_loader.download_meps_ensemble_xml(latlon, date_start, date_end, members)
+    ensemble = _meps_data_loader.parse_meps_ensemble_xml(xml, members, site["latitude"], site["longitude"])
+
+    if len(ensemble["members"]) == 0:
+        print("Error: no MEPS ensemble members found for " + str(date_start) + " - " + str(date_end))
+        sys.exit(1)
+
+    selected = (ensemble["index"] >= date_start) & (ensemble["index"] <= date_end)
+    return {key: (value[..., selected] if key != "members" else value) for key, value in ensemble.items()}
+
+
+def __get_irradiance_fmiopen(date_start, date_end, site):
+    latlon = str(site["latitude"]) + "," + str(site["longitude"])
+    xml = _meps_data_loader.download_fmi_opendata_xml(latlon, date_start, date_end)
+
+    # recording raw responses so that this run can be replayed offline
+    if config.record_wfs_responses:
+        wfs_replay.record_response(xml, date_start, site["site_name"])
+
+    data = _meps_data_loader.parse_fmi_opendata_xml(xml, site["latitude"], site["longitude"])
+
+    # storing every fetched frame for backtesting and later analysis
+    if config.archive_forecasts:
+        forecast_archive.archive_frame(data, "fmi", site["site_name"])
+
+    return data
 
 
-def __get_irradiance_pvlib(date_start, date_end, mod="ineichen"):
+def __get_irradiance_replay(date_start, date_end, site):
     """
-    PVlib based clear sky irradiance modeling
-    :param date: Datetime object containing a date
-    :param mod: One of the 3 models supported by pvlib
-    :return: Dataframe with ghi, dni, dhi. Or only GHI if using haurwitz
+    Offline fmi open data, replays recorded WFS responses or archived frames. No network access required.
     """
+    data = wfs_replay.load_replay_frame(date_start, date_end, site["site_name"],
+                                        latitude=site["latitude"], longitude=site["longitude"])
+    if data is None:
+        print("Error: no recorded fmi open data for " + str(date_start) + " - " + str(date_end))
+        sys.exit(1)
+    return data
 
-    # creating site data required by pvlib poa
-    site = location.Location(config.latitude, config.longitude, tz=config.timezone)
 
-    # measurement frequency, for example "15min" or "60min"
-    measurement_frequency = str(config.data_resolution) + "min"
-
-    # measurement count, 1440 minutes per day
-    measurement_count = 1440 / config.data_resolution
+def __get_irradiance_meps_grid(date_start, date_end, site):
+    """
+    MEPS data extracted from the locally stored gridded file config.meps_grid_file.
+    """
+    data = meps_grid_loader.extract_sites(config.meps_grid_file, [site])[site["site_name"]]
+    return data[(data.index >= date_start) & (data.index <= date_end)]
 
-    times = pd.date_range(start=date_start,
-                          end=date_end,  # year + day for which the irradiance is calculated
-                          freq=measurement_frequency,  # take measurement every 60 minutes
-                          tz=site.tz)  # timezone
 
-    # creating a clear sky and solar position entities
-    clearsky = site.get_clearsky(times, model=mod)
+def __get_irradiance_pvlib(date_start, date_end, site, mod="ineichen"):
+    """
+    PVlib based clear sky irradiance modeling
+    :param date: Datetime object containing a date
+    :param mod: One of the 3 models supported by pvlib
+    :return: Dataframe with ghi, dni, dhi. Or only GHI if using haurwitz
+    """
 
-    # adds index as a separate time column, for some reason this is required as even a named index is not callable
-    # with df[index_name] and df.index is not supported by function apply structures
-    clearsky.insert(loc=0, column="time", value=clearsky.index)
+    # clear sky days are computed once per site, model and resolution, see clearsky_cache.py
+    clearsky = clearsky_cache.get_clearsky(date_start, date_end, site, model=mod, resolution=config.data_resolution,
+                                           timezone=config.timezone)
 
     # returning clearsky irradiance df
     return clearsky
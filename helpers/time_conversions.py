@@ -0,0 +1,37 @@
+"""
+Time conversion helpers shared by the archive, resampling and aggregation functions.
+
+Timestamps are handled internally as int64 nanoseconds since epoch in UTC. This allows sorted time searches with
+numpy.searchsorted and storing time columns as plain numpy arrays. Naive timestamps are assumed to be in UTC as the
+rest of the project produces UTC data.
+"""
+
+import numpy
+import pandas
+
+
+def to_utc_ns(times):
+    """
+    Converts datetimes to int64 nanoseconds since epoch in UTC.
+    :param times: Series, DatetimeIndex, array or a single timestamp. Naive values are interpreted as UTC.
+    :return: numpy int64 array, or int if a single timestamp was given
+    """
+    if isinstance(times, (str, pandas.Timestamp)) or not hasattr(times, "__len__"):
+        timestamp = pandas.Timestamp(times)
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.tz_localize("UTC")
+        return int(timestamp.tz_convert("UTC").as_unit("ns").value)
+
+    index = pandas.DatetimeIndex(times)
+    if index.tz is None:
+        index = index.tz_localize("UTC")
+    return index.tz_convert("UTC").as_unit("ns").asi8
+
+
+def from_utc_ns(values):
+    """
+    Converts int64 nanoseconds since epoch back to a UTC DatetimeIndex.
+    :param values: int64 array
+    :return: DatetimeIndex with UTC timezone
+    """
+    return pandas.to_datetime(numpy.asarray(values, dtype=numpy.int64), unit="ns", utc=True)
@@ -0,0 +1,319 @@
+"""
+Export of forecast weather data to yearly TMY (typical meteorological year) files for Radiance runs.
+
+Hourly rows are appended to one file per site and year:
+    <config.tmy_directory>weatherPrediction_<site name>_<year>.csv
+Files follow the PVGIS TMY csv layout, a header with the site location and months followed by the columns
+    time(UTC),T2m,RH,G(h),Gb(n),Gd(h),IR(h),WS10m,WD10m,SP
+Rows are timestamped with the end of their hour and assigned to the year in which the hour starts, a file contains
+hours from 01:00 on January 1st to 00:00 on January 1st of the next year. The first rows of a new year start a new
+file with its own header.
+
+Appending is safe to repeat and the newest values of an hour win. Rows which are identical to the row already in the
+file for their timestamp are skipped, new and changed rows are written with a single append call, so a later forecast
+of an hour is appended after the older one. load_year() and compact() keep the last row of each timestamp. A half
+written last line left by an interrupted write is removed before the next append. Daily appends are not necessarily in
+time order, compact() rewrites a year file sorted and without duplicates and can also write an EnergyPlus weather file
+(.epw) of the same data. A year file is compacted automatically when rows of the following year are appended.
+
+fmi open data does not contain relative humidity, infrared radiation, wind direction or surface pressure. If the
+appended dataframe does not have RH, IR(h), WD10m or SP columns, constant site values from config.py are used.
+
+The nightly export of each site is scheduler.export_tmy_day(), it runs only the pipeline steps the TMY columns need.
+
+Example:
+data = pipeline.process_irradiance(fmi_df, site, outputs=tmy_writer.INPUT_COLUMNS)
+tmy_writer.append_frame(data, site)
+"""
+
+import io
+import os
+
+import numpy
+import pandas
+
+import config
+from helpers import site_parameters
+from helpers import time_conversions
+
+# pipeline columns needed for TMY files
+INPUT_COLUMNS = ["T", "ghi", "dni", "dhi", "wind"]
+
+# TMY column, pipeline column and number format for each column after time(UTC)
+TMY_COLUMNS = [("T2m", "T", "%.1f"),
+               ("RH", "RH", "%.0f"),
+               ("G(h)", "ghi", "%.1f"),
+               ("Gb(n)", "dni", "%.1f"),
+               ("Gd(h)", "dhi", "%.1f"),
+               ("IR(h)", "IR(h)", "%.0f"),
+               ("WS10m", "wind", "%.2f"),
+               ("WD10m", "WD10m", "%.0f"),
+               ("SP", "SP", "%.0f")]
+
+TIME_COLUMN = "time(UTC)"
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def tmy_path(year, site=None, directory=None):
+    """
+    :param year: Year of the file
+    :param site: Optional dictionary of site parameters, see site_parameters.get_site_parameters()
+    :param directory: Output directory, config.tmy_directory by default
+    :return: Path of the TMY file of a site and year
+    """
+    site = site_parameters.get_site_parameters(site)
+    if directory is None:
+        directory = config.tmy_directory
+    return os.path.join(directory, "weatherPrediction_" + site["site_name"] + "_" + str(year) + ".csv")
+
+
+def to_tmy_frame(data):
+    """
+    Converts a pipeline dataframe to TMY columns. Missing RH, IR(h), WD10m and SP columns are filled with constant
+    values from config.py.
+    :param data: Dataframe with T, ghi, dni, dhi and wind columns and a DatetimeIndex, naive index values are UTC
+    :return: Dataframe with TMY column names indexed by naive UTC time
+    """
+    fill_values = {"RH": config.tmy_relative_humidity,
+                   "IR(h)": config.tmy_infrared_radiation,
+                   "WD10m": config.tmy_wind_direction,
+                   "SP": config.tmy_surface_pressure}
+
+    columns = {}
+    for tmy_name, name, _ in TMY_COLUMNS:
+        if name in data.columns:
+            columns[tmy_name] = data[name].to_numpy(dtype=numpy.float64)
+        else:
+            columns[tmy_name] = numpy.full(len(data), fill_values[name], dtype=numpy.float64)
+
+    times = time_conversions.from_utc_ns(time_conversions.to_utc_ns(data.index)).tz_localize(None)
+    return pandas.DataFrame(columns, index=pandas.DatetimeIndex(times, name=TIME_COLUMN))
+
+
+def format_rows(tmy_frame):
+    """
+    Formats all rows of a TMY dataframe at once.
+    :param tmy_frame: Dataframe from to_tmy_frame() or load_year()
+    :return: Array of row strings without line endings
+    """
+    rows = numpy.asarray(tmy_frame.index.strftime(TIME_FORMAT), dtype=str)
+    for tmy_name, _, number_format in TMY_COLUMNS:
+        values = numpy.char.mod(number_format, tmy_frame[tmy_name].to_numpy())
+        rows = numpy.char.add(numpy.char.add(rows, ","), values)
+    return rows
+
+
+def header_lines(year, site=None):
+    """
+    Header of a TMY file, site location, the months of the year and column names.
+    """
+    site = site_parameters.get_site_parameters(site)
+    lines = ["Latitude (decimal degrees): " + str(site["latitude"]),
+             "Longitude (decimal degrees): " + str(site["longitude"]),
+             "Elevation (m): " + str(site["elevation"]),
+             "month,year"]
+    lines += [str(month) + "." + str(year) for month in range(1, 13)]
+    lines.append(",".join([TIME_COLUMN] + [tmy_name for tmy_name, _, _ in TMY_COLUMNS]))
+    return lines
+
+
+def append_frame(data, site=None, directory=None):
+    """
+    Appends rows to the yearly TMY files, rows with timestamps already in a file are skipped.
+    :param data: Dataframe with T, ghi, dni, dhi and wind columns and a DatetimeIndex, naive index values are UTC
+    :param site: Optional dictionary of site parameters, see site_parameters.get_site_parameters()
+    :param directory: Output directory, config.tmy_directory by default
+    :return: Dictionary {path: number of appended rows}
+    """
+    tmy_frame = to_tmy_frame(data.dropna(subset=[name for name in INPUT_COLUMNS if name in data.columns]))
+    tmy_frame = tmy_frame[~tmy_frame.index.duplicated(keep="last")].sort_index()
+
+    years = (tmy_frame.index - pandas.Timedelta(1, "ns")).year.to_numpy()
+    appended = {}
+    for year in numpy.unique(years):
+        path = tmy_path(year, site, directory)
+        appended[path] = __append_year(path, tmy_frame[years == year], year, site)
+
+    # a year is complete when data of the next year arrives
+    for year in numpy.unique(years)[:-1]:
+        compact(year, site, directory)
+
+    return appended
+
+
+def load_year(year, site=None, directory=None):
+    """
+    Reads a TMY file. Malformed rows are skipped, the last appended row is kept for duplicates.
+    :return: Dataframe with TMY column names indexed by naive UTC time and sorted, empty if the file does not exist
+    """
+    path = tmy_path(year, site, directory)
+    if not os.path.exists(path):
+        return pandas.DataFrame(columns=[tmy_name for tmy_name, _, _ in TMY_COLUMNS],
+                                index=pandas.DatetimeIndex([], name=TIME_COLUMN))
+    return __latest_rows(path)
+
+
+def compact(year, site=None, directory=None, epw=None):
+    """
+    Rewrites a year file sorted by time with one row per timestamp, the last appended row is kept for duplicates.
+    :param epw: If True, an EnergyPlus weather file is written next to the csv. config.tmy_write_epw by default.
+    :return: Path to the compacted file, None if the file does not exist
+    """
+    path = tmy_path(year, site, directory)
+    if not os.path.exists(path):
+        return None
+    if epw is None:
+        epw = config.tmy_write_epw
+
+    tmy_frame = __latest_rows(path)
+    __write_atomic(path, header_lines(year, site) + list(format_rows(tmy_frame)))
+    if epw:
+        write_epw(tmy_frame, os.path.splitext(path)[0] + ".epw", site)
+
+    return path
+
+
+def write_epw(tmy_frame, path, site=None):
+    """
+    Writes TMY rows as an EnergyPlus weather file. Times are written in UTC, the file time zone is 0. Dew point is
+    computed from air temperature and relative humidity, fields without data are written as EPW missing values.
+    :param tmy_frame: Dataframe from to_tmy_frame() or load_year()
+    :param path: Output path
+    :return: path
+    """
+    site = site_parameters.get_site_parameters(site)
+
+    # epw hours 1-24 label the hour ending at that time, rows are timestamped with the interval end
+    starts = tmy_frame.index - pandas.Timedelta(hours=1)
+    temperature = tmy_frame["T2m"].to_numpy()
+    humidity = numpy.clip(tmy_frame["RH"].to_numpy(), 1, 100)
+
+    # Magnus formula
+    gamma = numpy.log(humidity / 100) + 17.62 * temperature / (243.12 + temperature)
+    dew_point = 243.12 * gamma / (17.62 - gamma)
+
+    n = len(tmy_frame)
+    fields = [(starts.year.to_numpy(), "%d"),
+              (starts.month.to_numpy(), "%d"),
+              (starts.day.to_numpy(), "%d"),
+              (starts.hour.to_numpy() + 1, "%d"),
+              (numpy.full(n, 60), "%d"),
+              (numpy.full(n, "*"), "%s"),
+              (temperature, "%.1f"),
+              (dew_point, "%.1f"),
+              (humidity, "%.0f"),
+              (tmy_frame["SP"].to_numpy(), "%.0f"),
+              (numpy.full(n, 9999), "%d"),
+              (numpy.full(n, 9999), "%d"),
+              (tmy_frame["IR(h)"].to_numpy(), "%.0f"),
+              (tmy_frame["G(h)"].to_numpy(), "%.0f"),
+              (tmy_frame["Gb(n)"].to_numpy(), "%.0f"),
+              (tmy_frame["Gd(h)"].to_numpy(), "%.0f"),
+              (numpy.full(n, 999999), "%d"),
+              (numpy.full(n, 999999), "%d"),
+              (numpy.full(n, 999999), "%d"),
+              (numpy.full(n, 9999), "%d"),
+              (tmy_frame["WD10m"].to_numpy(), "%.0f"),
+              (tmy_frame["WS10m"].to_numpy(), "%.1f"),
+              (numpy.full(n, "99,99,9999,99999,9,999999999,999,0.999,999,99,999,999,99"), "%s")]
+
+    rows = numpy.char.mod(fields[0][1], fields[0][0])
+    for values, number_format in fields[1:]:
+        rows = numpy.char.add(numpy.char.add(rows, ","), numpy.char.mod(number_format, values))
+
+    first = starts[0] if n else pandas.Timestamp(year=2000, month=1, day=1)
+    last = starts[-1] if n else first
+    lines = ["LOCATION," + site["site_name"] + ",-,-,FMI open forecast,-," + str(site["latitude"]) + ","
+             + str(site["longitude"]) + ",0.0," + str(site["elevation"]),
+             "DESIGN CONDITIONS,0",
+             "TYPICAL/EXTREME PERIODS,0",
+             "GROUND TEMPERATURES,0",
+             "HOLIDAYS/DAYLIGHT SAVINGS,No,0,0,0",
+             "COMMENTS 1,Forecast weather data in UTC",
+             "COMMENTS 2,RH IR(h) WD10m and SP are constant site values unless measured",
+             "DATA PERIODS,1,1,Data," + first.day_name() + "," + str(first.month) + "/" + str(first.day) + ","
+             + str(last.month) + "/" + str(last.day)]
+
+    __write_atomic(path, lines + list(rows))
+    return path
+
+
+def __append_year(path, tmy_frame, year, site):
+    """
+    Appends rows of one year which are not yet in the file or differ from the latest row of their timestamp.
+    :return: Number of appended rows
+    """
+    if not os.path.exists(path):
+        __write_atomic(path, header_lines(year, site) + list(format_rows(tmy_frame)))
+        return len(tmy_frame)
+
+    __remove_partial_line(path)
+    # rows are compared as formatted text, the same values always give the same line
+    existing = __latest_rows(path)
+    existing = pandas.Series(format_rows(existing), index=existing.index)
+    lines = format_rows(tmy_frame)
+    new_rows = tmy_frame[existing.reindex(tmy_frame.index).to_numpy() != lines]
+    if len(new_rows) == 0:
+        return 0
+
+    # one write call for all rows, a reader never sees rows of one append interleaved with another
+    text = ("\n".join(format_rows(new_rows)) + "\n").encode()
+    descriptor = os.open(path, os.O_WRONLY | os.O_APPEND)
+    try:
+        while text:
+            text = text[os.write(descriptor, text):]
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+    return len(new_rows)
+
+
+def __read_rows(path):
+    with open(path) as f:
+        text = f.read()
+
+    # data starts after the column name line
+    start = text.find(TIME_COLUMN + ",")
+    data = pandas.read_csv(io.StringIO(text[start:]), on_bad_lines="skip")
+    data[TIME_COLUMN] = pandas.to_datetime(data[TIME_COLUMN], format=TIME_FORMAT, errors="coerce")
+    data = data.dropna(subset=[TIME_COLUMN])
+
+    return data.set_index(TIME_COLUMN)[[tmy_name for tmy_name, _, _ in TMY_COLUMNS]].astype(numpy.float64)
+
+
+def __latest_rows(path):
+    """
+    Rows of a file sorted by time, the last appended row of each timestamp.
+    """
+    data = __read_rows(path)
+    return data[~data.index.duplicated(keep="last")].sort_index()
+
+
+def __remove_partial_line(path):
+    """
+    Truncates a file after its last line ending, removes a row left half written by an interrupted append.
+    """
+    with open(path, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size == 0:
+            return
+        f.seek(max(size - 4096, 0))
+        tail = f.read()
+        if tail.endswith(b"\n"):
+            return
+        f.truncate(max(size - 4096, 0) + tail.rfind(b"\n") + 1)
+
+
+def __write_atomic(path, lines):
+    """
+    Writes a file through a temporary file, readers see either the old or the new file.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temporary = path + ".tmp"
+    with open(temporary, "w") as f:
+        f.write("\n".join(lines) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
@@ -0,0 +1,110 @@
+"""
+Monte Carlo uncertainty of the power estimate caused by uncertain site parameters.
+
+Albedo, reflectance constant, module elevation, derate and the Huld et al. coefficients of output_estimator.py are
+drawn config.uncertainty_samples times from normal distributions with the standard deviations in
+config.uncertainty_deviations. Samples are (samples, 1) arrays and the projection, reflection, temperature and output
+models are evaluated for all samples and timestamps at once as a (samples, times) broadcast, see
+pipeline.process_arrays(). Solar geometry and the Perez diffuse projection do not depend on the sampled parameters and
+are computed only once.
+
+Confidence bands are quantiles over samples, config.uncertainty_quantiles by default:
+    power   Dataframe indexed like the irradiance dataframe with a time column and one column per quantile, W
+    energy  Dataframe indexed by local days with one column per quantile, kWh
+
+Example:
+irradiance = solar_irradiance_estimator.get_solar_irradiance(datetime.datetime(2024, 6, 1), 3, model="fmiopen")
+power, energy = uncertainty.confidence_bands(irradiance, seed=1)
+"""
+
+import numpy
+
+import config
+from helpers import astronomical_calculations
+from helpers import ensemble_forecast
+from helpers import output_estimator
+from helpers import pipeline
+from helpers import site_parameters
+
+SAMPLED_PARAMETERS = ["albedo", "reflectance_constant", "module_elevation", "derate", "huld_coefficients"]
+
+
+def draw_samples(count=None, site=None, deviations=None, seed=None):
+    """
+    Draws site parameter samples around the site values.
+    :param count: Number of samples, config.uncertainty_samples by default
+    :param site: Optional dictionary of site parameters, see site_parameters.get_site_parameters()
+    :param deviations: Dictionary of standard deviations with keys from SAMPLED_PARAMETERS,
+    config.uncertainty_deviations by default. Missing keys are not sampled.
+    :param seed: Optional random seed for repeatable samples
+    :return: Dictionary with albedo_offset, reflectance_constant, module_elevation and derate arrays of shape
+    (count, 1) and coefficients, a tuple of six (count, 1) arrays
+    """
+    if count is None:
+        count = config.uncertainty_samples
+    if deviations is None:
+        deviations = config.uncertainty_deviations
+    site = site_parameters.get_site_parameters(site)
+    generator = numpy.random.default_rng(seed)
+
+    def normal(key, size=1):
+        return generator.normal(0.0, deviations.get(key, 0.0), (count, size))
+
+    # albedo is an offset, fmi open data has an albedo of its own for each timestamp
+    return {"albedo_offset": normal("albedo"),
+            "reflectance_constant": numpy.maximum(site["reflectance_constant"] + normal("reflectance_constant"), 0.01),
+            "module_elevation": numpy.maximum(site["module_elevation"] + normal("module_elevation"), 0.1),
+            "derate": numpy.maximum(site["derate"] * (1 + normal("derate")), 0.0),
+            "coefficients": tuple((numpy.array(output_estimator.HULD_COEFFICIENTS)
+                                   * (1 + normal("huld_coefficients", 6))).T[:, :, None])}
+
+
+def sample_output(irradiance_df, site=None, samples=None, geometry=None):
+    """
+    Power output of every parameter sample.
+    :param irradiance_df: Dataframe with time, ghi, dni and dhi columns, optionally albedo, T and wind
+    :param site: Optional dictionary of site parameters
+    :param samples: Dictionary from draw_samples(), drawn with default arguments if not given
+    :param geometry: Optional precomputed solar geometry for the time column
+    :return: Power output array of shape (samples, times) in W
+    """
+    site = site_parameters.get_site_parameters(site)
+    if samples is None:
+        samples = draw_samples(site=site)
+    if geometry is None:
+        geometry = astronomical_calculations.get_solar_geometry(irradiance_df["time"], site["latitude"],
+                                                                site["longitude"])
+
+    albedo = irradiance_df["albedo"].to_numpy() if "albedo" in irradiance_df.columns else site["albedo"]
+    albedo = numpy.clip(numpy.nan_to_num(albedo, nan=site["albedo"]) + samples["albedo_offset"], 0.0, 1.0)
+
+    sampled_site = dict(site, reflectance_constant=samples["reflectance_constant"],
+                        module_elevation=samples["module_elevation"], derate=samples["derate"])
+
+    return pipeline.process_arrays(irradiance_df["dni"].to_numpy(dtype=float),
+                                   irradiance_df["dhi"].to_numpy(dtype=float),
+                                   irradiance_df["ghi"].to_numpy(dtype=float), geometry, sampled_site, albedo=albedo,
+                                   air_temperature=__column(irradiance_df, "T"),
+                                   wind=__column(irradiance_df, "wind"),
+                                   coefficients=samples["coefficients"])
+
+
+def confidence_bands(irradiance_df, site=None, count=None, quantiles=None, seed=None):
+    """
+    Draws parameter samples and returns power and daily energy quantiles over them.
+    :param irradiance_df: Dataframe with time, ghi, dni and dhi columns, optionally albedo, T and wind
+    :param count: Number of samples, config.uncertainty_samples by default
+    :param quantiles: List of quantiles in range [0, 1], config.uncertainty_quantiles by default
+    :return: Tuple (power dataframe, energy dataframe)
+    """
+    if quantiles is None:
+        quantiles = config.uncertainty_quantiles
+    site = site_parameters.get_site_parameters(site)
+
+    output = sample_output(irradiance_df, site, draw_samples(count, site, seed=seed))
+    return (ensemble_forecast.power_quantiles(irradiance_df.index, irradiance_df["time"].to_numpy(), output, quantiles),
+            ensemble_forecast.daily_energy_quantiles(irradiance_df["time"], output, quantiles))
+
+
+def __column(df, column):
+    return df[column].to_numpy(dtype=float) if column in df.columns else None
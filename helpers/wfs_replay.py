@@ -0,0 +1,177 @@
+"""
+Offline replay of fmi open data.
+
+Raw WFS responses fetched by solar_irradiance_estimator are recorded to
+    <config.replay_directory>/<site name>/start=<request start>.xml
+when config.record_wfs_responses is True. Replaying parses the recorded responses with the same
+_meps_data_loader.parse_fmi_opendata_xml() function as live data, so the rest of the pipeline sees identical frames.
+
+If no recorded response covers the requested period, frames of kind "fmi" from the forecast archive are used instead.
+
+Replay does not require network access and runs at full speed, which makes it suitable for deterministic benchmarks
+and regression runs of the fmi open data path.
+"""
+
+import bisect
+import datetime
+import os
+
+import pandas
+
+import config
+from helpers import _meps_data_loader, forecast_archive
+
+REQUEST_START_FORMAT = "%Y%m%dT%H%MZ"
+
+
+def record_response(xml, request_start, site=None, directory=None):
+    """
+    Saves a raw WFS response to disk. Responses are named by the request start time, a later response for the same
+    request start replaces the older one.
+    :param xml: Response xml as bytes
+    :param request_start: Datetime, start time of the request
+    :param site: Site name, config.site_name by default
+    :param directory: Replay directory, config.replay_directory by default
+    :return: Path to the recorded file
+    """
+    site_directory = __site_directory(site, directory)
+    os.makedirs(site_directory, exist_ok=True)
+
+    path = os.path.join(site_directory, "start=" + request_start.strftime(REQUEST_START_FORMAT) + ".xml")
+
+    # writing to a temporary file first, a replay running in parallel never reads a partial response
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as f:
+        f.write(xml)
+    os.replace(temporary, path)
+
+    return path
+
+
+def list_recorded_responses(site=None, directory=None):
+    """
+    Lists recorded responses for a site.
+    :return: Sorted list of (request start datetime, path) tuples
+    """
+    site_directory = __site_directory(site, directory)
+    if not os.path.isdir(site_directory):
+        return []
+
+    responses = []
+    for name in os.listdir(site_directory):
+        if not name.startswith("start=") or not name.endswith(".xml"):
+            continue
+        request_start = datetime.datetime.strptime(name[len("start="):-len(".xml")], REQUEST_START_FORMAT)
+        responses.append((request_start, os.path.join(site_directory, name)))
+
+    return sorted(responses)
+
+
+def load_replay_frame(date_start, date_end, site=None, directory=None, latitude=None, longitude=None):
+    """
+    Returns a frame in the same format as _meps_data_loader.collect_fmi_opendata() for the given period. Uses the latest
+    recorded response which was requested at or before date_start, falls back to the forecast archive.
+    :param date_start: Datetime, first hour of the period
+    :param date_end: Datetime, end of the period
+    :param site: Site name, config.site_name by default
+    :param directory: Replay directory, config.replay_directory by default
+    :param latitude: Site latitude for solar angles, config.latitude by default
+    :param longitude: Site longitude for solar angles, config.longitude by default
+    :return: Dataframe, None if no recorded data covers the period
+    """
+
+    candidates = [path for request_start, path in list_recorded_responses(site, directory)
+                  if request_start <= date_start]
+
+    if candidates:
+        with open(candidates[-1], "rb") as f:
+            xml = f.read()
+        data = _meps_data_loader.parse_fmi_opendata_xml(xml, latitude, longitude)
+
+        # responses can cover multiple days, restricting to the requested period. Index holds interval end times.
+        data = data[(data.index >= date_start) & (data.index <= date_end)]
+        if len(data) > 0:
+            return data
+
+    return __load_archived_frame(date_start, date_end, site)
+
+
+def load_replay_days(days, site=None, directory=None, latitude=None, longitude=None):
+    """
+    Same as calling load_replay_frame() for each day, but the replay directory is listed once and each recorded
+    response is parsed only once even if it covers several of the given days. Used by backtests.
+    :param days: List of datetimes, each one is the start of a day
+    :return: List of dataframes in the order of days, None for days without recorded data
+    """
+    responses = list_recorded_responses(site, directory)
+    request_starts = [request_start for request_start, path in responses]
+    parsed = {}
+
+    frames = []
+    for day in days:
+        day_end = day + datetime.timedelta(days=1, minutes=-1)
+        data = None
+
+        # latest response requested at or before the start of the day
+        position = bisect.bisect_right(request_starts, day) - 1
+        if position >= 0:
+            path = responses[position][1]
+            if path not in parsed:
+                with open(path, "rb") as f:
+                    parsed[path] = _meps_data_loader.parse_fmi_opendata_xml(f.read(), latitude, longitude)
+            data = parsed[path]
+            data = data[(data.index >= day) & (data.index <= day_end)]
+
+        if data is None or len(data) == 0:
+            data = __load_archived_frame(day, day_end, site)
+        frames.append(data)
+
+    return frames
+
+
+def replay_days(date_start, date_end, day_count=1, site=None, directory=None):
+    """
+    Generator which replays a date range one simulation start date at a time without network access.
+    Example:
+    for date, data in wfs_replay.replay_days(datetime.datetime(2024, 7, 1), datetime.datetime(2024, 7, 31)):
+        ...
+    :param date_start: First date to replay
+    :param date_end: Last date to replay
+    :param day_count: Day count for each replayed frame, same as in solar_irradiance_estimator.get_solar_irradiance()
+    :return: (date, dataframe) tuples, days without recorded data are skipped
+    """
+    date = datetime.datetime(date_start.year, date_start.month, date_start.day)
+    while date <= date_end:
+        data = load_replay_frame(date, date + datetime.timedelta(days=day_count, minutes=-1), site, directory)
+        if data is not None:
+            yield date, data
+        date = date + datetime.timedelta(days=1)
+
+
+def __load_archived_frame(date_start, date_end, site):
+    """
+    Reads archived fmi frames covering the period and restores the collect_fmi_opendata() frame format.
+    """
+
+    # archived time column holds interval centers, selecting the same hours as the recorded response path does
+    data = forecast_archive.read_archive("fmi", site=site,
+                                         start=date_start + datetime.timedelta(minutes=-30),
+                                         end=date_end + datetime.timedelta(minutes=-30),
+                                         run_end=date_end, latest_only=True)
+    if len(data) == 0:
+        return None
+
+    data = data.drop("run_time", axis=1)
+    # interval end times as naive index, same as in _meps_data_loader
+    data.index = pandas.DatetimeIndex(data["time"] + datetime.timedelta(minutes=30)).tz_localize(None)
+    data.index.name = "Time"
+
+    return data
+
+
+def __site_directory(site, directory):
+    if directory is None:
+        directory = config.replay_directory
+    if site is None:
+        site = config.site_name
+    return os.path.join(directory, str(site))
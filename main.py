@@ -2,12 +2,14 @@ import os
 import pandas as pd
 import datetime
 import config      # HuHu Modification
-import helpers.geometric_projections
-from helpers import solar_irradiance_estimator, astronomical_calculations
-from helpers import reflection_estimator
+import plotter
+from helpers import solar_irradiance_estimator
 from helpers import panel_temperature_estimator
-from helpers import output_estimator
-from apscheduler.schedulers.blocking import BlockingScheduler
+from helpers import forecast_archive
+from helpers import data_resampler
+from helpers import pipeline
+from helpers import site_parameters
+import scheduler
 
 
 """
@@ -66,20 +68,9 @@ def full_processing_of_fmi_open_data():
     # step 1. simulate irradiance components dni, dhi, ghi:
     data = solar_irradiance_estimator.get_solar_irradiance(date_start, day_count=3, model="fmiopen")
 
-    # step 2. project irradiance components to plane of array:
-    data = helpers.geometric_projections.irradiance_df_to_poa_df(data)
-
-    # step 3. simulate how much of irradiance components is absorbed:
-    data = helpers.reflection_estimator.add_reflection_corrected_poa_components_to_df(data)
-
-    # step 4. compute sum of reflection-corrected components:
-    data = helpers.reflection_estimator.add_reflection_corrected_poa_to_df(data)
-
-    # step 5. estimate panel temperature based on wind speed, air temperature and absorbed radiation
-    data = helpers.panel_temperature_estimator.add_estimated_panel_temperature(data)
-
-    # step 6. estimate power output
-    data = helpers.output_estimator.add_output_to_df(data)
+    # steps 2-6. plane of array projection with shading, reflection losses, panel temperature and power output with
+    # the site parameters of config.py, see helpers/pipeline.py
+    data = pipeline.process_irradiance(data, site_parameters.get_site_parameters())
 
     # printing and plotting data
     print_full(data)
@@ -103,23 +94,9 @@ def full_processing_of_pvlib_data():
     # step 1. simulate irradiance components dni, dhi, ghi:
     data = solar_irradiance_estimator.get_solar_irradiance(date_start, day_count=3, model="pvlib")
 
-    # step 2. project irradiance components to plane of array:
-    data = helpers.geometric_projections.irradiance_df_to_poa_df(data)
-
-    # step 3. simulate how much of irradiance components is absorbed:
-    data = helpers.reflection_estimator.add_reflection_corrected_poa_components_to_df(data)
-
-    # step 4. compute sum of reflection-corrected components:
-    data = helpers.reflection_estimator.add_reflection_corrected_poa_to_df(data)
-
-    # step 4.1. add dummy wind and air temp data
-    data = helpers.panel_temperature_estimator.add_dummy_wind_and_temp(data, config.wind_speed, config.air_temp)
-
-    # step 5. estimate panel temperature based on wind speed, air temperature and absorbed radiation
-    data = helpers.panel_temperature_estimator.add_estimated_panel_temperature(data)
-
-    # step 6. estimate power output
-    data = helpers.output_estimator.add_output_to_df(data)
+    # steps 2-6. plane of array projection with shading, reflection losses, panel temperature and power output with
+    # the site parameters of config.py, dummy wind and air temperature are added, see helpers/pipeline.py
+    data = pipeline.process_irradiance(data, site_parameters.get_site_parameters())
 
     # printing and plotting data
     print_full(data)
@@ -133,43 +110,37 @@ def full_processing_of_pvlib_data():
     plotter.show_legend()
     plotter.show_plot()
 
-def get_fmi_data(day_range):
+def get_fmi_data(day_range, date_start=None, model="fmiopen", resolution=None):
     """
     This function shows the steps used for generating power output data with fmi open. Also returns the power output.
     Note that FMI open only gives irradiance estimates for the next ~64 hours.
     :param day_range: Day count, 1 returns only this day, 3 returns this day and the 2 following days.
+    :param date_start: Optional, first day of simulation. Today by default.
+    :param model: "fmiopen" for live data, "replay" for recorded data without network access
+    :param resolution: Optional, minutes between timestamps. Fmi open data is hourly by default, if resolution is given
+    the data is resampled to that resolution before processing. config.data_resolution is not modified.
     :return: Power output dataframe
     """
 
-    # using a temporary override of data resolution as fmi open operates on 60 minute data sections.
-    # saving original data resolution
-    original_data_resolution = config.data_resolution
-    # setting temporary value for fmi data processing(this is restored back to original value later)
-    config.data_resolution = 60
-
     # date for simulation:
-    today = datetime.date.today()
-    date_start = datetime.datetime(today.year, today.month, today.day)
+    if date_start is None:
+        today = datetime.date.today()
+        date_start = datetime.datetime(today.year, today.month, today.day)
 
     # step 1. simulate irradiance components dni, dhi, ghi:
-    data = solar_irradiance_estimator.get_solar_irradiance(date_start, day_count=day_range, model="fmiopen")
-
-    # step 2. project irradiance components to plane of array:
-    data = helpers.geometric_projections.irradiance_df_to_poa_df(data)
+    data = solar_irradiance_estimator.get_solar_irradiance(date_start, day_count=day_range, model=model)
 
-    # step 3. simulate how much of irradiance components is absorbed:
-    data = helpers.reflection_estimator.add_reflection_corrected_poa_components_to_df(data)
+    # step 1.1. resampling hourly fmi data to requested resolution
+    if resolution is not None and resolution != 60:
+        data = data_resampler.resample_fmi_frame(data, resolution)
 
-    # step 4. compute sum of reflection-corrected components:
-    data = helpers.reflection_estimator.add_reflection_corrected_poa_to_df(data)
+    # steps 2-6. plane of array projection with shading, reflection losses, panel temperature and power output with
+    # the site parameters of config.py, see helpers/pipeline.py
+    data = pipeline.process_irradiance(data, site_parameters.get_site_parameters())
 
-    # step 5. estimate panel temperature based on wind speed, air temperature and absorbed radiation
-    data = helpers.panel_temperature_estimator.add_estimated_panel_temperature(data)
-
-    # step 6. estimate power output
-    data = helpers.output_estimator.add_output_to_df(data)
-
-    config.data_resolution = original_data_resolution
+    # storing pipeline result to the forecast archive, replayed runs are already archived
+    if config.archive_forecasts and model not in ("replay", "fmiopen_replay"):
+        forecast_archive.archive_frame(data, "fmi_output")
 
     return data
 
@@ -187,31 +158,20 @@ def get_pvlib_data(day_range, data_fmi=None):
 
     data_pvlib = solar_irradiance_estimator.get_solar_irradiance(date_start, day_count=day_range, model="pvlib")
 
-    # step 2. project irradiance components to plane of array:
-    data_pvlib = helpers.geometric_projections.irradiance_df_to_poa_df(data_pvlib)
-
-    # step 3. simulate how much of irradiance components is absorbed:
-    data_pvlib = helpers.reflection_estimator.add_reflection_corrected_poa_components_to_df(data_pvlib)
-
-    # step 4. compute sum of reflection-corrected components:
-    data_pvlib = helpers.reflection_estimator.add_reflection_corrected_poa_to_df(data_pvlib)
-
-    # step 4.1. adding wind and air speed to dataframe
+    # step 1.1. adding wind and air temperature from the fmi dataframe if one was given, dummy values are used otherwise
     if data_fmi is not None:
-        # getting data from fmi dataframe if one was given
         data_pvlib = panel_temperature_estimator.add_wind_and_temp_to_df1_from_df2(data_pvlib, data_fmi)
-    else:
-        # using dummy values if no df was given
-        data_pvlib = helpers.panel_temperature_estimator.add_dummy_wind_and_temp(data_pvlib, config.wind_speed, config.air_temp)
-
-    # step 5. estimate panel temperature based on wind speed, air temperature and absorbed radiation
-    data_pvlib = helpers.panel_temperature_estimator.add_estimated_panel_temperature(data_pvlib)
 
-    # step 6. estimate power output
-    data_pvlib = helpers.output_estimator.add_output_to_df(data_pvlib)
+    # steps 2-6. plane of array projection with shading, reflection losses, panel temperature and power output with
+    # the site parameters of config.py, see helpers/pipeline.py
+    data_pvlib = pipeline.process_irradiance(data_pvlib, site_parameters.get_site_parameters())
 
     data_pvlib = data_pvlib.dropna()
 
+    # storing pipeline result to the forecast archive
+    if config.archive_forecasts:
+        forecast_archive.archive_frame(data_pvlib, "pvlib_output")
+
     return data_pvlib
 
 # HuHu added days as input
@@ -244,99 +204,17 @@ def __process_irradiance_data(meps_data):
     If input does not contain T and wind values, dummies will be added
     """
 
-    # step 2. project irradiance components to plane of array:
-    data = helpers.geometric_projections.irradiance_df_to_poa_df(meps_data)
-
-    # step 3. simulate how much of irradiance components is absorbed:
-    data = helpers.reflection_estimator.add_reflection_corrected_poa_components_to_df(data)
-
-    # step 4. compute sum of reflection-corrected components:
-    data = helpers.reflection_estimator.add_reflection_corrected_poa_to_df(data)
-
-    # step 4.1. add dummy wind and air temp data
-    if "T" not in meps_data.columns or "wind" not in meps_data.columns:
-        data = helpers.panel_temperature_estimator.add_dummy_wind_and_temp(data, config.wind_speed, config.air_temp)
-
-    # step 5. estimate panel temperature based on wind speed, air temperature and absorbed radiation
-    data = helpers.panel_temperature_estimator.add_estimated_panel_temperature(data)
-
-    # step 6. estimate power output
-    data = helpers.output_estimator.add_output_to_df(data)
+    # steps 2-6, dummy wind and air temperature are added when missing, see helpers/pipeline.py
+    data = pipeline.process_irradiance(meps_data, site_parameters.get_site_parameters())
 
     return data
 
 
 #### Hugo Huerta last review 28.12.2024
 
-# Prepare a TMY (format) file
-# Configure the config file to run the following lines
-headers = [f'Latitude (decimal degrees): {config.latitude}',
-           f'Longitude (decimal degrees): {config.longitude}',
-           f'Elevation (m): {config.elevation}',
-            'month,year',
-            '1.2024',
-            '2.2024',
-            '3.2024',
-            '4.2024',
-            '5.2024',
-            '6.2024',
-            '7.2024',
-            '8.2024',
-            '9.2024',
-            '10.2024',
-            '11.2024',
-            '12.2024',
-            'time(UTC),T2m,RH,G(h),Gb(n),Gd(h),IR(h),WS10m,WD10m,SP'
-            ]
-
-# File path where the CSV will be saved
-fileName = '/Documents/solcast/FMI_linux/output/weatherPrediction_' + config.site_name + '_2024.csv'
-#fileName = '/output/weatherPrediction_' + config.site_name + '_2024.csv'
-path = os.getcwd()
-file_path = path + fileName
-
-
-if not os.path.exists(file_path):
-# Create a file with empty lines (17 empty lines)
-    with open(file_path, 'w') as f:
-        # Write the details
-        for element in headers:
-            f.write(element + '\n')
-
-
-# Define the function to be run at 11 PM
-def scheduled_task():
-    """
-
-    Collect the meteodata with FMI API.
-
-    """
-    df = combined_processing_of_data(days=2)
-    df.drop(['time', 'dir_hi', 'albedo',   
-           'cloud_cover', 'dni_poa', 'dhi_poa', 'ghi_poa', 'poa', 'dni_rc',
-           'dhi_rc', 'ghi_rc', 'poa_ref_cor', 'module_temp', 'output'], axis=1)
-
-    " Add missing columns with average values from the site"
-    df['RH']= 80
-    df['IR(h)']= 296
-    df['WD10m']= 202
-    df['SP']= 101193
-
-    # Rearrange accoriding to TMY format
-    #TMY = df[['timeUTC','T','RH','ghi','dni','dhi','IR(h)','wind','WD10m','SP']]
-    TMY = df[['T','RH','ghi','dni','dhi','IR(h)','wind','WD10m','SP']].iloc[-24:]
-    # Append the DataFrame content to the created file
-    TMY.to_csv(file_path, mode='a', header=None)
-
-    print(f"Task is running at {datetime.datetime.now()}")
-
-# Create an instance of the scheduler
-scheduler = BlockingScheduler()
-
-# Schedule the task to run every day at 11:00 PM
-scheduler.add_job(scheduled_task, 'cron', hour = 23, minute = 30)
+# TMY files are written by helpers/tmy_writer.py to config.tmy_directory, one file per year
 
-# Start the scheduler
+# Start the scheduler, runs scheduler.export_tmy_day() daily for the sites in config.scheduler_sites and catches up
+# missed days, see scheduler.py
 if __name__ == "__main__":
-    print("Scheduler is starting...")
     scheduler.start()
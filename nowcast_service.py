@@ -0,0 +1,229 @@
+"""
+Nowcasting service, corrects the latest forecasts of each site with live inverter power readings.
+
+Readings are received as text lines
+    <site name>,<time>,<power W>
+where time is either ISO format (naive values are UTC) or unix seconds, for example
+    helsinki,2024-06-01T10:15:00Z,15230.5
+Lines can be sent to a TCP port, config.nowcast_port, by any number of clients or appended to a file which the service
+follows like tail -f. Readings are kept in per site ring buffers, see helpers/nowcast.py.
+
+Every config.nowcast_interval seconds the latest archived forecast of each site (config.nowcast_forecast_kind, see
+helpers/forecast_archive.py, published by scheduler.py) is corrected with the readings of the last
+config.nowcast_window_minutes minutes and written to <config.nowcast_directory>/<site name>.npz with arrays
+    times   int64 nanoseconds since epoch in UTC
+    power   corrected forecast power in W
+    ratio   applied ratio of measured to forecast power
+
+Example:
+python nowcast_service.py --sites helsinki kuopio
+python nowcast_service.py --tail /var/log/inverters.csv
+printf "helsinki,$(date +%s),15230\\n" | nc 127.0.0.1 8081
+"""
+
+import argparse
+import asyncio
+import collections
+import os
+import time
+
+import numpy
+import pandas
+
+import config
+import forecast_server
+from helpers import nowcast
+from helpers import site_parameters
+from helpers import time_conversions
+
+
+def parse_readings(lines):
+    """
+    Parses reading lines and groups them by site.
+    :param lines: List of "<site name>,<time>,<power W>" strings
+    :return: Dictionary {site name: (int64 nanosecond times, float power)}
+    """
+    texts = collections.defaultdict(lambda: ([], []))
+    for line in lines:
+        fields = line.strip().split(",")
+        if len(fields) != 3:
+            if line.strip():
+                print("Error: malformed reading \"" + line.strip() + "\"")
+            continue
+        texts[fields[0]][0].append(fields[1])
+        texts[fields[0]][1].append(fields[2])
+
+    readings = {}
+    for site, (time_texts, power_texts) in texts.items():
+        # unix seconds and ISO times can be mixed, invalid values become nan or NaT and are dropped
+        seconds = pandas.to_numeric(pandas.Series(time_texts), errors="coerce").to_numpy(dtype=numpy.float64)
+        iso_times = pandas.to_datetime(pandas.Series(time_texts).where(numpy.isnan(seconds)), utc=True,
+                                       format="ISO8601", errors="coerce")
+        power = pandas.to_numeric(pandas.Series(power_texts), errors="coerce").to_numpy(dtype=numpy.float64)
+
+        valid = (~numpy.isnan(seconds) | iso_times.notna().to_numpy()) & ~numpy.isnan(power)
+        if not valid.all():
+            print("Error: " + str(int((~valid).sum())) + " invalid readings of site \"" + site + "\" dropped")
+
+        times = numpy.where(numpy.isnan(seconds), 0, seconds * 1e9).astype(numpy.int64)
+        iso_valid = iso_times.notna().to_numpy()
+        times[iso_valid] = time_conversions.to_utc_ns(pandas.DatetimeIndex(iso_times[iso_valid]))
+        readings[site] = (times[valid], power[valid])
+    return readings
+
+
+def write_nowcast(site, result, directory=None):
+    """
+    Writes a corrected forecast through a temporary file, readers never see a partly written file.
+    :return: Path to the written file
+    """
+    if directory is None:
+        directory = config.nowcast_directory
+    os.makedirs(directory, exist_ok=True)
+
+    path = os.path.join(directory, site + ".npz")
+    temporary = path + "." + str(os.getpid()) + ".tmp.npz"
+    numpy.savez(temporary, times=result["times"], power=result["power"], ratio=numpy.float64(result["ratio"]))
+    os.replace(temporary, path)
+    return path
+
+
+def update_sites(nowcaster, cache, rated_powers, now=None, missing=None):
+    """
+    Corrects and writes the forecast of every site which has a forecast in the cache. Sites without a forecast are
+    reported.
+    :param nowcaster: nowcast.Nowcaster with the readings
+    :param cache: forecast_server.ForecastCache with config.nowcast_forecast_kind forecasts
+    :param rated_powers: Dictionary {site name: rated power in kW}
+    :param now: Nanoseconds since epoch, current time by default
+    :param missing: Optional set of sites already reported without a forecast, each site is then reported only once
+    until its forecast appears
+    :return: Dictionary {site name: result from Nowcaster.update()}
+    """
+    if now is None:
+        now = time.time_ns()
+
+    results = {}
+    for site in cache.sites:
+        for kind in cache.kinds:
+            entry = cache.entries.get((site, kind))
+            if entry is None:
+                if missing is None or site not in missing:
+                    print("No " + kind + " forecast archived for site \"" + site + "\", forecasts are published by "
+                          + "scheduler.py")
+                if missing is not None:
+                    missing.add(site)
+                continue
+            if missing is not None:
+                missing.discard(site)
+            results[site] = nowcaster.update(site, entry["times"], entry["power"], now, rated_powers.get(site))
+            write_nowcast(site, results[site])
+    return results
+
+
+async def serve(sites, port=None, tail=None, interval=None):
+    """
+    Receives readings and updates the forecasts every interval seconds until cancelled.
+    """
+    if port is None:
+        port = config.nowcast_port
+    if interval is None:
+        interval = config.nowcast_interval
+
+    cache = forecast_server.ForecastCache(sites, kinds=[config.nowcast_forecast_kind])
+    rated_powers = {}
+    for name in sites:
+        site = site_parameters.get_site(name)
+        if site is not None:
+            rated_powers[name] = site["rated_power"]
+
+    nowcaster = nowcast.Nowcaster()
+    missing = set()
+    pending = []
+    tasks = []
+
+    server = None
+    if port:
+        server = await asyncio.start_server(lambda reader, writer: __receive(reader, writer, pending),
+                                            config.server_host, port)
+        print("Receiving readings on " + config.server_host + ":" + str(port))
+    if tail is not None:
+        tasks.append(asyncio.create_task(__follow(tail, pending)))
+        print("Following readings in " + tail)
+
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            # blocking archive reads are made outside the event loop, readings keep arriving meanwhile
+            for site, kind in await loop.run_in_executor(None, cache.refresh):
+                print("Loaded new " + kind + " run of site " + site)
+
+            lines = pending[:]
+            del pending[:len(lines)]
+
+            started = time.perf_counter()
+            for site, (times, power) in parse_readings(lines).items():
+                nowcaster.ingest(site, times, power)
+            results = update_sites(nowcaster, cache, rated_powers, missing=missing)
+            elapsed = (time.perf_counter() - started) * 1000
+
+            print("Corrected " + str(len(results)) + " sites with " + str(len(lines)) + " new readings in "
+                  + "{:.1f}".format(elapsed) + " ms")
+            await asyncio.sleep(interval)
+    finally:
+        for task in tasks:
+            task.cancel()
+        if server is not None:
+            server.close()
+
+
+async def __receive(reader, writer, pending):
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            pending.append(line.decode("utf-8", errors="replace"))
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def __follow(path, pending):
+    """
+    Appends lines written to the end of a file, like tail -f. Incomplete last lines wait for their line break.
+    """
+    while not os.path.exists(path):
+        await asyncio.sleep(1)
+
+    with open(path, "r") as f:
+        f.seek(0, os.SEEK_END)
+        partial = ""
+        while True:
+            text = f.read()
+            if not text:
+                await asyncio.sleep(1)
+                continue
+            lines = (partial + text).split("\n")
+            partial = lines.pop()
+            pending.extend(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Correct the latest forecasts with live inverter power readings.")
+    parser.add_argument("--sites", nargs="+", default=None, help="site names, config.scheduler_sites by default")
+    parser.add_argument("--port", type=int, default=config.nowcast_port, help="TCP port for readings, 0 disables")
+    parser.add_argument("--tail", default=None, help="file to follow for readings")
+    parser.add_argument("--interval", type=float, default=config.nowcast_interval, help="seconds between updates")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(config.scheduler_sites if args.sites is None else args.sites, args.port, args.tail,
+                          args.interval))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,18 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
 import matplotlib.pyplot
 import matplotlib.dates
+import matplotlib.figure
+import numpy
 import pandas
 from matplotlib import dates
 import datetime
 from datetime import datetime
 from matplotlib.dates import DateFormatter
 import config
+from helpers import downsampling
+from helpers import energy_aggregation
 
 import pytz
 
@@ -15,6 +22,10 @@ global fig
 global ax
 import locale
 
+# plots are saved as files instead of shown in a window, see show_plot()
+if config.headless_plotting:
+    matplotlib.pyplot.switch_backend("Agg")
+
 
 # INIT PLOT #################################################
 def init_plot():
@@ -31,8 +42,32 @@ def ticks():
     ax.tick_params()
 
 
-def show_plot():
-    matplotlib.pyplot.show()
+def show_plot(savepath=None):
+    """
+    Shows the plot in a window. In headless mode, or if savepath is given, the plot is saved as a .png file instead and
+    the call does not block.
+    :param savepath: Optional output path, <config.save_directory><site name>-<date and time>.png in headless mode
+    """
+    if savepath is None and not is_headless():
+        matplotlib.pyplot.show()
+        return
+
+    if savepath is None:
+        savepath = config.save_directory + config.site_name + "-" + datetime.utcnow().strftime("%Y-%m-%d %H:%M") + ".png"
+    fig.savefig(savepath)
+    matplotlib.pyplot.close(fig)
+    print("Plot saved as '" + savepath + "'")
+
+
+def use_headless_backend():
+    """
+    Switches to the non-interactive Agg backend, plots can be rendered without a display.
+    """
+    matplotlib.pyplot.switch_backend("Agg")
+
+
+def is_headless():
+    return config.headless_plotting or matplotlib.get_backend().lower() == "agg"
 
 
 # PLOT TITLES, LEGENDS, LABELS ETC ########################
@@ -75,10 +110,32 @@ def format_time_axis():
     xax.set_minor_formatter(dates.DateFormatter('%H'))
 
 
+def format_long_time_axis():
+    """
+    Time axis for months or years of data, day ticks of format_time_axis() would not fit.
+    """
+    global ax
+
+    xax = ax.get_xaxis()
+    locator = dates.AutoDateLocator()
+    xax.set_major_locator(locator)
+    xax.set_major_formatter(dates.ConciseDateFormatter(locator))
+    xax.set_minor_locator(matplotlib.ticker.NullLocator())
+
+
 # PLOTTING FUNCTIONS #######################################
 
 
-def plot_curve(x, y, label=None, color=None, alpha=1, width=1):
+def plot_curve(x, y, label=None, color=None, alpha=1, width=1, max_points=None, method="minmax"):
+    """
+    Plots a curve, curves longer than max_points are downsampled first, see helpers/downsampling.py
+    :param max_points: Maximum number of plotted points, config.plot_max_points by default
+    :param method: Downsampling method, "minmax" or "lttb"
+    """
+    if max_points is None:
+        max_points = config.plot_max_points
+    x, y = downsampling.downsample(x, y, max_points, method)
+
     if color is not None:
         ax.plot(x, y, label=label, color=color, alpha=alpha, linewidth=width)
     else:
@@ -100,19 +157,11 @@ def set_size(x, y):
 
 
 def plot_kwh_labels(df, y_offset=0):
-    df2 = df[["time", "output"]].copy()
-
-    df2["date"] = pandas.to_datetime(df2["time"]).dt.date
-
-    # df2 = df2.groupby(["date"])["output"]
-    df2 = df2.drop("time", axis=1)
-    df2 = df2.groupby(["date"]).sum()
+    days, energy = energy_aggregation.daily_energy(df["time"], df["output"])
 
-    df2["output_kwh"] = df2["output"] / 1000 * (60 / config.data_resolution)
-
-    for index, row in df2.iterrows():
-        x_value = datetime(index.year, index.month, index.day, 8)
-        output = round(row["output_kwh"], -1)
+    for day, output_kwh in zip(days, energy):
+        x_value = datetime(day.year, day.month, day.day, 8)
+        output = round(output_kwh, -1)
         text = str(output) + " kWh"
         matplotlib.pyplot.text(x_value, y_offset, text)
 
@@ -130,142 +179,238 @@ def plot_fmi_pvlib_mono(data_fmi, data_pvlib):
     :param data_pvlib:
     :return:
     """
+    template = FigureTemplate()
+    savepath = render_fmi_pvlib_mono(template, data_fmi, data_pvlib)
+    print("Simulation plot saved as '" + savepath + "'")
+    template.close()
+
+
+# HEADLESS RENDERING ##########################################
+
+
+class FigureTemplate:
+    """
+    Reusable figure for plot_fmi_pvlib_mono() style plots. Figure, axes, formatting, lines, bars and texts are created
+    once, render_fmi_pvlib_mono() only updates their data. Figures are created without pyplot, they are not registered
+    to any global figure manager and rendering works with the non-interactive Agg backend, no display is required.
+    """
+
+    def __init__(self, max_days=3):
+        """
+        :param max_days: Maximum number of days shown in the energy bar chart
+        """
+        self.max_days = max_days
+        self.figure = matplotlib.figure.Figure(figsize=(12, 6))
+        self.power_axes, self.energy_axes = self.figure.subplots(1, 2, gridspec_kw={'width_ratios': [3, 1]})
+
+        a0 = self.power_axes
+        a1 = self.energy_axes
+        a0.xaxis_date()
+        a1.xaxis_date()
+
+        # plotting pvlib and fmi data
+        self.pvlib_line, = a0.plot([], [], label="Theoretical clear sky generation", c="#6ec8fa")
+        self.fmi_line, = a0.plot([], [], label="Weather model based generation", c="#303193")
+
+        # simulation runtime as vertical line
+        self.now_line, = a0.plot([], [], color="silver", linestyle='--')
+
+        # adding legend
+        a0.legend(loc='upper right')
+
+        # plot 0 labels
+        a0.set_ylabel("Power(W)")
+        a0.set_xlabel("Time(UTC)")
+
+        a1.set_xlabel("Date")
+        a1.set_ylabel("Energy(kWh)")
+
+        # titles, power generation title is replaced when rendering but it is needed for computing the layout
+        a0.set_title('Power generation')
+        a1.set_title('Energy generation')
+
+        # bars and kWh texts for every day, hidden until used
+        self.pvlib_bars = a1.bar(range(max_days), [0] * max_days, color="#6ec8fa")
+        self.fmi_bars = a1.bar(range(max_days), [0] * max_days, color="#303193")
+        self.texts = [a1.text(0, 0, "", ha="center", backgroundcolor="#FFFFFFd5") for i in range(max_days)]
+
+        # formatting plot 1 date axis
+        a0.xaxis.set_major_formatter(DateFormatter("%m-%d"))
+        a0.xaxis.set_minor_locator(matplotlib.dates.HourLocator(interval=4))
+        a0.xaxis.set_minor_formatter(DateFormatter("%H"))
+
+        # moves major axis to top of plot
+        a0.tick_params(axis="x", which="major", top=True, labeltop=True, bottom=False, labelbottom=False)
+
+        # shifts markers for days from midnight to near middle of power generation peaks
+        a0.xaxis.set_major_locator(matplotlib.dates.HourLocator(byhour=10))
+
+        # formatting plot 2 date axis so that 2023-11-23 is shown as 11-23 and markers are shown only once per day
+        a1.xaxis.set_major_formatter(DateFormatter("%m-%d"))
+        a1.xaxis.set_major_locator(matplotlib.dates.DayLocator(interval=1))
+
+        # layout is computed once, renders reuse it
+        self.figure.tight_layout()
+
+    def save(self, path):
+        self.figure.savefig(path)
+
+    def close(self):
+        self.figure.clear()
+
+
+def render_fmi_pvlib_mono(template, data_fmi, data_pvlib, savepath=None, site_name=None, now=None):
+    """
+    Draws fmi and pvlib output to a FigureTemplate and saves it as a .png file. Given dataframes are not modified.
+    :param template: FigureTemplate
+    :param data_fmi: Dataframe with time and output columns
+    :param data_pvlib: Dataframe with time and output columns
+    :param savepath: Output path, <config.save_directory><site name>-<date and time>.png by default
+    :param site_name: Site name shown in title and file name, config.site_name by default
+    :param now: Simulation runtime shown as vertical line, current UTC time by default
+    :return: Path of the saved file
+    """
+    if site_name is None:
+        site_name = config.site_name
+    if now is None:
+        now = datetime.utcnow()
 
     # TODO FIX TIMEZONE CONVERSION HERE
     # timezone adjustment, currently does not work
     finnish_time = pytz.timezone("Europe/Helsinki")
 
+    data_pvlib = data_pvlib[["time", "output"]].copy()
+    data_fmi = data_fmi[["time", "output"]].copy()
     data_pvlib["time"] = data_pvlib["time"].dt.tz_convert(finnish_time)
     data_fmi["time"] = data_fmi["time"].dt.tz_convert(finnish_time)
 
-    f, (a0, a1) = matplotlib.pyplot.subplots(1, 2, gridspec_kw={'width_ratios': [3, 1]}, figsize=(12, 6))
-
-    # plotting pvlib and fmi data
-    a0.plot(data_pvlib["time"], data_pvlib["output"], label="Theoretical clear sky generation", c="#6ec8fa")
-
     # removing leading and trailing power output is zero values from fmi open data based energy generation data
-    # Find the index of the first non-zero value
     start_index = data_fmi['output'].ne(0).idxmax()
-
-    # Find the index of the last non-zero value
     end_index = data_fmi['output'].ne(0)[::-1].idxmax()
-
-    # Extract the section of the DataFrame without leading and trailing zeros
     data_fmi = data_fmi.loc[start_index:end_index]
 
-    a0.plot(data_fmi["time"], data_fmi["output"],
-            label="Weather model based generation", c="#303193")
+    a0 = template.power_axes
+    a1 = template.energy_axes
+
+    # updating line data
+    template.pvlib_line.set_data(*downsampling.downsample(matplotlib.dates.date2num(data_pvlib["time"]),
+                                                          data_pvlib["output"].to_numpy(), config.plot_max_points))
+    template.fmi_line.set_data(*downsampling.downsample(matplotlib.dates.date2num(data_fmi["time"]),
+                                                       data_fmi["output"].to_numpy(), config.plot_max_points))
 
-    # adding legend
-    a0.legend(loc='upper right')
+    v_line_max = max(max(data_pvlib["output"]), max(data_fmi["output"]))
+    now_number = matplotlib.dates.date2num(now)
+    template.now_line.set_data([now_number, now_number], [0, v_line_max])
 
     #reading date from fmi data
     date_for_simulation = data_fmi.index[0].date()
-    now = datetime.utcnow()
     timestamp = str(date_for_simulation) + " " + str(now.time())[0:5]
+    a0.set_title('Power generation "' + site_name + "\" " + timestamp + "UTC")
 
-    # adding titles for both plots
-    a0.set_title('Power generation "' + config.site_name + "\" " + timestamp + "UTC")
-    a1.set_title('Energy generation')
-
-    # plot 0 labels
-    a0.set_ylabel("Power(W)")
-    a0.set_xlabel("Time(UTC)")
-
-    a1.set_xlabel("Date")
-    a1.set_ylabel("Energy(kWh)")
+    # calculating kwh sums for pvlib and fmi, energy is integrated from the timestamp spacing of each dataframe
+    pvlib_x, pvlib_y = __get_dayily_power_sums(data_pvlib)
+    fmi_x, fmi_y = __get_dayily_power_sums(data_fmi)
 
-    # calculating kwh sums for pvlib
-    pvlib_x, pvlib_y = __get_dayily_power_sums(data_pvlib, 15)
-
-    # calculating khw sums for fmi
-    fmi_x, fmi_y = __get_dayily_power_sums(data_fmi, 60)
-
-    # plotting kwh sums on second plot
-    a1.bar(pvlib_x, pvlib_y, color="#6ec8fa")
-    a1.bar(fmi_x, fmi_y, color="#303193")
-
-    # adding simulation runtime as vertical line
-    v_line_max = max(max(data_pvlib["output"]), max(data_fmi["output"]))
-    a0.plot([now, now], [0, v_line_max], color="silver", linestyle='--')
+    # updating bar heights and kWh texts, unused bars are hidden
+    __update_bars(template.pvlib_bars, pvlib_x, pvlib_y)
+    __update_bars(template.fmi_bars, fmi_x, fmi_y)
 
+    for i, text in enumerate(template.texts):
+        if i >= len(fmi_x) or i >= len(pvlib_y):
+            text.set_visible(False)
+            continue
 
-    # adding xxkWh (xx%) text to second plot
-    for i in range(len(fmi_x)):
-        pvlib_kwh = pvlib_y[i]
-        fmi_kwh = fmi_y[i]
-        fraction_kwh = fmi_kwh / pvlib_kwh
+        # adding xxkWh (xx%) text to second plot
+        fraction_kwh = fmi_y[i] / pvlib_y[i]
         percents = round(fraction_kwh * 100)
         txt = str(fmi_y[i]) + "kWh\n(" + str(percents) + "%)"
 
         # this mess here should make sure that kwh numbers do not overlap in bar charts. This shifts
         # text in y-axis if texts are too close
-        if i == 0:
-            a1.text(fmi_x[i], fmi_y[i] / 2, txt, ha="center", backgroundcolor="#FFFFFFd5")
+        new_y_position = fmi_y[i] / 2
         if i > 0:
             last_y_position = fmi_y[i - 1] / 2
-            new_y_position = fmi_y[i] / 2
 
             if last_y_position < new_y_position < last_y_position * 1.2:
                 new_y_position = last_y_position * 1.2
             if last_y_position > new_y_position > last_y_position * 0.8:
                 new_y_position = last_y_position * 0.8
 
-            a1.text(fmi_x[i], new_y_position, txt, ha="center", backgroundcolor="#FFFFFFd5")
+        text.set_text(txt)
+        text.set_position((matplotlib.dates.date2num(fmi_x[i]), new_y_position))
+        text.set_visible(True)
 
-    # formatting plot 1 date axis
-    a0.xaxis.set_major_formatter(DateFormatter("%m-%d"))
-    a0.xaxis.set_major_locator(matplotlib.dates.DayLocator(interval=1))
-    a0.xaxis.set_minor_locator(matplotlib.dates.HourLocator(interval=4))
-    a0.xaxis.set_minor_formatter(DateFormatter("%H"))
+    # rescaling axes to new data
+    for axes in (a0, a1):
+        axes.relim(visible_only=True)
+        axes.autoscale_view()
 
-    # moves major axis to top of plot
-    a0.tick_params(axis="x", which="major", top=True, labeltop=True, bottom=False, labelbottom=False)
+    # saving plot as .png -file
+    if savepath is None:
+        savepath = (config.save_directory + site_name + "-" + timestamp + ".png")
+    template.save(savepath)
 
-    # shifts markers for days from midnight to near middle of power generation peaks
-    shifter = matplotlib.dates.HourLocator(byhour=10)
-    a0.xaxis.set_major_locator(shifter)
+    return savepath
 
-    # formatting plot 2 date axis so that 2023-11-23 is shown as 11-23
-    formatter = DateFormatter("%m-%d")
-    a1.xaxis.set_major_formatter(formatter)
 
-    # formatting plot 2 date axis so that markers are shown only once per day
-    a1.xaxis.set_major_locator(matplotlib.dates.DayLocator(interval=1))
+def render_batch(jobs, processes=None, max_days=3):
+    """
+    Renders plot_fmi_pvlib_mono() style plots for many sites in parallel. Each worker process creates one
+    FigureTemplate and reuses it for all of its plots.
+    Example:
+    plotter.render_batch([{"data_fmi": fmi, "data_pvlib": pvlib, "site_name": name} for name, fmi, pvlib in sites])
+    :param jobs: List of dictionaries with render_fmi_pvlib_mono() arguments data_fmi, data_pvlib and optionally
+    savepath, site_name and now
+    :param processes: Worker process count, cpu count by default
+    :param max_days: Maximum number of days in one plot
+    :return: List of saved file paths in job order
+    """
+    if processes is None:
+        processes = os.cpu_count() or 1
 
-    # using tight graph layout to help with data density
-    f.tight_layout()
+    if processes == 1:
+        template = FigureTemplate(max_days)
+        paths = [render_fmi_pvlib_mono(template, **job) for job in jobs]
+        template.close()
+        return paths
 
-    # saving plot as .png -file
+    with ProcessPoolExecutor(max_workers=processes, initializer=__init_render_worker, initargs=(max_days,)) as executor:
+        return list(executor.map(__render_job, jobs, chunksize=max(1, len(jobs) // (4 * processes))))
 
-    savepath = (config.save_directory + config.site_name + "-" + timestamp + ".png")
-    matplotlib.pyplot.savefig(savepath)
-    print("Simulation plot saved as '" + savepath + "'")
 
-    #matplotlib.pyplot.show()
+# figure template of a render worker process
+__worker_template = None
 
 
-def __get_dayily_power_sums(data, resolution=config.data_resolution):
-    df = data[["time", "output"]].copy()
+def __init_render_worker(max_days):
+    global __worker_template
+    __worker_template = FigureTemplate(max_days)
 
-    df["date"] = pandas.to_datetime(df["time"]).dt.date
 
-    df = df.drop("time", axis=1)
-    df = df.groupby(["date"]).sum()
+def __render_job(job):
+    return render_fmi_pvlib_mono(__worker_template, **job)
 
-    df["output_kwh"] = (df["output"] / 1000) / (60 / resolution)
 
-    xvalues = []
-    yvalues = []
+def __update_bars(bars, x_values, y_values):
+    """
+    Moves bars to given dates and sets their heights, bars without values are hidden.
+    """
+    for i, bar in enumerate(bars):
+        if i < len(x_values):
+            bar.set_x(matplotlib.dates.date2num(x_values[i]) - bar.get_width() / 2)
+            bar.set_height(y_values[i])
+            bar.set_visible(True)
+        else:
+            bar.set_visible(False)
 
-    for index, row in df.iterrows():
-        x_value = datetime(index.year, index.month, index.day).date()
-        # x_value = data(index.year, index.month, index.day)
-        output = round(row["output_kwh"], 1)
 
-        # avoiding days with zero power,
-        if output > 0:
-            xvalues.append(x_value)
-            yvalues.append(output)
+def __get_dayily_power_sums(data):
+    """
+    Daily energy in kWh of local calendar days, rounded to 0.1 kWh. Days with zero energy are left out.
+    """
+    days, energy = energy_aggregation.daily_energy(data["time"], data["output"])
+    energy = numpy.round(energy, 1)
 
-    return xvalues, yvalues
+    # avoiding days with zero power,
+    produced = energy > 0
+    return [day.date() for day in days[produced]], list(energy[produced])
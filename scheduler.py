@@ -0,0 +1,382 @@
+"""
+Scheduler for the daily TMY export and the published forecasts of several sites.
+
+Runs once a day at config.scheduler_hour:config.scheduler_minute (local time of the machine), and once at start up to
+catch up missed runs. Every site has one run per day. Completed days are kept in a state file,
+config.scheduler_state_file, so runs missed while the machine was down or while fmi open was not reachable are run
+later:
+- the run of the current day fetches live fmi open data
+- runs of earlier days use recorded WFS responses or the forecast archive, see helpers/wfs_replay.py
+Days older than config.scheduler_catch_up_days are given up.
+
+Each run is a separate process which is terminated after config.scheduler_job_timeout seconds. Up to
+config.scheduler_workers sites are processed at the same time, runs of one site are always made one at a time in day
+order because they append to the same files.
+
+Forecasts are published every config.scheduler_forecast_hours hours, see publish_forecasts(). Each site gets new
+"fmi_output" and "pvlib_output" runs in the forecast archive covering config.scheduler_forecast_days days, which
+forecast_server.py and nowcast_service.py pick up. Forecast runs use the same processes, timeout and worker limit as
+the TMY export and are recorded in the state file as job "forecast".
+
+The state file is also the status file, for each site and job it contains:
+    done_days       days with a successful run inside the catch-up window
+    last_success    time of the last successful run
+    last_duration   duration of the last run in seconds
+    last_rows       rows appended by the last successful run
+    last_error      error of the last failed run, None after a successful run
+
+Example:
+python scheduler.py             # catch up and keep running
+python scheduler.py --once      # catch up and exit
+python scheduler.py --status    # print the state file
+"""
+
+import argparse
+import collections
+import datetime
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import time
+
+from apscheduler.schedulers.blocking import BlockingScheduler
+
+import config
+from helpers import forecast_archive
+from helpers import pipeline
+from helpers import site_parameters
+from helpers import solar_irradiance_estimator
+from helpers import tmy_writer
+from helpers import wfs_replay
+
+JOB_NAME = "tmy_export"
+FORECAST_JOB_NAME = "forecast"
+DAY_FORMAT = "%Y-%m-%d"
+
+
+def export_tmy_day(site, day, live):
+    """
+    Appends fmi open weather of a day and the following day to the TMY files of a site.
+    :param site: Dictionary of site parameters
+    :param day: Datetime, start of the day
+    :param live: True fetches from fmi open, False reads recorded responses or archived frames
+    :return: Number of appended rows, None if no data was found
+    """
+    if live:
+        data = solar_irradiance_estimator.get_solar_irradiance(day, day_count=2, model="fmiopen", site=site)
+    else:
+        data = wfs_replay.load_replay_frame(day, day + datetime.timedelta(days=2, minutes=-1), site["site_name"],
+                                            latitude=site["latitude"], longitude=site["longitude"])
+        if data is None:
+            return None
+
+    # only weather columns are needed, the plane of array, reflection, temperature and output steps are skipped
+    data = pipeline.process_irradiance(data, site, outputs=tmy_writer.INPUT_COLUMNS)
+    return sum(tmy_writer.append_frame(data, site).values())
+
+
+def due_days(entry, now=None):
+    """
+    Days which should have a run by now and do not have a successful one.
+    :param entry: State of one site, see load_state()
+    :param now: Datetime, current local time by default
+    :return: List of datetimes in day order
+    """
+    if now is None:
+        now = datetime.datetime.now()
+
+    today = datetime.datetime(now.year, now.month, now.day)
+    latest = today
+    if (now.hour, now.minute) < (config.scheduler_hour, config.scheduler_minute):
+        latest = today - datetime.timedelta(days=1)
+
+    # days before the site was first scheduled were never meant to be run
+    first = max(latest - datetime.timedelta(days=config.scheduler_catch_up_days - 1),
+                datetime.datetime.strptime(entry["first_day"], DAY_FORMAT))
+
+    done = set(entry["done_days"])
+    days = []
+    day = first
+    while day <= latest:
+        if day.strftime(DAY_FORMAT) not in done:
+            days.append(day)
+        day += datetime.timedelta(days=1)
+    return days
+
+
+def load_state(path=None):
+    """
+    :param path: State file, config.scheduler_state_file by default
+    :return: State dictionary {"sites": {site name: {job name: site state}}}, empty state if the file does not exist
+    """
+    if path is None:
+        path = config.scheduler_state_file
+    if not os.path.exists(path):
+        return {"sites": {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_state(state, path=None):
+    """
+    Writes the state file through a temporary file, a crash never leaves a half written state.
+    """
+    if path is None:
+        path = config.scheduler_state_file
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temporary = path + ".tmp"
+    with open(temporary, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(temporary, path)
+
+
+def run_due_jobs(site_names=None, state_path=None, now=None, workers=None, timeout=None):
+    """
+    Runs all due days of all sites and records results to the state file.
+    :param site_names: List of site names, config.scheduler_sites by default
+    :param state_path: State file, config.scheduler_state_file by default
+    :param now: Datetime used for deciding due days, current local time by default
+    :param workers: Number of sites processed at the same time, config.scheduler_workers by default
+    :param timeout: Seconds before a run is terminated, config.scheduler_job_timeout by default
+    :return: State dictionary
+    """
+    if site_names is None:
+        site_names = config.scheduler_sites
+    if now is None:
+        now = datetime.datetime.now()
+    if workers is None:
+        workers = config.scheduler_workers
+    if timeout is None:
+        timeout = config.scheduler_job_timeout
+    if workers < 1:
+        raise ValueError("scheduler needs at least one worker, got " + str(workers))
+
+    state = load_state(state_path)
+    today = datetime.datetime(now.year, now.month, now.day)
+
+    queues = {}
+    sites = {}
+    for name in site_names:
+        site = site_parameters.get_site(name)
+        if site is None:
+            continue
+        entry = state["sites"].setdefault(name, {}).setdefault(JOB_NAME, __new_entry(now))
+        days = due_days(entry, now)
+        if days:
+            sites[name] = site
+            queues[name] = collections.deque(days)
+
+    if queues:
+        print("Running " + str(sum(len(days) for days in queues.values())) + " due runs of " + str(len(queues))
+              + " sites at " + str(now))
+
+    __run_queues(queues, sites, JOB_NAME, lambda site, day: (export_tmy_day, (site, day, day == today)), state,
+                 state_path, workers, timeout, now)
+    return state
+
+
+def publish_forecasts(site, now=None):
+    """
+    Runs the whole pipeline for live fmi open data and clear sky irradiance from the start of the current day and
+    archives the results as the latest "fmi_output" and "pvlib_output" runs of the site. forecast_server.py and
+    nowcast_service.py serve and correct these runs.
+    :param site: Dictionary of site parameters
+    :param now: Datetime, current local time by default
+    :return: Number of archived fmi open rows
+    """
+    if now is None:
+        now = datetime.datetime.now()
+    today = datetime.datetime(now.year, now.month, now.day)
+
+    data = solar_irradiance_estimator.get_solar_irradiance(today, config.scheduler_forecast_days, model="fmiopen",
+                                                           site=site)
+    data = pipeline.process_irradiance(data, site)
+    forecast_archive.archive_frame(data, "fmi_output", site["site_name"])
+
+    clearsky = solar_irradiance_estimator.get_solar_irradiance(today, config.scheduler_forecast_days, model="pvlib",
+                                                               site=site)
+    forecast_archive.archive_frame(pipeline.process_irradiance(clearsky, site), "pvlib_output", site["site_name"])
+    return len(data)
+
+
+def run_forecast_jobs(site_names=None, state_path=None, now=None, workers=None, timeout=None):
+    """
+    Publishes new forecasts of all sites and records results to the state file, see publish_forecasts(). Arguments are
+    the same as in run_due_jobs().
+    :return: State dictionary
+    """
+    if site_names is None:
+        site_names = config.scheduler_sites
+    if now is None:
+        now = datetime.datetime.now()
+    if workers is None:
+        workers = config.scheduler_workers
+    if timeout is None:
+        timeout = config.scheduler_job_timeout
+    if workers < 1:
+        raise ValueError("scheduler needs at least one worker, got " + str(workers))
+
+    state = load_state(state_path)
+    today = datetime.datetime(now.year, now.month, now.day)
+
+    queues = {}
+    sites = {}
+    for name in site_names:
+        site = site_parameters.get_site(name)
+        if site is None:
+            continue
+        state["sites"].setdefault(name, {}).setdefault(FORECAST_JOB_NAME, __new_entry(now))
+        sites[name] = site
+        queues[name] = collections.deque([today])
+
+    if queues:
+        print("Publishing forecasts of " + str(len(queues)) + " sites at " + str(now))
+
+    __run_queues(queues, sites, FORECAST_JOB_NAME, lambda site, day: (publish_forecasts, (site, now)), state,
+                 state_path, workers, timeout, now)
+    return state
+
+
+def start():
+    """
+    Catches up missed runs and runs due jobs daily at config.scheduler_hour:config.scheduler_minute. Forecasts of all
+    sites are published at start up and every config.scheduler_forecast_hours hours.
+    """
+    run_due_jobs()
+    run_forecast_jobs()
+
+    scheduler = BlockingScheduler()
+    # a trigger missed because the machine was suspended is run late, the due days are read from the state file
+    scheduler.add_job(run_due_jobs, "cron", hour=config.scheduler_hour, minute=config.scheduler_minute,
+                      misfire_grace_time=None, coalesce=True, max_instances=1)
+    scheduler.add_job(run_forecast_jobs, "interval", hours=config.scheduler_forecast_hours, misfire_grace_time=None,
+                      coalesce=True, max_instances=1)
+    print("Scheduler is starting...")
+    scheduler.start()
+
+
+def print_status(state):
+    for name, jobs in state["sites"].items():
+        for job_name, entry in jobs.items():
+            print(name + " " + job_name + ": last success " + str(entry["last_success"]) + ", duration "
+                  + str(entry["last_duration"]) + " s, " + str(len(entry["done_days"])) + " days done"
+                  + ("" if entry["last_error"] is None else ", last error: " + entry["last_error"]))
+
+
+def __new_entry(now):
+    return {"first_day": now.strftime(DAY_FORMAT),
+            "done_days": [],
+            "last_attempt": None,
+            "last_success": None,
+            "last_duration": None,
+            "last_rows": None,
+            "last_error": None}
+
+
+def __run_queues(queues, sites, job_name, make_task, state, state_path, workers, timeout, now):
+    """
+    Runs queued days of sites in separate processes, one run per site at a time, and records each result.
+    :param queues: Dictionary {site name: deque of days}
+    :param make_task: Function (site, day) -> (function run in the process, its arguments)
+    """
+    active = {}
+    while queues or active:
+        # starting runs of sites which are not running, one run per site at a time
+        for name in list(queues):
+            if len(active) >= workers:
+                break
+            if name in active:
+                continue
+            day = queues[name].popleft()
+            if not queues[name]:
+                del queues[name]
+            task, args = make_task(sites[name], day)
+            active[name] = __start_run(task, args, day)
+
+        multiprocessing.connection.wait([run["process"].sentinel for run in active.values()], timeout=1)
+
+        for name, run in list(active.items()):
+            elapsed = time.monotonic() - run["started"]
+            if run["process"].is_alive():
+                if elapsed < timeout:
+                    continue
+                run["process"].terminate()
+                run["process"].join()
+                result = ("error", "timed out after " + str(timeout) + " s")
+            else:
+                run["process"].join()
+                result = run["receiver"].recv() if run["receiver"].poll() else \
+                    ("error", "exited with code " + str(run["process"].exitcode))
+            run["receiver"].close()
+            del active[name]
+
+            __record(state["sites"][name][job_name], run["day"], result, elapsed, now)
+            save_state(state, state_path)
+
+            day_text = run["day"].strftime(DAY_FORMAT)
+            if result[0] == "ok":
+                print("Site \"" + name + "\" " + day_text + ": " + str(result[1]) + " rows in "
+                      + "{:.1f}".format(elapsed) + " s")
+            else:
+                print("Error: site \"" + name + "\" " + day_text + ": " + result[1])
+
+
+def __start_run(task, args, day):
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=__run, args=(task, args, sender), daemon=True)
+    process.start()
+    sender.close()
+    return {"process": process, "receiver": receiver, "day": day, "started": time.monotonic()}
+
+
+def __run(task, args, sender):
+    """
+    Run in a separate process, sends ("ok", row count) or ("error", message) to the parent.
+    """
+    try:
+        rows = task(*args)
+        if rows is None:
+            sender.send(("error", "no recorded or archived fmi open data"))
+        else:
+            sender.send(("ok", rows))
+    except BaseException as e:
+        sender.send(("error", type(e).__name__ + ": " + str(e)))
+
+
+def __record(entry, day, result, duration, now):
+    """
+    Updates the state of a site after a run. Done days older than the catch-up window are dropped.
+    """
+    entry["last_attempt"] = datetime.datetime.now().isoformat(timespec="seconds")
+    entry["last_duration"] = round(duration, 2)
+
+    if result[0] == "ok":
+        oldest = (now - datetime.timedelta(days=config.scheduler_catch_up_days)).strftime(DAY_FORMAT)
+        done_days = set(done for done in entry["done_days"] if done >= oldest)
+        done_days.add(day.strftime(DAY_FORMAT))
+        entry["done_days"] = sorted(done_days)
+        entry["last_success"] = entry["last_attempt"]
+        entry["last_rows"] = result[1]
+        entry["last_error"] = None
+    else:
+        entry["last_error"] = result[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the daily TMY export and forecasts of all scheduled sites.")
+    parser.add_argument("--once", action="store_true", help="run due and missed days and exit")
+    parser.add_argument("--status", action="store_true", help="print last runs of each site and exit")
+    args = parser.parse_args()
+
+    if args.status:
+        print_status(load_state())
+    elif args.once:
+        run_due_jobs()
+        run_forecast_jobs()
+    else:
+        start()
+
+
+if __name__ == "__main__":
+    main()
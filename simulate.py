@@ -0,0 +1,87 @@
+"""
+Long simulations of one or more sites written into a memory mapped simulation store, see helpers/simulation_store.py.
+
+Days are simulated in chunks of config.simulation_chunk_days days at config.data_resolution, memory use does not grow
+with the length of the simulation. A stopped simulation continues where it was stopped when run again with the same
+arguments. A store of the same name with other sites or dates is only replaced with --replace. Existing stores are
+reopened with --report or --plot without --start, their results are read from the memory mapped arrays without
+simulating again.
+
+Example:
+python simulate.py --name helsinki_20y --sites helsinki --start 2004-01-01 --end 2023-12-31
+python simulate.py --name helsinki_20y --report month
+python simulate.py --name helsinki_20y --plot output/helsinki_20y.png
+"""
+
+import argparse
+import datetime
+
+import numpy
+
+import plotter
+from helpers import simulation_store
+
+
+def report(store, period):
+    """
+    Prints energy of each site over local calendar periods. Periods with rows which are not simulated are reported
+    without energy and left out of the total.
+    """
+    for site in store.sites():
+        starts, energy = store.aggregate_energy(site, period)
+        incomplete = numpy.isnan(energy)
+        print(site + ": " + "{:.1f}".format(energy[~incomplete].sum()) + " kWh in total"
+              + ("" if not incomplete.any() else ", " + str(incomplete.sum()) + " periods not fully simulated"))
+        for start, value in zip(starts, energy):
+            print("  " + start.strftime("%Y-%m-%d %H:%M") + " "
+                  + ("not fully simulated" if numpy.isnan(value) else "{:.1f}".format(value) + " kWh"))
+
+
+def plot(store, savepath):
+    """
+    Plots the output envelope of each site over the whole simulation.
+    """
+    plotter.init_plot()
+    for site in store.sites():
+        times, values = store.curve(site)
+        plotter.plot_curve(times, values, label=site)
+    plotter.format_long_time_axis()
+    plotter.add_label_y("Output (W)")
+    plotter.show_legend()
+    plotter.show_plot(savepath)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate sites over long periods into memory mapped arrays.")
+    parser.add_argument("--name", required=True, help="store name under config.simulation_directory")
+    parser.add_argument("--sites", nargs="+", default=None, help="site names, see helpers/site_parameters.py")
+    parser.add_argument("--start", default=None, help="first day, YYYY-MM-DD. Without it an existing store is read")
+    parser.add_argument("--end", default=None, help="last day, YYYY-MM-DD")
+    parser.add_argument("--model", default="pvlib", help="irradiance model, see solar_irradiance_estimator.py")
+    parser.add_argument("--report", default=None, choices=["hour", "day", "month"], help="print energy per period")
+    parser.add_argument("--plot", default=None, help="save an output plot to this path")
+    parser.add_argument("--replace", action="store_true",
+                        help="replace an existing store of the same name which has other sites or dates")
+    args = parser.parse_args()
+
+    if args.start is not None:
+        if args.end is None or args.sites is None:
+            print("Error: --start needs --end and --sites")
+            return
+        store = simulation_store.simulate(args.name, args.sites, datetime.datetime.strptime(args.start, "%Y-%m-%d"),
+                                          datetime.datetime.strptime(args.end, "%Y-%m-%d"), args.model,
+                                          overwrite=args.replace)
+    else:
+        store = simulation_store.open_store(args.name)
+    if store is None:
+        return
+
+    if args.report is not None:
+        report(store, args.report)
+    if args.plot is not None:
+        plotter.use_headless_backend()
+        plot(store, args.plot)
+
+
+if __name__ == "__main__":
+    main()
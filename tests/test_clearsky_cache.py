@@ -0,0 +1,33 @@
+"""
+Linke turbidity read from the memory mapped climatology matches pvlib.
+"""
+
+import numpy
+import pandas
+import pytest
+from pvlib import clearsky
+
+import config
+from helpers import clearsky_cache
+
+
+@pytest.mark.parametrize("latitude, longitude", [(60.2044, 24.9625), (62.8919, 27.6349), (-33.9, 18.4),
+                                                 (90, -180), (-90, 180), (0, 0)])
+def test_linke_turbidity_matches_pvlib(tmp_path, monkeypatch, latitude, longitude):
+    monkeypatch.setattr(config, "clearsky_cache_directory", str(tmp_path) + "/")
+    monkeypatch.setattr(clearsky_cache, "__turbidity_map", None)
+    monkeypatch.setattr(clearsky_cache, "__monthly_turbidity", {})
+
+    # a leap year and a common year, hourly in a timezone with daylight saving time
+    times = pandas.date_range("2023-12-25", "2024-12-31 23:00", freq="h", tz="Europe/Helsinki")
+
+    expected = clearsky.lookup_linke_turbidity(times, latitude, longitude)
+    turbidity = clearsky_cache.linke_turbidity(times, latitude, longitude)
+
+    assert turbidity.index.equals(times)
+    numpy.testing.assert_allclose(turbidity.to_numpy(), expected.to_numpy())
+
+
+def test_linke_turbidity_rejects_coordinates_out_of_range():
+    with pytest.raises(ValueError):
+        clearsky_cache.linke_turbidity(pandas.date_range("2024-01-01", periods=2, freq="D"), 91, 0)
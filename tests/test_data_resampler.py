@@ -0,0 +1,34 @@
+"""
+Resampling hourly fmi open data keeps the energy of the source.
+"""
+
+import numpy
+import pandas
+import pytest
+
+from helpers import data_resampler
+
+
+@pytest.mark.parametrize("resolution", [1, 5, 10, 15, 30, 60])
+def test_default_grid_preserves_energy(resolution):
+    # three hourly averages of 100 W/m2 centered at half hours, 300 Wh/m2 in total
+    times = pandas.date_range("2024-06-01 10:30", periods=3, freq="h", tz="UTC")
+    source = pandas.DataFrame({"time": times, "ghi": [100.0, 100.0, 100.0], "T": [15.0, 16.0, 17.0]})
+
+    resampled = data_resampler.resample_fmi_frame(source, resolution)
+
+    assert len(resampled) == 3 * 60 // resolution
+    assert resampled["time"].iloc[0] == pandas.Timestamp("2024-06-01 10:00", tz="UTC") + pandas.Timedelta(
+        minutes=resolution / 2)
+    assert not resampled["ghi"].isna().any()
+    assert resampled["ghi"].sum() * resolution / 60 == pytest.approx(300.0)
+
+
+def test_default_grid_preserves_energy_of_varying_values():
+    times = pandas.date_range("2024-06-01 04:30", periods=12, freq="h", tz="UTC")
+    ghi = numpy.array([0, 20, 80, 150, 300, 420, 500, 480, 390, 260, 120, 30], dtype=float)
+    source = pandas.DataFrame({"time": times, "ghi": ghi})
+
+    for method in ["linear", "pchip"]:
+        resampled = data_resampler.resample_fmi_frame(source, 15, method=method)
+        assert resampled["ghi"].sum() * 15 / 60 == pytest.approx(ghi.sum())
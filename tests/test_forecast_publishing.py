@@ -0,0 +1,36 @@
+"""
+Forecasts published by the scheduler are picked up by the forecast server cache.
+"""
+
+import datetime
+
+import config
+import forecast_server
+import scheduler
+from helpers import site_parameters
+from helpers import solar_irradiance_estimator
+
+
+def test_refresh_picks_up_published_forecast(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "archive_directory", str(tmp_path) + "/")
+    monkeypatch.setattr(config, "record_wfs_responses", False)
+
+    # clear sky irradiance stands in for fmi open data, the test does not need network access
+    get_solar_irradiance = solar_irradiance_estimator.get_solar_irradiance
+    monkeypatch.setattr(solar_irradiance_estimator, "get_solar_irradiance",
+                        lambda date_start, day_count, model="pvlib", site=None:
+                        get_solar_irradiance(date_start, day_count, "pvlib", site))
+
+    site = site_parameters.get_site("helsinki")
+    cache = forecast_server.ForecastCache(["helsinki"])
+    assert cache.refresh() == []
+
+    rows = scheduler.publish_forecasts(site, now=datetime.datetime(2024, 6, 1, 12))
+
+    assert rows > 0
+    assert sorted(cache.refresh()) == [("helsinki", "fmi_output"), ("helsinki", "pvlib_output")]
+    entry = cache.entries[("helsinki", "fmi_output")]
+    assert len(entry["times"]) == rows
+    assert entry["power"].max() > 0
+    # nothing new is loaded until the scheduler publishes again
+    assert cache.refresh() == []
@@ -0,0 +1,53 @@
+"""
+Power output of main.py matches the forecasts published by the scheduler for the same config.
+"""
+
+import datetime
+
+import numpy
+import pytest
+
+import config
+import main
+import scheduler
+from helpers import forecast_archive
+from helpers import site_parameters
+from helpers import solar_irradiance_estimator
+
+
+@pytest.fixture
+def shaded_site(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "archive_directory", str(tmp_path) + "/")
+    monkeypatch.setattr(config, "archive_forecasts", False)
+    monkeypatch.setattr(config, "record_wfs_responses", False)
+    monkeypatch.setattr(config, "scheduler_forecast_days", 1)
+    monkeypatch.setattr(config, "horizon_profile", [[90, 25], [180, 35], [270, 25]])
+    monkeypatch.setattr(config, "shading_obstacles", [{"azimuth": 200, "width": 30, "height": 18, "distance": 25}])
+    monkeypatch.setattr(config, "derate", 0.9)
+    monkeypatch.setattr(config, "air_temp_offset", 3)
+
+    # clear sky irradiance stands in for fmi open data, the test does not need network access
+    get_solar_irradiance = solar_irradiance_estimator.get_solar_irradiance
+    monkeypatch.setattr(solar_irradiance_estimator, "get_solar_irradiance",
+                        lambda date_start, day_count, model="pvlib", site=None:
+                        get_solar_irradiance(date_start, day_count, "pvlib", site))
+    return site_parameters.get_site_parameters()
+
+
+def test_main_matches_published_forecasts(shaded_site):
+    today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+    scheduler.publish_forecasts(shaded_site, now=today)
+
+    for kind, data in [("fmi_output", main.get_fmi_data(1, date_start=today)), ("pvlib_output", main.get_pvlib_data(1))]:
+        published = forecast_archive.read_archive(kind, config.site_name, columns=["output"])
+        assert data["output"].max() > 0
+        numpy.testing.assert_allclose(data["output"].to_numpy(), published["output"].to_numpy(), rtol=1e-6)
+
+
+def test_main_applies_shading(shaded_site, monkeypatch):
+    today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+    shaded = main.get_fmi_data(1, date_start=today)["output"].sum()
+    monkeypatch.setattr(config, "horizon_profile", [])
+    monkeypatch.setattr(config, "shading_obstacles", [])
+
+    assert shaded < main.get_fmi_data(1, date_start=today)["output"].sum()
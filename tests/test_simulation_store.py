@@ -0,0 +1,49 @@
+"""
+Simulation stores keep the energy of sources which are not on the store time grid.
+"""
+
+import datetime
+
+import numpy
+import pandas
+import pytest
+
+import config
+from helpers import simulation_store
+from helpers import solar_irradiance_estimator
+
+
+def test_hourly_source_at_half_hours_is_resampled_to_the_grid(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "data_resolution", 15)
+    monkeypatch.setattr(config, "clearsky_cache_directory", str(tmp_path / "clearsky") + "/")
+    get_solar_irradiance = solar_irradiance_estimator.get_solar_irradiance
+
+    def hourly(date_start, day_count, model="pvlib", site=None):
+        # hourly averages of clear sky irradiance stamped at the centers of the hours, like fmi open data
+        data = get_solar_irradiance(date_start, day_count, "pvlib", site).set_index("time")
+        data = data.resample("h").mean()
+        data.index = data.index + pandas.Timedelta(minutes=30)
+        return data.rename_axis(None).assign(time=data.index)[["time", "ghi", "dni", "dhi"]]
+
+    first, last = datetime.datetime(2024, 6, 1), datetime.datetime(2024, 6, 2)
+    reference = simulation_store.simulate("reference", ["helsinki"], first, last, root=str(tmp_path))
+    monkeypatch.setattr(solar_irradiance_estimator, "get_solar_irradiance", hourly)
+    store = simulation_store.simulate("hourly", ["helsinki"], first, last, root=str(tmp_path))
+
+    assert not numpy.isnan(store.column("output")).any()
+    _, expected = reference.aggregate_energy("helsinki", period="day", timezone="UTC")
+    _, energy = store.aggregate_energy("helsinki", period="day", timezone="UTC")
+    assert energy == pytest.approx(expected, rel=0.05)
+
+
+def test_periods_with_unwritten_rows_have_no_energy(tmp_path):
+    store = simulation_store.create_store("partial", ["helsinki"], datetime.datetime(2024, 6, 1),
+                                          datetime.datetime(2024, 6, 2, 23, 45), resolution=15, columns=["output"],
+                                          root=str(tmp_path))
+    times = pandas.date_range("2024-06-01", "2024-06-01 23:45", freq="15min", tz="UTC")
+    store.write(pandas.DataFrame({"time": times, "output": 1000.0}), "helsinki")
+
+    _, energy = store.aggregate_energy("helsinki", period="day", timezone="UTC")
+
+    assert energy[0] == pytest.approx(24.0)
+    assert numpy.isnan(energy[1])
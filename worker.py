@@ -0,0 +1,262 @@
+"""
+Long running worker which keeps the forecast code loaded between runs.
+
+Starting python and importing pandas, pvlib, matplotlib and apscheduler takes seconds, which dominates short ad hoc
+runs. The worker imports everything once, listens on the unix socket config.worker_socket and answers requests of
+worker_client.py. Between requests it keeps warm:
+- imported modules and the matplotlib figure template used for plots
+- clear sky days and the Linke turbidity climatology, see helpers/clearsky_cache.py
+- fetched fmi open frames, reused for config.worker_fmi_max_age seconds, at most config.worker_cache_entries frames
+- pipeline results of unchanged frames and site parameters, see helpers/result_cache.py
+
+Requests and responses are single lines of json:
+    {"command": "forecast", "args": {"site": "helsinki", "start": "2024-06-01", "days": 2, "model": "fmiopen"}}
+    {"ok": true, "result": {...}, "log": "printed output", "duration": 0.05}
+Commands:
+    ping        process id, uptime, number of handled requests and result cache statistics
+    forecast    power for each timestamp and daily energy, args site, start, days and model
+    plot        fmi open and clear sky plot saved as .png, args site, start, days, model and path
+    tmy         appends a day to the TMY files of a site, args site, day and live
+    clear       empties the caches
+    shutdown    stops the worker
+Requests are handled one at a time in arrival order, config values are shared by all requests.
+
+Example:
+python worker.py &
+python worker_client.py forecast --site helsinki --days 2
+"""
+
+import argparse
+import collections
+import contextlib
+import datetime
+import io
+import json
+import os
+import socket
+import socketserver
+import time
+
+import pandas
+
+import config
+import plotter
+import scheduler
+from helpers import astronomical_calculations
+from helpers import clearsky_cache
+from helpers import energy_aggregation
+from helpers import result_cache
+from helpers import site_parameters
+from helpers import solar_irradiance_estimator
+from helpers import tmy_writer
+
+# models which fetch data over the network, their frames are cached by the worker
+FETCHED_MODELS = ["meps", "fmi_open", "fmiopen"]
+
+
+class WorkerState:
+    """
+    Everything the worker keeps between requests.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.requests = 0
+        self.stopped = False
+        self.template = None
+        # fetched frames, key is (site name, model, start, days), value is (fetch time, dataframe)
+        self.frames = collections.OrderedDict()
+
+    def warm_up(self):
+        """
+        Loads what the first request would otherwise load.
+        """
+        plotter.use_headless_backend()
+        self.template = plotter.FigureTemplate()
+        clearsky_cache.turbidity_map()
+
+        today = start_of_today()
+        site = site_parameters.get_site_parameters()
+        solar_irradiance_estimator.get_solar_irradiance(today, 3, model="pvlib", site=site)
+        astronomical_calculations.get_solar_geometry(pandas.date_range(today, periods=2, freq="h", tz="UTC"))
+
+    def irradiance(self, site, start, days, model):
+        """
+        Irradiance frame of a site, fetched frames are reused while they are fresh.
+        """
+        if model not in FETCHED_MODELS:
+            return solar_irradiance_estimator.get_solar_irradiance(start, day_count=days, model=model, site=site)
+
+        key = (site["site_name"], model, start.isoformat(), days)
+        cached = self.frames.get(key)
+        if cached is not None and time.monotonic() - cached[0] < config.worker_fmi_max_age:
+            self.frames.move_to_end(key)
+            return cached[1].copy()
+
+        data = solar_irradiance_estimator.get_solar_irradiance(start, day_count=days, model=model, site=site)
+        self.frames[key] = (time.monotonic(), data)
+        self.frames.move_to_end(key)
+        while len(self.frames) > config.worker_cache_entries:
+            self.frames.popitem(last=False)
+        return data.copy()
+
+
+def handle_request(state, request):
+    """
+    Runs one request, printed output is captured and returned with the response.
+    :param state: WorkerState
+    :param request: Request dictionary with command and args
+    :return: Response dictionary
+    """
+    started = time.perf_counter()
+    log = io.StringIO()
+    state.requests += 1
+
+    try:
+        with contextlib.redirect_stdout(log):
+            result = run_command(state, request.get("command"), request.get("args") or {})
+        response = {"ok": True, "result": result}
+    except (Exception, SystemExit) as e:
+        # sys.exit() of helpers must not stop the worker
+        response = {"ok": False, "error": type(e).__name__ + ": " + str(e)}
+
+    response["log"] = log.getvalue()
+    response["duration"] = round(time.perf_counter() - started, 4)
+    return response
+
+
+def run_command(state, command, args):
+    """
+    :return: json serializable result of the command
+    """
+    match command:
+        case "ping":
+            return {"pid": os.getpid(),
+                    "uptime": round(time.monotonic() - state.started, 1),
+                    "requests": state.requests,
+                    "cached_frames": len(state.frames),
+                    "results": result_cache.statistics()}
+        case "forecast":
+            site, start, days = __request_site(args), __request_day(args.get("start")), int(args.get("days", 3))
+            model = args.get("model", "fmiopen")
+            data = result_cache.process_irradiance(state.irradiance(site, start, days, model), site)
+            day_starts, energy = energy_aggregation.daily_energy(data["time"], data["output"])
+            return {"site": site["site_name"],
+                    "model": model,
+                    "time": list(pandas.DatetimeIndex(data["time"]).tz_convert("UTC").strftime("%Y-%m-%dT%H:%M:%SZ")),
+                    "output": [None if pandas.isna(value) else value for value in data["output"].tolist()],
+                    "daily_energy": {day.strftime("%Y-%m-%d"): value for day, value in zip(day_starts, energy)}}
+        case "plot":
+            site, start, days = __request_site(args), __request_day(args.get("start")), int(args.get("days", 3))
+            model = args.get("model", "fmiopen")
+            data_fmi = result_cache.process_irradiance(state.irradiance(site, start, days, model), site)
+            data_pvlib = result_cache.process_irradiance(state.irradiance(site, start, days, "pvlib"), site)
+            # plots of past days mark their start instead of the current time, which would stretch the time axis
+            now = None if start >= start_of_today() else start
+            path = plotter.render_fmi_pvlib_mono(state.template, data_fmi, data_pvlib, savepath=args.get("path"),
+                                                 site_name=site["site_name"], now=now)
+            return {"path": path}
+        case "tmy":
+            site, day = __request_site(args), __request_day(args.get("day"))
+            if not args.get("live", True):
+                return {"rows": scheduler.export_tmy_day(site, day, live=False)}
+            # only weather columns are needed, see scheduler.export_tmy_day()
+            data = result_cache.process_irradiance(state.irradiance(site, day, 2, "fmiopen"), site,
+                                                   outputs=tmy_writer.INPUT_COLUMNS)
+            return {"rows": sum(tmy_writer.append_frame(data, site).values())}
+        case "clear":
+            state.frames.clear()
+            clearsky_cache.clear()
+            result_cache.clear()
+            return {}
+        case "shutdown":
+            state.stopped = True
+            return {}
+
+    raise ValueError("unknown command " + str(command))
+
+
+def serve(path=None):
+    """
+    Answers requests on a unix socket until a shutdown request.
+    """
+    if path is None:
+        path = config.worker_socket
+
+    state = WorkerState()
+    state.warm_up()
+
+    __remove_stale_socket(path)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                try:
+                    request = json.loads(line)
+                except ValueError as e:
+                    response = {"ok": False, "error": "invalid request: " + str(e)}
+                else:
+                    response = handle_request(state, request)
+                self.wfile.write(json.dumps(response).encode() + b"\n")
+                self.wfile.flush()
+                if state.stopped:
+                    break
+
+    with socketserver.UnixStreamServer(path, Handler) as server:
+        print("Worker " + str(os.getpid()) + " is ready on " + path)
+        try:
+            while not state.stopped:
+                server.handle_request()
+        finally:
+            os.remove(path)
+    print("Worker stopped after " + str(state.requests) + " requests")
+
+
+def start_of_today():
+    """
+    Naive datetime of the current local day start.
+    """
+    today = datetime.date.today()
+    return datetime.datetime(today.year, today.month, today.day)
+
+
+def __request_site(args):
+    name = args.get("site")
+    site = site_parameters.get_site_parameters() if name is None else site_parameters.get_site(name)
+    if site is None:
+        raise ValueError("unknown site " + str(name))
+    return site
+
+
+def __request_day(text):
+    if text is None:
+        return start_of_today()
+    return datetime.datetime.strptime(text, "%Y-%m-%d")
+
+
+def __remove_stale_socket(path):
+    """
+    Removes a socket file left by a worker which did not stop cleanly, a running worker is not replaced.
+    """
+    if not os.path.exists(path):
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(path)
+        except OSError:
+            os.remove(path)
+            return
+    raise SystemExit("Error: a worker is already running on " + path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep the forecast code loaded and answer worker_client.py requests.")
+    parser.add_argument("--socket", default=config.worker_socket, help="unix socket path")
+    args = parser.parse_args()
+
+    serve(args.socket)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Command line client of worker.py.
+
+Only standard library modules are imported, a request returns in the time the worker needs for it instead of the
+seconds needed for importing pandas, pvlib and matplotlib.
+
+Example:
+python worker_client.py ping
+python worker_client.py forecast --site helsinki --days 2
+python worker_client.py forecast --model pvlib --json > forecast.json
+python worker_client.py plot --site kuopio --path output/kuopio.png
+python worker_client.py tmy --site helsinki --day 2024-06-01 --recorded
+python worker_client.py shutdown
+"""
+
+import argparse
+import json
+import socket
+import sys
+
+import config
+
+
+def request(command, args=None, path=None, timeout=None):
+    """
+    Sends one request to the worker and waits for the response.
+    :param command: Command name, see worker.py
+    :param args: Optional dictionary of command arguments
+    :param path: Unix socket path, config.worker_socket by default
+    :param timeout: Optional seconds to wait for the response
+    :return: Response dictionary
+    """
+    if path is None:
+        path = config.worker_socket
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.settimeout(timeout)
+        connection.connect(path)
+        connection.sendall(json.dumps({"command": command, "args": args or {}}).encode() + b"\n")
+        with connection.makefile("rb") as reader:
+            line = reader.readline()
+
+    if not line:
+        return {"ok": False, "error": "worker closed the connection"}
+    return json.loads(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send requests to a running worker.py.")
+    parser.add_argument("command", choices=["ping", "forecast", "plot", "tmy", "clear", "shutdown"])
+    parser.add_argument("--site", default=None, help="site name, config.site_name by default")
+    parser.add_argument("--start", default=None, help="first day as YYYY-MM-DD, today by default")
+    parser.add_argument("--days", type=int, default=3, help="number of days")
+    parser.add_argument("--model", default="fmiopen", help="irradiance model of forecasts and plots")
+    parser.add_argument("--path", default=None, help="output path of plots")
+    parser.add_argument("--day", default=None, help="day of tmy export as YYYY-MM-DD, today by default")
+    parser.add_argument("--recorded", action="store_true", help="tmy export from recorded or archived data")
+    parser.add_argument("--json", action="store_true", help="print the whole response as json")
+    parser.add_argument("--socket", default=config.worker_socket, help="unix socket path")
+    args = parser.parse_args()
+
+    arguments = {"ping": {},
+                 "forecast": {"site": args.site, "start": args.start, "days": args.days, "model": args.model},
+                 "plot": {"site": args.site, "start": args.start, "days": args.days, "model": args.model,
+                          "path": args.path},
+                 "tmy": {"site": args.site, "day": args.day, "live": not args.recorded},
+                 "clear": {},
+                 "shutdown": {}}[args.command]
+
+    try:
+        response = request(args.command, {key: value for key, value in arguments.items() if value is not None},
+                           args.socket)
+    except (FileNotFoundError, ConnectionRefusedError):
+        print("Error: worker is not running on " + args.socket + ", start it with python worker.py")
+        sys.exit(1)
+
+    if args.json:
+        print(json.dumps(response))
+    else:
+        print(response["log"], end="")
+        if not response["ok"]:
+            print("Error: " + response["error"])
+        elif args.command == "forecast":
+            for day, energy in response["result"]["daily_energy"].items():
+                print(day + " " + "{:.1f}".format(energy) + " kWh")
+        else:
+            print(json.dumps(response["result"]))
+
+    sys.exit(0 if response["ok"] else 1)
+
+
+if __name__ == "__main__":
+    main()